@@ -0,0 +1,43 @@
+export interface SSEMessage {
+  event: string
+  data: any
+}
+
+/**
+ * Đọc response dạng Server-Sent Events từ fetch và gọi onMessage cho từng event.
+ * Dùng fetch thay vì EventSource vì các endpoint stream của backend là POST.
+ */
+export async function readSSE(response: Response, onMessage: (message: SSEMessage) => void) {
+  if (!response.body) {
+    throw new Error('Response has no body')
+  }
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+
+    let boundary = buffer.indexOf('\n\n')
+    while (boundary !== -1) {
+      const raw = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      boundary = buffer.indexOf('\n\n')
+
+      let event = 'message'
+      const dataLines: string[] = []
+      for (const line of raw.split('\n')) {
+        if (line.startsWith('event:')) {
+          event = line.slice(6).trim()
+        } else if (line.startsWith('data:')) {
+          dataLines.push(line.slice(5).trim())
+        }
+      }
+      if (dataLines.length) {
+        onMessage({ event, data: JSON.parse(dataLines.join('\n')) })
+      }
+    }
+  }
+}
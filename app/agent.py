@@ -1,62 +1,54 @@
-from typing import List, Dict, Any
+import asyncio
+from contextvars import ContextVar
+from typing import List, Dict, Any, AsyncIterator, Tuple
 from langchain.agents import Tool, AgentExecutor, create_react_agent
 from langchain_anthropic import ChatAnthropic
-from langchain.prompts import PromptTemplate
-from langchain.callbacks import StdOutCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import BasePromptTemplate
+from langchain_core.callbacks import AsyncCallbackHandler
 from .config import settings
+from .history import create_history_manager
+from .prompt_cache import CachedPrefixPromptTemplate, CachingChatAnthropic
+from .llm_gateway import LLMTimeoutError
+from .llm_scheduler import LLMBusyError
+from .metrics import agent_iterations
+from .streaming import ANSWER_RESET
+from .tracing import PARSE_ERROR_TOOL, TracingCallbackHandler, record_event
 
-# Biến lưu trữ bài tập hiện tại
-current_exercise = {
-    "description": "",
-    "example": "",
-    "example_output": "",
-    "explanation": "",
-    "function": "",
-    "unit_test": ""
-}
+# Lỗi do hệ thống quá tải hoặc quá hạn: trả về cho client (503/504/429) thay vì thử cách khác
+OVERLOAD_ERRORS = (LLMBusyError, LLMTimeoutError)
+
+# Các trường của bài tập được đưa vào prompt
+EXERCISE_FIELDS = ("description", "example", "example_output", "explanation", "function", "unit_test")
 
 # Tạo LLM
-llm = ChatAnthropic(
+llm = CachingChatAnthropic(
     model_name="claude-3-5-sonnet-20241022",
     anthropic_api_key=settings.ANTHROPIC_API_KEY,
     temperature=settings.ANTHROPIC_TEMPERATURE,
-    max_tokens=4096
+    max_tokens=4096,
+    call_site="agent"
 )
 
-# Prompt template cho chat thông thường
-CHAT_PROMPT_TEMPLATE = """Bạn là một AI tutor chuyên nghiệp về lập trình.
-Nhiệm vụ của bạn là giúp học viên học lập trình và giải quyết các vấn đề code. Bạn đang hướng dẫn một học viên làm bài tập của họ nên hãy giữ tôn trọng học viên và hướng dẫn họ một cách tốt nhất.
+# Cắt history theo token budget, tóm tắt phần cũ bằng cùng LLM
+history_manager = create_history_manager(llm)
 
-Bạn có quyền truy cập vào các công cụ sau:
-{tools}
-
-Các công cụ có sẵn: {tool_names}
+# LLM dùng cho các agent stream: bật streaming để callback nhận được từng token
+streaming_llm = CachingChatAnthropic(
+    model_name="claude-3-5-sonnet-20241022",
+    anthropic_api_key=settings.ANTHROPIC_API_KEY,
+    temperature=settings.ANTHROPIC_TEMPERATURE,
+    max_tokens=4096,
+    streaming=True,
+    call_site="agent_stream"
+)
 
-Lịch sử trò chuyện:
-{chat_history}
+# Các prompt được chia thành phần cố định đặt trước (được Anthropic cache) và phần
+# thay đổi theo từng lượt đặt sau. Thứ tự: hướng dẫn chung cho mọi học viên, bài tập
+# hiện tại, rồi lịch sử, câu hỏi và scratchpad của agent.
 
-Bài tập hiện tại:
-Mô tả: {description}
-Ví dụ:
-{example}
-Output:
-{example_output}
-Giải thích: {explanation}
-Hàm cần hoàn chỉnh:
-{function}
-Unit test:
-{unit_test}
-
-Khi phân tích và đưa ra quyết định, hãy:
-1. Đọc và hiểu yêu cầu của học viên.
-2. Xem xét ngữ cảnh từ lịch sử trò chuyện nếu có.
-3. Nếu học viên yêu cầu review, giải thích hoặc chỉnh sửa code của họ, hãy dùng read_code để đọc code từ sandbox.
-4. Nếu học viên hỏi về bài tập hiện tại:
-   - Giải thích yêu cầu bài tập một cách rõ ràng
-   - Cung cấp gợi ý phù hợp nếu học viên cần
-   - Kiểm tra code của học viên và đưa ra nhận xét
-5. Đừng bao giờ đưa code cho học viên, thay vào đó nếu học viên có hỏi về cách làm bài hãy cố gắng đưa ra những gợi ý mà bạn nghĩ là tốt nhất.
-6. LUÔN LUÔN tuân theo định dạng sau một cách chính xác:
+# Định dạng ReAct dùng chung cho agent chat và agent đánh giá code
+REACT_FORMAT_INSTRUCTIONS = """LUÔN LUÔN tuân theo định dạng sau một cách chính xác:
 
 Thought: suy nghĩ về những gì bạn sẽ làm
 Action: tên công cụ bạn sẽ sử dụng (nếu cần)
@@ -71,16 +63,46 @@ LƯU Ý QUAN TRỌNG:
 - Nếu không cần sử dụng công cụ, PHẢI kết thúc bằng Final Answer
 - KHÔNG được trả lời mà thiếu Thought ở đầu
 - KHÔNG được trả lời tự do không theo format
-- Khi trả lời có chứa code mẫu, PHẢI đặt code trong block ```python:copyable và kết thúc bằng ```. Ví dụ:
+"""
+
+CODE_BLOCK_INSTRUCTIONS = """- Khi trả lời có chứa code mẫu, PHẢI đặt code trong block ```python:copyable và kết thúc bằng ```. Ví dụ:
   ```python:copyable
   print("Hello World")
-  ```
+  ```"""
 
-Câu hỏi: {input}
-{agent_scratchpad}"""
+# Hướng dẫn cho agent chat
+CHAT_INSTRUCTIONS = """Bạn là một AI tutor chuyên nghiệp về lập trình.
+Nhiệm vụ của bạn là giúp học viên học lập trình và giải quyết các vấn đề code. Bạn đang hướng dẫn một học viên làm bài tập của họ nên hãy giữ tôn trọng học viên và hướng dẫn họ một cách tốt nhất.
+
+Bạn có quyền truy cập vào các công cụ sau:
+{tools}
+
+Các công cụ có sẵn: {tool_names}
+
+Khi phân tích và đưa ra quyết định, hãy:
+1. Đọc và hiểu yêu cầu của học viên.
+2. Xem xét ngữ cảnh từ lịch sử trò chuyện nếu có.
+3. Nếu học viên yêu cầu review, giải thích hoặc chỉnh sửa code của họ, hãy dùng read_code để đọc code từ sandbox.
+4. Nếu học viên hỏi về bài tập hiện tại:
+   - Giải thích yêu cầu bài tập một cách rõ ràng
+   - Cung cấp gợi ý phù hợp nếu học viên cần
+   - Kiểm tra code của học viên và đưa ra nhận xét
+5. Đừng bao giờ đưa code cho học viên, thay vào đó nếu học viên có hỏi về cách làm bài hãy cố gắng đưa ra những gợi ý mà bạn nghĩ là tốt nhất.
+6. """ + REACT_FORMAT_INSTRUCTIONS + CODE_BLOCK_INSTRUCTIONS
+
+# Tiêu chí nhận xét dùng chung cho hai cách đánh giá code
+CODE_REVIEW_GUIDELINES = """Đưa ra nhận xét:
+   - Nếu code chạy đúng:
+     + Khen ngợi học viên một cách cụ thể (ví dụ: cách giải quyết hay, code sạch, v.v.)
+     + Đề xuất cách tối ưu hóa nếu có
+     + Khuyến khích học viên tiếp tục phát triển
+   - Nếu code chưa đúng:
+     + Chỉ ra vấn đề một cách rõ ràng nhưng nhẹ nhàng
+     + Đưa ra gợi ý để học viên tự sửa (KHÔNG đưa đáp án)
+     + Động viên học viên cố gắng"""
 
-# Prompt template cho đánh giá code
-CODE_EVALUATION_PROMPT_TEMPLATE = """Bạn là một AI tutor chuyên nghiệp về lập trình.
+# Hướng dẫn cho agent đánh giá code
+CODE_EVALUATION_INSTRUCTIONS = """Bạn là một AI tutor chuyên nghiệp về lập trình.
 Nhiệm vụ của bạn là đánh giá code của học viên và đưa ra nhận xét phù hợp. Hãy giữ thái độ tích cực và khuyến khích học viên.
 
 Bạn có quyền truy cập vào các công cụ sau:
@@ -88,10 +110,28 @@ Bạn có quyền truy cập vào các công cụ sau:
 
 Các công cụ có sẵn: {tool_names}
 
-Lịch sử trò chuyện:
-{chat_history}
+Khi đánh giá code của học viên, hãy:
+1. Đọc code của học viên bằng công cụ read_code
+2. Đọc terminal output bằng công cụ read_terminal_output
+3. So sánh kết quả với yêu cầu bài tập
+4. """ + CODE_REVIEW_GUIDELINES + """
+5. """ + REACT_FORMAT_INSTRUCTIONS + CODE_BLOCK_INSTRUCTIONS
+
+# Hướng dẫn đánh giá code trong một lần gọi LLM: code và terminal output
+# đã có sẵn ở server nên được đưa thẳng vào prompt thay vì để agent gọi tool
+CODE_EVALUATION_SINGLE_SHOT_INSTRUCTIONS = """Bạn là một AI tutor chuyên nghiệp về lập trình.
+Nhiệm vụ của bạn là đánh giá code của học viên và đưa ra nhận xét phù hợp. Hãy giữ thái độ tích cực và khuyến khích học viên.
 
-Bài tập hiện tại:
+Khi đánh giá code của học viên, hãy:
+1. So sánh code và terminal output của học viên với yêu cầu bài tập
+2. """ + CODE_REVIEW_GUIDELINES + """
+3. Trả lời trực tiếp bằng nhận xét dành cho học viên, KHÔNG ghi Thought, Action hay Final Answer.
+
+LƯU Ý QUAN TRỌNG:
+""" + CODE_BLOCK_INSTRUCTIONS
+
+# Bài tập hiện tại: giống nhau ở mọi lượt của cùng một bài tập
+EXERCISE_TEMPLATE = """Bài tập hiện tại:
 Mô tả: {description}
 Ví dụ:
 {example}
@@ -101,140 +141,274 @@ Giải thích: {explanation}
 Hàm cần hoàn chỉnh:
 {function}
 Unit test:
-{unit_test}
+{unit_test}"""
 
-Khi đánh giá code của học viên, hãy:
-1. Đọc code của học viên bằng công cụ read_code
-2. Đọc terminal output bằng công cụ read_terminal_output
-3. So sánh kết quả với yêu cầu bài tập
-4. Đưa ra nhận xét:
-   - Nếu code chạy đúng:
-     + Khen ngợi học viên một cách cụ thể (ví dụ: cách giải quyết hay, code sạch, v.v.)
-     + Đề xuất cách tối ưu hóa nếu có
-     + Khuyến khích học viên tiếp tục phát triển
-   - Nếu code chưa đúng:
-     + Chỉ ra vấn đề một cách rõ ràng nhưng nhẹ nhàng
-     + Đưa ra gợi ý để học viên tự sửa (KHÔNG đưa đáp án)
-     + Động viên học viên cố gắng
-5. LUÔN LUÔN tuân theo định dạng sau một cách chính xác:
+# Phần thay đổi theo từng lượt
+REACT_SUFFIX_TEMPLATE = """Lịch sử trò chuyện:
+{chat_history}
 
-Thought: suy nghĩ về những gì bạn sẽ làm
-Action: tên công cụ bạn sẽ sử dụng (nếu cần)
-Action Input: input cho công cụ (nếu cần)
+Câu hỏi: {input}
+{agent_scratchpad}"""
 
-HOẶC
+CODE_EVALUATION_SINGLE_SHOT_SUFFIX_TEMPLATE = """Lịch sử trò chuyện:
+{chat_history}
 
-Final Answer: câu trả lời cuối cùng (hãy tổng hợp lại toàn bộ câu trả lời của bạn từ đầu bao gồm cả Thought)
+Code của học viên:
+{code}
 
-LƯU Ý QUAN TRỌNG:
-- Nếu bạn cần sử dụng công cụ, PHẢI có cả Action và Action Input
-- Nếu không cần sử dụng công cụ, PHẢI kết thúc bằng Final Answer
-- KHÔNG được trả lời mà thiếu Thought ở đầu
-- KHÔNG được trả lời tự do không theo format
-- Khi trả lời có chứa code mẫu, PHẢI đặt code trong block ```python:copyable và kết thúc bằng ```. Ví dụ:
-  ```python:copyable
-  print("Hello World")
-  ```
+{terminal_output}
 
 Câu hỏi: {input}
-{agent_scratchpad}"""
+"""
 
 # Prompt objects
-chat_prompt = PromptTemplate(
-    template=CHAT_PROMPT_TEMPLATE,
-    input_variables=["input", "tools", "tool_names", "agent_scratchpad", "chat_history", 
-                    "description", "example", "example_output", "explanation", "function", "unit_test"]
+chat_prompt = CachedPrefixPromptTemplate.from_templates(
+    [CHAT_INSTRUCTIONS, EXERCISE_TEMPLATE], REACT_SUFFIX_TEMPLATE
 )
 
-code_evaluation_prompt = PromptTemplate(
-    template=CODE_EVALUATION_PROMPT_TEMPLATE,
-    input_variables=["input", "tools", "tool_names", "agent_scratchpad", "chat_history", 
-                    "description", "example", "example_output", "explanation", "function", "unit_test"]
+code_evaluation_prompt = CachedPrefixPromptTemplate.from_templates(
+    [CODE_EVALUATION_INSTRUCTIONS, EXERCISE_TEMPLATE], REACT_SUFFIX_TEMPLATE
 )
 
-# Hàm format lịch sử trò chuyện (nếu dùng)
-def format_chat_history(history: List[Dict[str, Any]]) -> str:
-    if not history:
-        return "Chưa có lịch sử trò chuyện."
-    formatted = []
-    for msg in history:
-        role = "Học viên" if msg.get("role") == "user" else "Tutor"
-        formatted.append(f"{role}: {msg.get('content', '')}")
-    return "\n".join(formatted)
-
-def get_agent_response(message: str, code: str = None, history: List[Dict[str, Any]] = None, terminal_output: str = None, exercise: Dict[str, str] = None, is_code_evaluation: bool = False) -> str:
+code_evaluation_single_shot_prompt = CachedPrefixPromptTemplate.from_templates(
+    [CODE_EVALUATION_SINGLE_SHOT_INSTRUCTIONS, EXERCISE_TEMPLATE], CODE_EVALUATION_SINGLE_SHOT_SUFFIX_TEMPLATE
+)
+
+# Code và terminal output của request đang xử lý, để các tool dùng chung đọc
+_request_context: ContextVar[Dict[str, Any]] = ContextVar("agent_request_context", default={})
+
+def format_code(code: str = None) -> str:
+    if code:
+        return f"```python\n{code.strip()}\n```"
+    return "Không có code nào trong sandbox để đọc."
+
+def format_terminal_output(terminal_output: str = None) -> str:
+    if terminal_output:
+        return f"Terminal Output:\n```\n{terminal_output.strip()}\n```"
+    return "Không có terminal output nào để đọc."
+
+def read_code(input_str=None) -> str:
+    # Bỏ qua input_str, luôn trả về code của request hiện tại nếu có
+    return format_code(_request_context.get().get("code"))
+
+def read_terminal_output(input_str=None) -> str:
+    # Bỏ qua input_str, luôn trả về terminal output của request hiện tại nếu có
+    return format_terminal_output(_request_context.get().get("terminal_output"))
+
+tools = [
+    Tool(
+        name="read_code",
+        func=read_code,
+        description="Đọc code từ sandbox của học viên. Trả về code dưới dạng markdown Python block."
+    ),
+    Tool(
+        name="read_terminal_output",
+        func=read_terminal_output,
+        description="Đọc terminal output từ lần chạy code gần nhất của học viên. Trả về output dưới dạng markdown code block."
+    )
+]
+
+def build_executor(prompt: BasePromptTemplate, agent_llm: ChatAnthropic = None) -> AgentExecutor:
+    """Create a ReAct agent executor for `prompt` using the shared tools and `agent_llm` (default: `llm`)."""
+    agent = create_react_agent(
+        llm=agent_llm or llm,
+        tools=tools,
+        prompt=prompt
+    )
+    return AgentExecutor.from_agent_and_tools(
+        agent=agent,
+        tools=tools,
+        handle_parsing_errors=True,
+        max_iterations=5,
+        return_intermediate_steps=True
+    )
+
+# Agent được tạo một lần khi khởi động, mỗi request chỉ truyền ngữ cảnh riêng của nó
+chat_executor = build_executor(chat_prompt)
+code_evaluation_executor = build_executor(code_evaluation_prompt)
+chat_stream_executor = build_executor(chat_prompt, streaming_llm)
+code_evaluation_stream_executor = build_executor(code_evaluation_prompt, streaming_llm)
+
+class FinalAnswerStreamHandler(AsyncCallbackHandler):
+    """
+    Forwards the tokens of the agent's Final Answer to a queue as they are generated.
+
+    Thought/Action steps are held back; streaming starts once "Final Answer:"
+    shows up in the current LLM call. If the output parser then rejects the
+    step (the executor retries it through the parse error tool), an
+    `ANSWER_RESET` is queued so the client drops the answer streamed so far.
+    """
+
+    MARKER = "Final Answer:"
+    ACTION_MARKER = "Action:"
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+        self.streamed = False
+        self._buffer = ""
+        self._in_final_answer = False
+
+    async def on_chat_model_start(self, *args, **kwargs) -> None:
+        self._buffer = ""
+        self._in_final_answer = False
+
+    async def on_llm_start(self, *args, **kwargs) -> None:
+        self._buffer = ""
+        self._in_final_answer = False
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if not self._in_final_answer:
+            self._buffer += token
+            index = self._buffer.find(self.MARKER)
+            # Bước vừa có Action vừa có Final Answer sẽ bị parser từ chối, không stream
+            if index == -1 or self.ACTION_MARKER in self._buffer[:index]:
+                return
+            self._in_final_answer = True
+            token = self._buffer[index + len(self.MARKER):]
+        # Bỏ khoảng trắng ngay sau "Final Answer:" trước khi gửi token đầu tiên
+        if not self.streamed:
+            token = token.lstrip()
+            if not token:
+                return
+            self.streamed = True
+        await self.queue.put(token)
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs) -> None:
+        # Parser không chấp nhận bước có Final Answer vừa stream, agent sẽ trả lời lại
+        if serialized.get("name") == PARSE_ERROR_TOOL and self.streamed:
+            self.streamed = False
+            await self.queue.put(ANSWER_RESET)
+
+def _build_evaluation_prompt(message: str, code: str, terminal_output: str, chat_history_str: str, exercise: Dict[str, str]) -> List[BaseMessage]:
+    return code_evaluation_single_shot_prompt.format_messages(
+        input=message,
+        chat_history=chat_history_str,
+        code=format_code(code),
+        terminal_output=format_terminal_output(terminal_output),
+        **exercise
+    )
+
+async def evaluate_code_single_shot(message: str, code: str, terminal_output: str, chat_history_str: str, exercise: Dict[str, str]) -> str:
+    """Evaluate the student's code with one LLM call, putting code and terminal output straight into the prompt."""
+    prompt = _build_evaluation_prompt(message, code, terminal_output, chat_history_str, exercise)
+    response = await llm.ainvoke(prompt, config={"callbacks": [TracingCallbackHandler()]})
+    content = response.content if hasattr(response, "content") else str(response)
+    if not content.strip():
+        raise ValueError("LLM trả về câu trả lời rỗng")
+    return content
+
+def agent_name(is_code_evaluation: bool) -> str:
+    return "code_evaluation" if is_code_evaluation else "chat"
+
+async def _prepare_request(history: List[Dict[str, Any]], exercise: Dict[str, str], session_id: str = None) -> Tuple[str, Dict[str, str]]:
+    """Fit the chat history into its token budget and pick the exercise fields, returning both as prompt inputs."""
+    # History được cắt theo budget, phần cũ được thay bằng bản tóm tắt của session
+    chat_history_str = await history_manager.build(history, session_id)
+    exercise = exercise or {}
+    exercise_variables = {key: exercise.get(key, "") for key in EXERCISE_FIELDS}
+    return chat_history_str, exercise_variables
+
+async def get_agent_response(message: str, code: str = None, history: List[Dict[str, Any]] = None, terminal_output: str = None, exercise: Dict[str, str] = None, is_code_evaluation: bool = False, session_id: str = None) -> str:
+    """
+    Get the tutor's answer without blocking the event loop.
+
+    LLM calls go through `ainvoke`, so concurrent requests overlap while
+    waiting on the API instead of running one after another.
+    """
     try:
-        # Format history nếu có
-        chat_history_str = format_chat_history(history) if history else "Chưa có lịch sử trò chuyện."
-
-        # Cập nhật current_exercise nếu có
-        global current_exercise
-        if exercise:
-            current_exercise.update(exercise)
-
-        # Closure để giữ biến code và terminal_output
-        def read_code_with_input(input_str=None):
-            # Bỏ qua input_str, luôn trả về code nếu có
-            if code:
-                return f"```python\n{code.strip()}\n```"
-            return "Không có code nào trong sandbox để đọc."
-
-        def read_terminal_output(input_str=None):
-            # Bỏ qua input_str, luôn trả về terminal output nếu có
-            if terminal_output:
-                return f"Terminal Output:\n```\n{terminal_output.strip()}\n```"
-            return "Không có terminal output nào để đọc."
-
-        tools = [
-            Tool(
-                name="read_code",
-                func=read_code_with_input,
-                description="Đọc code từ sandbox của học viên. Trả về code dưới dạng markdown Python block."
-            ),
-            Tool(
-                name="read_terminal_output",
-                func=read_terminal_output,
-                description="Đọc terminal output từ lần chạy code gần nhất của học viên. Trả về output dưới dạng markdown code block."
-            )
-        ]
-
-        # Chọn prompt phù hợp
-        prompt = code_evaluation_prompt if is_code_evaluation else chat_prompt
-
-        agent = create_react_agent(
-            llm=llm,
-            tools=tools,
-            prompt=prompt
-        )
-
-        executor = AgentExecutor.from_agent_and_tools(
-            agent=agent,
-            tools=tools,
-            verbose=True,
-            handle_parsing_errors=True,
-            max_iterations=5,
-            return_intermediate_steps=True,
-            callbacks=[StdOutCallbackHandler()]
-        )
-
-        # Gửi input và các thông tin cần thiết
-        response = executor.invoke({
-            "input": message,
-            "tools": "\n".join([f"{tool.name}: {tool.description}" for tool in tools]),
-            "tool_names": [tool.name for tool in tools],
-            "chat_history": chat_history_str,
-            "description": current_exercise["description"],
-            "example": current_exercise["example"],
-            "example_output": current_exercise["example_output"],
-            "explanation": current_exercise["explanation"],
-            "function": current_exercise["function"],
-            "unit_test": current_exercise["unit_test"],
-            "agent_scratchpad": ""
-        })
+        chat_history_str, exercise_variables = await _prepare_request(history, exercise, session_id)
+
+        # Đánh giá code trong một lần gọi LLM, nếu lỗi thì quay về agent ReAct
+        if is_code_evaluation and settings.CODE_EVALUATION_MODE == "single_shot":
+            try:
+                return await evaluate_code_single_shot(message, code, terminal_output, chat_history_str, exercise_variables)
+            except OVERLOAD_ERRORS:
+                raise
+            except Exception as e:
+                record_event("single_shot_fallback", "fallback", e)
+
+        # Chọn agent phù hợp
+        executor = code_evaluation_executor if is_code_evaluation else chat_executor
+
+        token = _request_context.set({"code": code, "terminal_output": terminal_output})
+        try:
+            # Gửi input và các thông tin cần thiết
+            response = await executor.ainvoke({
+                "input": message,
+                "chat_history": chat_history_str,
+                **exercise_variables
+            }, config={"callbacks": [TracingCallbackHandler()]})
+        finally:
+            _request_context.reset(token)
+        agent_iterations.observe(len(response["intermediate_steps"]), agent=agent_name(is_code_evaluation))
 
         # Thêm metadata cho code blocks
         output = response["output"]
         return output
 
+    except OVERLOAD_ERRORS:
+        raise
     except Exception as e:
         return f"Xin lỗi, đã có lỗi xảy ra: {str(e)}"
+
+async def stream_agent_response(message: str, code: str = None, history: List[Dict[str, Any]] = None, terminal_output: str = None, exercise: Dict[str, str] = None, is_code_evaluation: bool = False, session_id: str = None) -> AsyncIterator[str]:
+    """
+    Streaming variant of `get_agent_response` that yields the answer token by token.
+
+    For the ReAct agent only the Final Answer is streamed, after the last
+    Thought/Action step.
+    """
+    try:
+        chat_history_str, exercise_variables = await _prepare_request(history, exercise, session_id)
+
+        if is_code_evaluation and settings.CODE_EVALUATION_MODE == "single_shot":
+            prompt = _build_evaluation_prompt(message, code, terminal_output, chat_history_str, exercise_variables)
+            streamed = False
+            try:
+                async for chunk in llm.astream(prompt, config={"callbacks": [TracingCallbackHandler()]}):
+                    if chunk.content:
+                        streamed = True
+                        yield chunk.content
+            except OVERLOAD_ERRORS:
+                raise
+            except Exception as e:
+                # Đã gửi một phần câu trả lời thì không thể chuyển sang agent được nữa
+                if streamed:
+                    raise
+                record_event("single_shot_fallback", "fallback", e)
+            if streamed:
+                return
+
+        executor = code_evaluation_stream_executor if is_code_evaluation else chat_stream_executor
+        queue: asyncio.Queue = asyncio.Queue()
+        handler = FinalAnswerStreamHandler(queue)
+
+        # Task copy context tại thời điểm tạo nên tool trong agent vẫn đọc được code của request này
+        token = _request_context.set({"code": code, "terminal_output": terminal_output})
+        task = asyncio.create_task(executor.ainvoke(
+            {"input": message, "chat_history": chat_history_str, **exercise_variables},
+            config={"callbacks": [handler, TracingCallbackHandler()]}
+        ))
+        _request_context.reset(token)
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+
+        try:
+            while True:
+                text = await queue.get()
+                if text is None:
+                    break
+                yield text
+        finally:
+            if not task.done():
+                task.cancel()
+
+        response = task.result()
+        agent_iterations.observe(len(response["intermediate_steps"]), agent=agent_name(is_code_evaluation))
+        # Agent kết thúc mà không có "Final Answer:" (ví dụ hết số vòng lặp) thì gửi output cuối cùng
+        if not handler.streamed:
+            yield response["output"]
+
+    except OVERLOAD_ERRORS:
+        raise
+    except Exception as e:
+        yield f"Xin lỗi, đã có lỗi xảy ra: {str(e)}"
@@ -1,15 +1,12 @@
 import os
 from typing import List
-import markdown2
-from pygments import highlight
-from pygments.formatters import HtmlFormatter
-from pygments.lexers import get_lexer_by_name
-import re
 
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langchain_openai import ChatOpenAI
 
 from .config import settings
+from .llm_gateway import llm_gateway
+from .rendering import renderer
 
 # Validate settings on module load
 settings.validate()
@@ -33,31 +30,17 @@ Hãy trả lời bằng tiếng Việt và sử dụng Markdown. Sử dụng cod
 chat = ChatOpenAI(
     model=settings.OPENAI_MODEL,
     temperature=settings.OPENAI_TEMPERATURE,
-    openai_api_key=settings.OPENAI_API_KEY
+    openai_api_key=settings.OPENAI_API_KEY,
+    # Dùng connection pool của gateway; retry do gateway xử lý
+    http_client=llm_gateway.sync_http_client,
+    http_async_client=llm_gateway.http_client,
+    max_retries=0
 )
 
 def process_code_blocks(content: str) -> str:
     """Process code blocks with syntax highlighting."""
-    def replace_code_block(match):
-        language = match.group(1) or 'python'  # Default to python if no language specified
-        code = match.group(2)
-        
-        try:
-            lexer = get_lexer_by_name(language)
-            formatter = HtmlFormatter(style='monokai')
-            highlighted = highlight(code, lexer, formatter)
-            return highlighted
-        except:
-            # If language isn't supported, return original code block
-            return f'<pre><code class="{language}">{code}</code></pre>'
-    
-    # Replace ```language\ncode``` blocks
-    pattern = r'```(\w+)?\n(.*?)```'
-    content = re.sub(pattern, replace_code_block, content, flags=re.DOTALL)
-    
-    # Convert remaining Markdown to HTML
-    content = markdown2.markdown(content)
-    return content
+    # Formatter, lexer và HTML đã render được cache trong renderer dùng chung
+    return renderer.render_markdown(content)
 
 def get_chat_response(message: str, code: str = None, history: List[dict] = None) -> str:
     """Get response from the chat model."""
@@ -79,7 +62,7 @@ def get_chat_response(message: str, code: str = None, history: List[dict] = None
     messages.append(HumanMessage(content=message))
     
     # Get response from the model
-    response = chat(messages)
+    response = llm_gateway.call_sync("chat", lambda: chat.invoke(messages))
     
     # Process markdown and code blocks
     return process_code_blocks(response.content) 
\ No newline at end of file
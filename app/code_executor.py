@@ -1,39 +1,168 @@
-import sys
-import io
-from contextlib import redirect_stdout, redirect_stderr
-import traceback
+import ast
+import hashlib
+import marshal
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple, Union
+
+from .cache import LRUCache
+from .config import settings
+from .sandbox import sandbox_pool, SandboxError
+from .test_harness import summarize, discover_test_methods, merge_reports
+
+# Code object đã compile (dạng marshal), key theo hash của source nguyên văn để traceback
+# của học viên luôn đúng số dòng
+compile_cache = LRUCache(settings.EXECUTION_CACHE_SIZE, settings.EXECUTION_CACHE_TTL)
+
+# Kết quả unit test, key theo (hash code đã chuẩn hóa, hash unit test, chạy song song hay không).
+# Chỉ lưu kết quả pass/fail không phụ thuộc vào source nguyên văn (xem `_is_cacheable`)
+test_result_cache = LRUCache(settings.EXECUTION_CACHE_SIZE, settings.EXECUTION_CACHE_TTL)
+
+# Thread dùng để gửi song song các nhóm test method tới nhiều sandbox worker
+_test_fanout = ThreadPoolExecutor(max_workers=settings.SANDBOX_WORKERS, thread_name_prefix="test-fanout")
+
+# Module và builtin làm kết quả thay đổi giữa các lần chạy cùng một code
+NONDETERMINISTIC_MODULES = {
+    "random", "time", "datetime", "secrets", "uuid", "os", "sys", "threading", "multiprocessing",
+    "asyncio", "socket", "subprocess", "urllib", "http", "requests",
+}
+NONDETERMINISTIC_BUILTINS = {"id", "hash", "input", "open", "__import__", "eval", "exec"}
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def normalize_code(code: str) -> Tuple[str, Optional[ast.AST]]:
+    """
+    Hash code by its AST so whitespace and comment changes map to the same key.
+
+    Returns the hash and the parsed tree; code that does not parse is hashed
+    as raw text and returned with no tree.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        # Code lồng quá sâu hoặc quá lớn vẫn được gửi nguyên văn để sandbox báo lỗi cho học viên
+        return _sha256(code), None
+    return _sha256(ast.dump(tree)), tree
+
+def is_deterministic(tree: Optional[ast.AST]) -> bool:
+    """Whether code imports nothing from `NONDETERMINISTIC_MODULES` and calls none of `NONDETERMINISTIC_BUILTINS`."""
+    if tree is None:
+        return False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules = [node.module or ""]
+        elif isinstance(node, ast.Name):
+            if node.id in NONDETERMINISTIC_BUILTINS:
+                return False
+            continue
+        else:
+            continue
+        if any(module.split(".")[0] in NONDETERMINISTIC_MODULES for module in modules):
+            return False
+    return True
+
+def compile_cached(code: str) -> Union[str, bytes]:
+    """
+    Return the marshalled code object for `code`, compiling only on a cache miss.
+
+    The cache is keyed on the exact source, so line numbers in tracebacks
+    always match what the student submitted. Source that does not compile is
+    returned unchanged so the worker reports the error.
+    """
+    key = _sha256(code)
+    compiled = compile_cache.get(key)
+    if compiled is None:
+        try:
+            compiled = marshal.dumps(compile(code, "<string>", "exec"))
+        except (SyntaxError, ValueError, RecursionError, MemoryError):
+            return code
+        compile_cache.set(key, compiled)
+    return compiled
 
 def run_python_code(code: str, namespace: dict = None) -> str:
     """
     Safely execute Python code and return the output.
-    
+
+    The code runs in a warm sandbox worker process so a slow or crashing
+    submission cannot stall the API process.
+
     Args:
         code (str): Python code to execute
         namespace (dict): Namespace for the code execution
-        
+
     Returns:
         str: Output of the code execution or error message
     """
-    # Redirect stdout to capture print statements
-    old_stdout = sys.stdout
-    redirected_output = sys.stdout = io.StringIO()
-    
     try:
-        # Create a new namespace if none is provided
-        if namespace is None:
-            namespace = {}
-        
-        # Add builtins to namespace
-        namespace.update({'__builtins__': __builtins__})
-        
-        # Execute code with the provided namespace
-        exec(code, namespace)
-        sys.stdout = old_stdout
-        return redirected_output.getvalue()
-    except Exception as e:
-        sys.stdout = old_stdout
-        return f"Error executing code:\n{traceback.format_exc()}"
-        
-    finally:
-        # Clean up
-        redirected_output.close() 
\ No newline at end of file
+        return sandbox_pool.run(compile_cached(code), namespace)
+    except SandboxError as e:
+        return f"Error executing code:\n{e}"
+
+def stream_python_code(code: str, on_chunk) -> str:
+    """
+    Execute Python code, passing stdout/stderr chunks to `on_chunk(stream, text)` as they are produced.
+
+    Returns:
+        str: Timeout or crash message, or an empty string if the run finished normally
+    """
+    try:
+        return sandbox_pool.run(compile_cached(code), on_chunk=on_chunk)
+    except SandboxError as e:
+        return f"Error executing code:\n{e}"
+
+def _run_tests_in_parallel(code: str, unit_test: str, test_names: List[str]) -> dict:
+    """Split test methods across sandbox workers, run the groups concurrently and merge the reports."""
+    group_count = min(len(test_names), sandbox_pool.size)
+    groups = [test_names[i::group_count] for i in range(group_count)]
+    futures = [_test_fanout.submit(sandbox_pool.run_unit_tests, code, unit_test, group) for group in groups]
+    return merge_reports([future.result() for future in futures], test_names)
+
+def run_unit_tests(code: str, unit_test: str, parallel: bool = False) -> dict:
+    """
+    Run the exercise's unit tests against the student's code.
+
+    With `parallel`, the test methods of the unit test's TestCase are split
+    across sandbox workers and their reports merged, which helps exercises
+    with a few slow tests. Reports are cached by (normalized code, unit test,
+    parallel), so re-running unchanged code skips the sandbox. Only plain
+    pass/fail reports of deterministic code are cached: reports with an
+    error traceback or captured output, timeouts, crashes and runs that hit
+    the output cap would show details of the source that produced them.
+
+    Returns:
+        dict: Report with `passed`, `total`, `failed`, per-test `results`
+        (name, status, message, duration_ms), `error` and captured `output`
+    """
+    code_hash, tree = normalize_code(code)
+    key = (code_hash, _sha256(unit_test), parallel)
+    report = test_result_cache.get(key)
+    if report is not None:
+        return report
+
+    test_names = discover_test_methods(unit_test) if parallel else []
+    try:
+        if len(test_names) > 1:
+            report = _run_tests_in_parallel(code, unit_test, test_names)
+        else:
+            report = sandbox_pool.run_unit_tests(code, unit_test)
+    except SandboxError as e:
+        report = summarize([], error=f"Error executing code:\n{e}")
+        report["output"] = ""
+        return report
+
+    if _is_cacheable(report, tree, unit_test):
+        test_result_cache.set(key, report)
+    return report
+
+def _is_cacheable(report: dict, tree: Optional[ast.AST], unit_test: str) -> bool:
+    if report.get("error") or report.get("output") or report.get("truncated"):
+        return False
+    return is_deterministic(tree) and is_deterministic(normalize_code(unit_test)[1])
+
+def cache_stats() -> dict:
+    return {
+        "compile": compile_cache.stats(),
+        "test_results": test_result_cache.stats(),
+    }
@@ -12,6 +12,102 @@ class Settings:
     ANTHROPIC_API_KEY: Optional[str] = os.getenv("ANTHROPIC_API_KEY")
     ANTHROPIC_MODEL: str = os.getenv("ANTHROPIC_MODEL", "claude-3-sonnet-20240229")
     ANTHROPIC_TEMPERATURE: float = float(os.getenv("ANTHROPIC_TEMPERATURE", "0.7"))
+
+    # OpenAI settings
+    OPENAI_API_KEY: Optional[str] = os.getenv("OPENAI_API_KEY")
+    OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    OPENAI_TEMPERATURE: float = float(os.getenv("OPENAI_TEMPERATURE", "0.7"))
+
+    # Agent settings: "single_shot" đánh giá code trong một lần gọi LLM, "react" dùng agent với tool
+    CODE_EVALUATION_MODE: str = os.getenv("CODE_EVALUATION_MODE", "single_shot")
+
+    # Chat history settings: giữ nguyên các tin nhắn gần nhất, phần cũ hơn được tóm tắt
+    HISTORY_TOKEN_BUDGET: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+    HISTORY_RECENT_TURNS: int = int(os.getenv("HISTORY_RECENT_TURNS", "6"))
+    HISTORY_SUMMARY_CACHE_SIZE: int = int(os.getenv("HISTORY_SUMMARY_CACHE_SIZE", "1024"))
+    HISTORY_SUMMARY_TTL: float = float(os.getenv("HISTORY_SUMMARY_TTL", "3600"))
+
+    # Theory chat settings: số section của bài học được đưa vào prompt
+    THEORY_TOP_K: int = int(os.getenv("THEORY_TOP_K", "3"))
+    THEORY_ANSWER_CACHE_SIZE: int = int(os.getenv("THEORY_ANSWER_CACHE_SIZE", "2048"))
+    THEORY_ANSWER_CACHE_TTL: float = float(os.getenv("THEORY_ANSWER_CACHE_TTL", "86400"))
+    # Số giây tối thiểu giữa hai lần kiểm tra file bài học có thay đổi (0 để kiểm tra mỗi request)
+    LESSON_RELOAD_INTERVAL: float = float(os.getenv("LESSON_RELOAD_INTERVAL", "2"))
+
+    # LLM gateway settings: deadline mỗi lần gọi (giây), số lần retry khi gặp 429/5xx và backoff
+    LLM_TIMEOUT: float = float(os.getenv("LLM_TIMEOUT", "120"))
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "3"))
+    LLM_BACKOFF_BASE: float = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+    LLM_BACKOFF_MAX: float = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+    LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+    # Số giây tối đa giữa hai chunk của một stream trước khi coi là bị treo
+    LLM_STREAM_IDLE_TIMEOUT: float = float(os.getenv("LLM_STREAM_IDLE_TIMEOUT", "30"))
+    # Gửi thêm một request trùng khi request chậm hơn p95 của call site (tốn thêm token nên mặc định tắt)
+    LLM_HEDGE: bool = os.getenv("LLM_HEDGE", "false").lower() in ("1", "true", "yes")
+    LLM_HEDGE_MIN_SAMPLES: int = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+    # LLM scheduler settings: số LLM call chạy cùng lúc, số call được chờ và thời gian chờ tối đa (giây)
+    LLM_CONCURRENCY: int = int(os.getenv("LLM_CONCURRENCY", "16"))
+    LLM_QUEUE_SIZE: int = int(os.getenv("LLM_QUEUE_SIZE", "64"))
+    LLM_QUEUE_TIMEOUT: float = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+    # Token bucket cho mỗi session: số request/giây và số request dồn tối đa (0 để tắt)
+    LLM_SESSION_RATE: float = float(os.getenv("LLM_SESSION_RATE", "0.5"))
+    LLM_SESSION_BURST: float = float(os.getenv("LLM_SESSION_BURST", "5"))
+    # Token bucket cho mỗi IP, áp dụng cả khi có session để client không né giới hạn bằng session id mới.
+    # Để rộng hơn giới hạn session vì cả lớp học có thể dùng chung một IP qua NAT (0 để tắt)
+    LLM_IP_RATE: float = float(os.getenv("LLM_IP_RATE", "5"))
+    LLM_IP_BURST: float = float(os.getenv("LLM_IP_BURST", "30"))
+
+    # Các endpoint gộp các request LLM giống hệt nhau đang chạy cùng lúc (cách nhau bởi dấu phẩy).
+    # Thêm "generate_exercise" để các học viên cùng yêu cầu một chủ đề nhận chung một bài tập
+    COALESCE_ENDPOINTS: str = os.getenv("COALESCE_ENDPOINTS", "theory_chat")
+
+    # Metrics settings: chu kỳ (giây) đo độ trễ của event loop (0 để tắt)
+    METRICS_LOOP_INTERVAL: float = float(os.getenv("METRICS_LOOP_INTERVAL", "0.5"))
+
+    # Tracing settings: số request gần nhất được giữ trace, số span tối đa mỗi request
+    # và file JSONL để ghi thêm trace (bỏ trống để chỉ giữ trong bộ nhớ)
+    TRACE_BUFFER_SIZE: int = int(os.getenv("TRACE_BUFFER_SIZE", "500"))
+    TRACE_MAX_SPANS: int = int(os.getenv("TRACE_MAX_SPANS", "200"))
+    TRACE_FILE: Optional[str] = os.getenv("TRACE_FILE") or None
+    # Bật /debug/traces (vẫn cần admin token); trace chứa một phần input của học viên
+    TRACE_DEBUG_ENDPOINTS: bool = os.getenv("TRACE_DEBUG_ENDPOINTS", "false").lower() in ("1", "true", "yes")
+
+    # Rendering settings: style Pygments và số code block / tài liệu đã render được cache
+    RENDER_STYLE: str = os.getenv("RENDER_STYLE", "monokai")
+    RENDER_CACHE_SIZE: int = int(os.getenv("RENDER_CACHE_SIZE", "4096"))
+
+    # Token cho các endpoint quản trị (gửi qua header X-Admin-Token); để trống thì các endpoint này bị tắt
+    ADMIN_TOKEN: Optional[str] = os.getenv("ADMIN_TOKEN")
+
+    # Exercise pool settings: số bài tập tạo sẵn cho mỗi chủ đề (0 để tắt)
+    EXERCISE_POOL_SIZE: int = int(os.getenv("EXERCISE_POOL_SIZE", "2"))
+    # Các chủ đề được tạo sẵn ngay khi khởi động, cách nhau bởi dấu phẩy; để trống là mọi bài học
+    EXERCISE_POOL_TOPICS: str = os.getenv("EXERCISE_POOL_TOPICS", "")
+    # Exercise bank: mọi bài tập đã tạo được lưu lại để phục vụ học viên khác
+    EXERCISE_BANK_PATH: str = os.getenv("EXERCISE_BANK_PATH", "exercises.db")
+
+    # Session store settings: "memory" cho một worker, "sqlite" để nhiều worker trên cùng máy dùng chung
+    SESSION_BACKEND: str = os.getenv("SESSION_BACKEND", "memory")
+    SESSION_DB_PATH: str = os.getenv("SESSION_DB_PATH", "sessions.db")
+    SESSION_TTL: float = float(os.getenv("SESSION_TTL", "86400"))
+    SESSION_CACHE_SIZE: int = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+
+    # Sandbox settings
+    SANDBOX_WORKERS: int = int(os.getenv("SANDBOX_WORKERS", str(os.cpu_count() or 2)))
+    SANDBOX_MAX_JOBS_PER_WORKER: int = int(os.getenv("SANDBOX_MAX_JOBS_PER_WORKER", "50"))
+    SANDBOX_TIMEOUT: float = float(os.getenv("SANDBOX_TIMEOUT", "10"))
+    SANDBOX_MAX_OUTPUT_CHARS: int = int(os.getenv("SANDBOX_MAX_OUTPUT_CHARS", "100000"))
+    SANDBOX_STREAM_BUFFER_CHARS: int = int(os.getenv("SANDBOX_STREAM_BUFFER_CHARS", "4096"))
+    STREAM_QUEUE_SIZE: int = int(os.getenv("STREAM_QUEUE_SIZE", "64"))
+
+    # Execution cache settings
+    EXECUTION_CACHE_SIZE: int = int(os.getenv("EXECUTION_CACHE_SIZE", "1024"))
+    EXECUTION_CACHE_TTL: float = float(os.getenv("EXECUTION_CACHE_TTL", "600"))
+
+    # Execution scheduler settings
+    EXECUTION_CONCURRENCY: int = int(os.getenv("EXECUTION_CONCURRENCY", str(SANDBOX_WORKERS)))
+    EXECUTION_QUEUE_SIZE: int = int(os.getenv("EXECUTION_QUEUE_SIZE", "32"))
     
     @classmethod
     def validate(cls):
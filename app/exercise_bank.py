@@ -0,0 +1,212 @@
+import asyncio
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from .config import settings
+
+EXERCISE_FIELDS = ("description", "example", "example_output", "explanation", "function", "unit_test")
+
+
+def content_hash(exercise: Dict[str, str]) -> str:
+    """Hash of the exercise fields, used to store each exercise only once."""
+    data = json.dumps([exercise.get(name, "") for name in EXERCISE_FIELDS], ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ExerciseBank:
+    """
+    Every generated exercise, stored in SQLite so later students can reuse it.
+
+    Exercises are indexed by topic, context pair and content hash, with a
+    usage count; `exercise_views` records which exercises each session has
+    already received so `take_unseen` never repeats one for the same student.
+    The database is opened by `start`, not on import. Endpoints use `aadd`
+    and `atake_unseen`, which run the blocking SQLite calls in a thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+
+    def start(self) -> None:
+        """Open the database file and create its tables; called on app startup."""
+        with self._lock:
+            if self._conn is not None:
+                return
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS exercises ("
+                " id INTEGER PRIMARY KEY,"
+                " topic TEXT NOT NULL, context_a TEXT, context_b TEXT,"
+                " content_hash TEXT NOT NULL UNIQUE,"
+                " description TEXT NOT NULL, example TEXT NOT NULL, example_output TEXT NOT NULL,"
+                " explanation TEXT NOT NULL, function TEXT NOT NULL, unit_test TEXT NOT NULL,"
+                " served_count INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL);"
+                # take_unseen duyệt theo (topic, served_count) để lấy bài ít được dùng nhất trước
+                "CREATE INDEX IF NOT EXISTS idx_exercises_topic_served ON exercises (topic, served_count, id);"
+                "CREATE INDEX IF NOT EXISTS idx_exercises_topic_context ON exercises (topic, context_a, context_b);"
+                "CREATE TABLE IF NOT EXISTS exercise_views ("
+                " session_id TEXT NOT NULL, exercise_id INTEGER NOT NULL, seen_at REAL NOT NULL,"
+                " PRIMARY KEY (session_id, exercise_id)) WITHOUT ROWID;"
+            )
+
+    def add(
+        self,
+        topic: str,
+        context: Optional[Sequence[str]],
+        exercise: Dict[str, str],
+        session_id: Optional[str] = None,
+    ) -> int:
+        """
+        Store an exercise (once per content hash) and return its id.
+
+        If `session_id` is given the exercise is also recorded as served to that session.
+        """
+        context_a, context_b = sorted(context) if context else (None, None)
+        digest = content_hash(exercise)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO exercises (topic, context_a, context_b, content_hash, "
+                    f"{', '.join(EXERCISE_FIELDS)}, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (topic, context_a, context_b, digest, *(exercise.get(name, "") for name in EXERCISE_FIELDS), time.time()),
+                )
+                (exercise_id,) = self._conn.execute(
+                    "SELECT id FROM exercises WHERE content_hash = ?", (digest,)
+                ).fetchone()
+                if session_id:
+                    self._mark_served(exercise_id, session_id)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return exercise_id
+
+    def take_unseen(
+        self,
+        topic: str,
+        session_id: Optional[str],
+        context: Optional[Sequence[str]] = None,
+    ) -> Optional[Dict[str, str]]:
+        """
+        Return the least-served exercise of `topic` that `session_id` has not received yet, or None.
+
+        The exercise is recorded as served to the session. Without a session
+        the least-served exercise is returned and nothing is recorded.
+        """
+        query = f"SELECT id, {', '.join(EXERCISE_FIELDS)} FROM exercises WHERE topic = ?"
+        params: List = [topic]
+        if context:
+            query += " AND context_a = ? AND context_b = ?"
+            params.extend(sorted(context))
+        if session_id:
+            # NOT EXISTS tra theo primary key của exercise_views, không quét bảng
+            query += (
+                " AND NOT EXISTS (SELECT 1 FROM exercise_views"
+                " WHERE session_id = ? AND exercise_id = exercises.id)"
+            )
+            params.append(session_id)
+        query += " ORDER BY served_count, id LIMIT 1"
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(query, params).fetchone()
+                if row is not None:
+                    self._mark_served(row[0], session_id)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(zip(EXERCISE_FIELDS, row[1:]))
+
+    def least_served(self, topic: str, limit: int) -> List[Tuple[List[str], Dict[str, str]]]:
+        """Return up to `limit` (context, exercise) pairs of `topic`, least served first, without marking them served."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT context_a, context_b, {', '.join(EXERCISE_FIELDS)} FROM exercises"
+                " WHERE topic = ? ORDER BY served_count, id LIMIT ?",
+                (topic, limit),
+            ).fetchall()
+        return [([context for context in row[:2] if context], dict(zip(EXERCISE_FIELDS, row[2:]))) for row in rows]
+
+    def seen_hashes(self, topic: str, session_id: str) -> Set[str]:
+        """Content hashes of the `topic` exercises already served to `session_id`."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT exercises.content_hash FROM exercise_views"
+                " JOIN exercises ON exercises.id = exercise_views.exercise_id"
+                " WHERE exercise_views.session_id = ? AND exercises.topic = ?",
+                (session_id, topic),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    async def aseen_hashes(self, topic: str, session_id: str) -> Set[str]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.seen_hashes, topic, session_id)
+
+    async def aadd(
+        self,
+        topic: str,
+        context: Optional[Sequence[str]],
+        exercise: Dict[str, str],
+        session_id: Optional[str] = None,
+    ) -> int:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self.add, topic, context, exercise, session_id=session_id)
+        )
+
+    async def atake_unseen(
+        self,
+        topic: str,
+        session_id: Optional[str],
+        context: Optional[Sequence[str]] = None,
+    ) -> Optional[Dict[str, str]]:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self.take_unseen, topic, session_id, context)
+        )
+
+    def _mark_served(self, exercise_id: int, session_id: Optional[str]) -> None:
+        self._conn.execute("UPDATE exercises SET served_count = served_count + 1 WHERE id = ?", (exercise_id,))
+        if session_id:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO exercise_views (session_id, exercise_id, seen_at) VALUES (?, ?, ?)",
+                (session_id, exercise_id, time.time()),
+            )
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            # Chưa start (app chưa khởi động xong) thì chưa có bài tập nào để thống kê
+            rows = self._conn.execute(
+                "SELECT topic, COUNT(*), SUM(served_count) FROM exercises GROUP BY topic"
+            ).fetchall() if self._conn is not None else []
+        lookups = self.hits + self.misses
+        return {
+            "topics": {topic: {"exercises": count, "served": served} for topic, count, served in rows},
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+exercise_bank = ExerciseBank(settings.EXERCISE_BANK_PATH)
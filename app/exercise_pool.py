@@ -0,0 +1,173 @@
+import asyncio
+import contextvars
+import time
+from collections import deque
+from typing import Awaitable, Callable, Collection, Deque, Dict, Iterable, List, Optional, Tuple
+
+from .config import settings
+from .exercise_bank import content_hash, exercise_bank
+from .generate_exercise import generate_exercise, get_context, parse_exercise
+from .llm_scheduler import Priority, llm_priority
+
+# Cặp ngữ cảnh đã dùng để tạo bài tập và bài tập đã được tách thành các trường
+GeneratedExercise = Tuple[List[str], Dict[str, str]]
+ExerciseFactory = Callable[[str], Awaitable[GeneratedExercise]]
+# Lấy tối đa n bài tập có sẵn của một topic (blocking, chạy trong thread)
+ExerciseSeed = Callable[[str, int], List[GeneratedExercise]]
+
+
+async def create_exercise(topic: str) -> GeneratedExercise:
+    """Generate and parse one exercise; raises ValueError if the LLM output is malformed."""
+    context = get_context()
+    return context, parse_exercise(await generate_exercise(topic, context))
+
+
+class ExercisePool:
+    """
+    Ready, already-parsed exercises per topic, refilled in the background.
+
+    Only the topics passed to `start` are pooled. Each topic's refill task
+    first fills the pool from `seed` (the exercise bank), then `take` pops an
+    exercise and wakes the task, which generates exercises one at a time
+    until the pool is back at `target_size`. Failed generations are retried
+    with exponential backoff from `retry_delay` up to `max_retry_delay`;
+    after `max_failures` failures in a row the topic waits for the next
+    `take` before trying again, so a broken API key does not keep calling the
+    LLM. Failures are reported in `stats`.
+    """
+
+    def __init__(
+        self,
+        target_size: int,
+        factory: ExerciseFactory = create_exercise,
+        seed: Optional[ExerciseSeed] = None,
+        retry_delay: float = 5.0,
+        max_retry_delay: float = 300.0,
+        max_failures: int = 5,
+    ):
+        self.target_size = target_size
+        self.factory = factory
+        self.seed = seed
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_failures = max_failures
+        self._exercises: Dict[str, Deque[GeneratedExercise]] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_failures = 0
+        self.seeded = 0
+        # Số lần tạo lỗi liên tiếp và lỗi gần nhất của từng topic
+        self._failures: Dict[str, int] = {}
+        self._last_errors: Dict[str, str] = {}
+        self._refill_seconds = 0.0
+        self._last_refill_seconds: Optional[float] = None
+
+    def start(self, topics: Iterable[str]) -> None:
+        """Start filling the pools of `topics`; must be called from the event loop."""
+        if self.target_size <= 0:
+            return
+        for topic in topics:
+            self._exercises.setdefault(topic, deque())
+            self._wakeups.setdefault(topic, asyncio.Event())
+            self._ensure_refill(topic)
+
+    async def shutdown(self) -> None:
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def take(self, topic: str, exclude: Collection[str] = ()) -> Optional[GeneratedExercise]:
+        """Pop a ready exercise for `topic` whose content hash is not in `exclude`, or return None."""
+        exercises = self._exercises.get(topic)
+        exercise = None
+        for index, candidate in enumerate(exercises or ()):
+            if not exclude or content_hash(candidate[1]) not in exclude:
+                exercise = candidate
+                del exercises[index]
+                break
+        if exercise is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        self._ensure_refill(topic)
+        return exercise
+
+    def _ensure_refill(self, topic: str) -> None:
+        if topic not in self._exercises:
+            return
+        self._wakeups[topic].set()
+        task = self._tasks.get(topic)
+        if task is None or task.done():
+            # take() chạy trong request của học viên: tạo task trong context rỗng để refill
+            # không mang theo request id, trace hay priority của request đó
+            self._tasks[topic] = contextvars.Context().run(asyncio.create_task, self._refill(topic))
+
+    async def _refill(self, topic: str) -> None:
+        # Tạo bài tập dự trữ chỉ dùng slot LLM khi không có request của học viên đang chờ
+        llm_priority.set(Priority.BACKGROUND)
+        exercises = self._exercises[topic]
+        wakeup = self._wakeups[topic]
+        if self.seed is not None and len(exercises) < self.target_size:
+            await self._seed(topic, exercises)
+        while True:
+            await wakeup.wait()
+            wakeup.clear()
+            while len(exercises) < self.target_size:
+                started_at = time.perf_counter()
+                try:
+                    exercise = await self.factory(topic)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.refill_failures += 1
+                    failures = self._failures[topic] = self._failures.get(topic, 0) + 1
+                    self._last_errors[topic] = f"{type(e).__name__}: {e}"
+                    if failures >= self.max_failures:
+                        # Dừng đến lần take tiếp theo thay vì gọi LLM mãi khi lỗi không tự hết
+                        break
+                    await asyncio.sleep(min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay))
+                    continue
+                elapsed = time.perf_counter() - started_at
+                self.refills += 1
+                self._refill_seconds += elapsed
+                self._last_refill_seconds = elapsed
+                self._failures[topic] = 0
+                exercises.append(exercise)
+
+    async def _seed(self, topic: str, exercises: Deque[GeneratedExercise]) -> None:
+        try:
+            stored = await asyncio.get_running_loop().run_in_executor(
+                None, self.seed, topic, self.target_size - len(exercises)
+            )
+        except Exception as e:
+            self._last_errors[topic] = f"{type(e).__name__}: {e}"
+            return
+        self.seeded += len(stored)
+        exercises.extend(stored)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "target_size": self.target_size,
+            "depth": {topic: len(exercises) for topic, exercises in self._exercises.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "refills": self.refills,
+            "refill_failures": self.refill_failures,
+            "seeded": self.seeded,
+            "consecutive_failures": {topic: count for topic, count in self._failures.items() if count},
+            "last_errors": dict(self._last_errors),
+            "refill_latency_ms": {
+                "last": round(self._last_refill_seconds * 1000, 1) if self._last_refill_seconds is not None else None,
+                "avg": round(self._refill_seconds / self.refills * 1000, 1) if self.refills else None,
+            },
+        }
+
+
+exercise_pool = ExercisePool(settings.EXERCISE_POOL_SIZE, seed=exercise_bank.least_served)
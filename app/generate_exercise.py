@@ -1,24 +1,28 @@
 import random
-import os
+from typing import AsyncIterator, Dict, List, Tuple
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
+
+from .llm_gateway import LLMTimeoutError, llm_gateway
+from .llm_scheduler import LLMBusyError
+
+# Quá tải hoặc quá hạn không phải lỗi tạo bài tập: để handler của app trả về 503/504
+OVERLOAD_ERRORS = (LLMBusyError, LLMTimeoutError)
 
 # Load environment variables
 load_dotenv()
 
+def get_client() -> AsyncOpenAI:
+    """Return the shared OpenAI client, which uses the gateway's connection pool."""
+    return llm_gateway.openai_client()
+
 def get_context():
     """Return 2 random context from the list of available contexts."""
     contexts = ["leo núi", "câu cá", "mối quan hệ", "bóng đá", "âm nhạc", "sách", "nấu ăn"]
     return random.sample(contexts, 2)
 
-def generate_exercise(topic):
-    """Generate a Python exercise using GPT-4 based on random topic and context."""
-    context = get_context()
-    print(topic, context)
-    
-    # Initialize OpenAI client
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    
+def build_messages(topic, context):
+    """Build the chat messages asking for an exercise on `topic` with the given context pair."""
     # Create prompt for GPT-4
     prompt = f"""
     Mô tả: Viết một hàm `fish_stats(fish_counts: List[int]) -> List[int]` nhận vào danh sách `fish_counts`, trong đó mỗi phần tử đại diện cho số cá câu được trong một lần ra hồ. Hàm cần trả về một danh sách gồm:
@@ -76,24 +80,63 @@ def generate_exercise(topic):
     - Unit test:
     
     Hãy viết bằng tiếng Việt và đảm bảo bài tập có độ khó trung bình, phù hợp với người học Python. Nếu bạn đưa ra code ví dụ thì hãy viết bằng tiếng anh. Hãy tuân thủ format và đừng thêm bất kỳ thông tin nào khác."""
-    
+
+    return [
+        {"role": "system", "content": "Bạn là một giáo viên dạy lập trình Python chuyên nghiệp."},
+        {"role": "user", "content": prompt}
+    ]
+
+async def generate_exercise(topic, context=None):
+    """Generate a Python exercise using GPT-4 based on the topic and a context pair (random if not given)."""
+    context = context or get_context()
+
     try:
-        response = client.chat.completions.create(
+        response = await llm_gateway.call("exercise", lambda: get_client().chat.completions.create(
             model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Bạn là một giáo viên dạy lập trình Python chuyên nghiệp."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=build_messages(topic, context),
             temperature=0.7
-        )
+        ))
         return response.choices[0].message.content
+    except OVERLOAD_ERRORS:
+        raise
     except Exception as e:
         return f"Có lỗi khi tạo bài tập: {str(e)}"
-    
-def extract_description(content):
-    """Extract the description from the content."""
-    return content.split("- Mô tả:")[1].split("- Ví dụ:")[0].strip()
 
+async def stream_exercise(topic, context=None) -> AsyncIterator[str]:
+    """
+    Stream the text of a generated exercise as it is produced.
+
+    Raises:
+        ValueError: if the OpenAI request fails
+        LLMBusyError, LLMTimeoutError: if the LLM scheduler is overloaded or the request times out
+    """
+    context = context or get_context()
+
+    async def completion_chunks():
+        stream = await get_client().chat.completions.create(
+            model="gpt-4o-mini",
+            messages=build_messages(topic, context),
+            temperature=0.7,
+            stream=True,
+            # Chunk cuối (không có choices) mang token usage của cả request
+            stream_options={"include_usage": True}
+        )
+        # Đóng stream khi generator bị hủy (client ngắt kết nối) để dừng sinh token
+        async with stream:
+            async for chunk in stream:
+                if chunk.usage:
+                    llm_gateway.record_usage("exercise_stream", chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    try:
+        async for text in llm_gateway.stream("exercise_stream", completion_chunks):
+            yield text
+    except OVERLOAD_ERRORS:
+        raise
+    except Exception as e:
+        raise ValueError(f"Có lỗi khi tạo bài tập: {str(e)}") from e
+    
 def normalize_code_block(text):
     """Helper function to normalize code blocks by removing extra indentation and markdown syntax."""
     # Split into lines
@@ -127,41 +170,106 @@ def normalize_code_block(text):
     # Join the lines back together
     return '\n'.join(processed_lines).strip()
 
-def extract_function(content):
-    """Extract the function from the content and remove markdown formatting."""
-    function_block = content.split("- Hàm cần hoàn chỉnh:")[1].split("- Unit test:")[0].strip()
-    return normalize_code_block(function_block)
+# Các phần của bài tập theo đúng thứ tự trong output của LLM
+SECTION_MARKERS = [
+    ("description", "- Mô tả:"),
+    ("example", "- Ví dụ:"),
+    ("explanation", "- Giải thích:"),
+    ("function", "- Hàm cần hoàn chỉnh:"),
+    ("unit_test", "- Unit test:"),
+]
 
-def extract_example(content):
-    """Extract the example from the content and normalize formatting."""
-    example_block = content.split("- Ví dụ:")[1].split("- Giải thích:")[0].strip()
-    
-    # Split into input and output sections if they exist
-    sections = example_block.split("Output:")
-    
-    if len(sections) > 1:
-        # Process input section
-        input_section = sections[0].strip()
-        return input_section
-    else:
-        # If there's no explicit Output section, return the entire block
-        return example_block.strip()
-
-def extract_example_output(content):
-    """Generate the example output from the content."""
-    example_block = content.split("- Ví dụ:")[1].split("- Giải thích:")[0].strip()
-    sections = example_block.split("Output:")
-    
-    if len(sections) > 1:
-        output_section = sections[1].strip()
-        return output_section
-    return ""
-
-def extract_explanation(content):
-    """Extract the explanation from the content."""
-    return content.split("- Giải thích:")[1].split("- Hàm cần hoàn chỉnh:")[0].strip()
-
-def extract_unit_test(content):
-    """Extract the unit test from the content and remove markdown formatting."""
-    test_block = content.split("- Unit test:")[1].strip()
-    return normalize_code_block(test_block)
+class ExerciseParser:
+    """
+    Single-pass parser for a generated exercise that can be fed a streamed completion.
+
+    `feed` returns the fields of every section completed by the new text, as
+    soon as the next section's marker arrives; `finish` returns the last
+    section. Format errors (a missing or out-of-order section, or no
+    description marker near the start) raise ValueError as soon as they can
+    be detected.
+    """
+
+    # Số ký tự tối đa trước "- Mô tả:" trước khi coi output là sai format
+    MAX_PREAMBLE = 1000
+    MARKER_LENGTH = max(len(marker) for _, marker in SECTION_MARKERS)
+
+    def __init__(self):
+        self._buffer = ""
+        # Vị trí bắt đầu tìm marker tiếp theo, để mỗi ký tự chỉ được quét một lần
+        self._scan_from = 0
+        # Chỉ số của section đang đọc; -1 là phần trước "- Mô tả:"
+        self._section = -1
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        """Add streamed text and return the (name, value) fields of the sections it completed."""
+        self._buffer += text
+        fields = []
+        while self._section < len(SECTION_MARKERS) - 1:
+            found = [
+                (position, index)
+                for index in range(self._section + 1, len(SECTION_MARKERS))
+                for position in [self._buffer.find(SECTION_MARKERS[index][1], self._scan_from)]
+                if position != -1
+            ]
+            if not found:
+                if self._section == -1 and len(self._buffer) > self.MAX_PREAMBLE:
+                    raise self._format_error(SECTION_MARKERS[0][1])
+                # Giữ lại phần cuối vì marker có thể bị cắt giữa hai chunk
+                self._scan_from = max(0, len(self._buffer) - self.MARKER_LENGTH + 1)
+                break
+            position, index = min(found)
+            if index != self._section + 1:
+                raise self._format_error(SECTION_MARKERS[self._section + 1][1])
+            if self._section >= 0:
+                fields.extend(self._complete(self._section, self._buffer[:position]))
+            self._buffer = self._buffer[position + len(SECTION_MARKERS[index][1]):]
+            self._scan_from = 0
+            self._section = index
+        return fields
+
+    def finish(self) -> List[Tuple[str, str]]:
+        """Return the fields of the last section once the completion has ended."""
+        if self._section < len(SECTION_MARKERS) - 1:
+            raise self._format_error(SECTION_MARKERS[self._section + 1][1])
+        return self._complete(self._section, self._buffer)
+
+    def _format_error(self, marker: str) -> ValueError:
+        preview = self._buffer[:200] if self._section == -1 else ""
+        return ValueError(f"Bài tập được tạo không đúng format: thiếu phần '{marker}' {preview}".strip())
+
+    def _complete(self, section: int, text: str) -> List[Tuple[str, str]]:
+        name = SECTION_MARKERS[section][0]
+        text = text.strip()
+        if name == "example":
+            # Tách phần input và output của ví dụ nếu có
+            example, _, example_output = text.partition("Output:")
+            return [("example", example.strip()), ("example_output", example_output.strip())]
+        if name in ("function", "unit_test"):
+            return [(name, normalize_code_block(text))]
+        return [(name, text)]
+
+def parse_exercise(content: str) -> Dict[str, str]:
+    """
+    Split a generated exercise into its fields.
+
+    Raises:
+        ValueError: if the content does not follow the expected format
+    """
+    parser = ExerciseParser()
+    fields = parser.feed(content) + parser.finish()
+    return dict(fields)
+
+async def stream_exercise_fields(topic, context=None) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Generate an exercise and yield each (name, value) field as soon as its section is complete.
+
+    Raises:
+        ValueError: if the request fails or the output is malformed
+    """
+    parser = ExerciseParser()
+    async for text in stream_exercise(topic, context):
+        for field in parser.feed(text):
+            yield field
+    for field in parser.finish():
+        yield field
@@ -0,0 +1,144 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from langchain.prompts import PromptTemplate
+
+from .cache import LRUCache
+from .config import settings
+from .llm_gateway import LLMTimeoutError
+from .llm_scheduler import LLMBusyError
+from .tracing import record_event
+
+NO_HISTORY = "Chưa có lịch sử trò chuyện."
+
+# Lỗi do hệ thống quá tải hoặc quá hạn: trả về cho client (503/504/429) thay vì bỏ bớt history
+OVERLOAD_ERRORS = (LLMBusyError, LLMTimeoutError)
+
+SUMMARY_PROMPT_TEMPLATE = """Bạn đang tóm tắt cuộc trò chuyện giữa học viên và AI tutor Python để dùng làm ngữ cảnh cho các câu trả lời sau.
+
+Tóm tắt hiện có (có thể trống):
+{summary}
+
+Các tin nhắn mới cần gộp vào tóm tắt:
+{messages}
+
+Hãy viết lại một bản tóm tắt duy nhất, ngắn gọn (tối đa {max_words} từ), giữ lại câu hỏi của học viên, lỗi đã gặp, kiến thức đã giải thích và các quyết định quan trọng. Chỉ trả về nội dung tóm tắt."""
+
+summary_prompt = PromptTemplate(
+    template=SUMMARY_PROMPT_TEMPLATE,
+    input_variables=["summary", "messages", "max_words"]
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count for `text`.
+
+    Tiếng Việt có dấu tốn nhiều token hơn tiếng Anh, nên ước lượng khoảng
+    3 ký tự một token thay vì 4.
+    """
+    return len(text) // 3 + 1
+
+
+def format_chat_history(history: List[Dict[str, Any]]) -> str:
+    if not history:
+        return NO_HISTORY
+    formatted = []
+    for msg in history:
+        role = "Học viên" if msg.get("role") == "user" else "Tutor"
+        formatted.append(f"{role}: {msg.get('content', '')}")
+    return "\n".join(formatted)
+
+
+def _fingerprint(messages: List[Dict[str, Any]]) -> str:
+    payload = json.dumps([(msg.get("role"), msg.get("content")) for msg in messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class HistoryManager:
+    """
+    Fit chat history into a token budget for the prompt.
+
+    The last `recent_turns` messages are kept word for word. When the whole
+    history no longer fits, older messages are folded into a rolling summary
+    cached per session. The summary is only extended when the messages it does
+    not cover yet stop fitting in the budget, so most requests reuse it as-is.
+    """
+
+    def __init__(self, llm, token_budget: int, recent_turns: int, cache: LRUCache):
+        self.llm = llm
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.cache = cache
+
+    async def build(self, history: List[Dict[str, Any]], session_id: Optional[str] = None) -> str:
+        """Return the chat history text to put in the prompt."""
+        if not history:
+            return NO_HISTORY
+        full = format_chat_history(history)
+        if estimate_tokens(full) <= self.token_budget:
+            return full
+
+        recent = history[-self.recent_turns:] if self.recent_turns > 0 else []
+        # Các tin nhắn gần nhất vẫn vượt budget thì bỏ bớt tin cũ nhất trong số đó
+        while len(recent) > 1 and estimate_tokens(format_chat_history(recent)) > self.token_budget:
+            recent = recent[1:]
+        older = history[:len(history) - len(recent)]
+
+        key = session_id or _fingerprint(history[:1])
+        summary, covered = self._cached_summary(key, older)
+        pending = older[covered:]
+
+        text = self._compose(summary, pending + recent)
+        if not pending or estimate_tokens(text) <= self.token_budget:
+            return text
+
+        try:
+            summary = await self._summarize(summary, pending)
+        except OVERLOAD_ERRORS:
+            raise
+        except Exception as e:
+            # Không tóm tắt được thì chỉ giữ các tin nhắn gần nhất
+            record_event("history_summary_fallback", "fallback", e, dropped_messages=len(pending))
+            return self._compose(summary, recent)
+        self.cache.set(key, (len(older), _fingerprint(older), summary))
+        return self._compose(summary, recent)
+
+    def _cached_summary(self, key: str, older: List[Dict[str, Any]]):
+        """Return the cached (summary, number of messages it covers), or an empty summary if it does not match `older`."""
+        entry = self.cache.get(key)
+        if entry is not None:
+            covered, fingerprint, summary = entry
+            if covered <= len(older) and _fingerprint(older[:covered]) == fingerprint:
+                return summary, covered
+        return "", 0
+
+    async def _summarize(self, summary: str, messages: List[Dict[str, Any]]) -> str:
+        prompt = summary_prompt.format(
+            summary=summary or "(trống)",
+            messages=format_chat_history(messages),
+            max_words=max(self.token_budget // 4, 50),
+        )
+        response = await self.llm.ainvoke(prompt)
+        content = response.content if hasattr(response, "content") else str(response)
+        return content.strip()
+
+    @staticmethod
+    def _compose(summary: str, messages: List[Dict[str, Any]]) -> str:
+        parts = []
+        if summary:
+            parts.append(f"Tóm tắt các trao đổi trước:\n{summary}")
+        if messages:
+            parts.append(format_chat_history(messages))
+        return "\n\n".join(parts) or NO_HISTORY
+
+
+def create_history_manager(llm) -> HistoryManager:
+    """Build a history manager using the configured budget and a summary cache of its own."""
+    return HistoryManager(
+        llm,
+        token_budget=settings.HISTORY_TOKEN_BUDGET,
+        recent_turns=settings.HISTORY_RECENT_TURNS,
+        cache=LRUCache(settings.HISTORY_SUMMARY_CACHE_SIZE, settings.HISTORY_SUMMARY_TTL),
+    )
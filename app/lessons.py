@@ -0,0 +1,261 @@
+import glob
+import gzip
+import hashlib
+import json
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from .config import settings
+
+THEORY_DIR = os.path.join(os.path.dirname(__file__), "theory")
+
+
+def parse_sections(content: str) -> List[Dict[str, str]]:
+    """Split a lesson's markdown into its level 2 (`## `) sections."""
+    sections = []
+    current_title = None
+    current_content = []
+
+    for line in content.split('\n'):
+        # Only process level 2 headings (##)
+        if line.startswith('## '):
+            # Save previous section if exists
+            if current_title is not None:
+                sections.append({
+                    "title": current_title,
+                    "content": '\n'.join(current_content).strip()
+                })
+            # Start new section
+            current_title = line[3:].strip()
+            current_content = []
+        else:
+            # Add line to current content
+            current_content.append(line)
+
+    # Add the last section
+    if current_title is not None:
+        sections.append({
+            "title": current_title,
+            "content": '\n'.join(current_content).strip()
+        })
+
+    return sections
+
+
+def lesson_path(lesson_id: str, theory_dir: str = THEORY_DIR) -> str:
+    return os.path.join(theory_dir, f"{lesson_id}.md")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase words with Vietnamese diacritics removed.
+
+    Học viên hay gõ không dấu, nên "vòng lặp" và "vong lap" phải cho cùng token.
+    """
+    text = unicodedata.normalize("NFD", text.lower()).replace("đ", "d")
+    text = "".join(char for char in text if unicodedata.category(char) != "Mn")
+    return re.findall(r"\w+", text)
+
+
+class SectionIndex:
+    """
+    BM25 index over the sections of every lesson, used to pick the parts of
+    a lesson relevant to a student's question.
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self):
+        self.lessons: Dict[str, List[Dict[str, str]]] = {}
+        self._terms: Dict[str, List[Counter]] = {}
+        self._lengths: Dict[str, List[int]] = {}
+        self._document_frequency: Dict[str, Counter] = {}
+
+    def add_lesson(self, lesson_id: str, sections: List[Dict[str, str]]) -> None:
+        terms = [Counter(tokenize(f"{section['title']}\n{section['content']}")) for section in sections]
+        self.lessons[lesson_id] = sections
+        self._terms[lesson_id] = terms
+        self._lengths[lesson_id] = [sum(counts.values()) for counts in terms]
+        self._document_frequency[lesson_id] = Counter(term for counts in terms for term in counts)
+
+    def remove_lesson(self, lesson_id: str) -> None:
+        for index in (self.lessons, self._terms, self._lengths, self._document_frequency):
+            index.pop(lesson_id, None)
+
+    def search(self, lesson_id: str, query: str, k: int) -> List[Dict[str, str]]:
+        """
+        Return the `k` sections of the lesson that best match `query`, in lesson order.
+
+        If nothing in the query matches (e.g. "giải thích lại giúp mình"),
+        the first `k` sections are returned.
+        """
+        sections = self.lessons.get(lesson_id, [])
+        if len(sections) <= k:
+            return list(sections)
+
+        terms = self._terms[lesson_id]
+        lengths = self._lengths[lesson_id]
+        document_frequency = self._document_frequency[lesson_id]
+        average_length = sum(lengths) / len(lengths) or 1
+        query_terms = set(tokenize(query))
+
+        scores = []
+        for index, counts in enumerate(terms):
+            score = 0.0
+            for term in query_terms:
+                frequency = counts.get(term)
+                if not frequency:
+                    continue
+                df = document_frequency[term]
+                idf = math.log(1 + (len(sections) - df + 0.5) / (df + 0.5))
+                norm = self.K1 * (1 - self.B + self.B * lengths[index] / average_length)
+                score += idf * frequency * (self.K1 + 1) / (frequency + norm)
+            scores.append((score, index))
+
+        if not any(score for score, _ in scores):
+            return sections[:k]
+        top = sorted(scores, key=lambda item: (-item[0], item[1]))[:k]
+        return [sections[index] for _, index in sorted(top, key=lambda item: item[1])]
+
+
+def format_sections(sections: List[Dict[str, str]]) -> str:
+    return "\n\n".join(f"## {section['title']}\n{section['content']}" for section in sections)
+
+
+section_index = SectionIndex()
+
+
+@dataclass
+class JSONPayload:
+    """A response body encoded once: JSON bytes, their gzip version and an ETag."""
+
+    body: bytes
+    gzip_body: bytes
+    etag: str
+
+    @classmethod
+    def encode(cls, data) -> "JSONPayload":
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        return cls(body, gzip.compress(body), f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+
+@dataclass
+class Lesson:
+    lesson_id: str
+    title: str
+    sections: List[Dict[str, str]]
+    mtime: float
+    payload: JSONPayload
+
+
+def lesson_title(content: str, lesson_id: str) -> str:
+    """Title from the lesson's level 1 heading, or the lesson id if it has none."""
+    for line in content.split('\n'):
+        if line.startswith('# '):
+            return line[2:].strip()
+    return lesson_id
+
+
+class LessonIndex:
+    """
+    Every lesson in the theory directory, parsed once and kept ready to serve.
+
+    Each lesson's `/api/theory` response is pre-encoded (JSON, gzip, ETag),
+    as is the list of all lessons. The directory is re-scanned at most every
+    `reload_interval` seconds; lessons whose file mtime changed are re-parsed,
+    re-indexed in `section_index`, and reported to the `on_change` callbacks.
+    """
+
+    def __init__(self, theory_dir: str = THEORY_DIR, sections: SectionIndex = section_index, reload_interval: float = 2.0):
+        self.theory_dir = theory_dir
+        self.sections = sections
+        self.reload_interval = reload_interval
+        self.lessons: Dict[str, Lesson] = {}
+        self.list_payload = JSONPayload.encode({"lessons": []})
+        self._checked_at: Optional[float] = None
+        self._listeners: List[Callable[[str], None]] = []
+
+    def build(self) -> None:
+        """Load every lesson; called once at startup."""
+        self.refresh(force=True)
+
+    def on_change(self, callback: Callable[[str], None]) -> None:
+        """Call `callback(lesson_id)` whenever a lesson is reloaded or removed."""
+        self._listeners.append(callback)
+
+    def get(self, lesson_id: str) -> Optional[Lesson]:
+        self.refresh()
+        return self.lessons.get(lesson_id)
+
+    def refresh(self, force: bool = False) -> List[str]:
+        """Reload lessons whose file changed since the last scan and return their ids."""
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.reload_interval:
+            return []
+        self._checked_at = now
+
+        mtimes = {}
+        for path in glob.glob(os.path.join(self.theory_dir, "*.md")):
+            try:
+                mtimes[os.path.splitext(os.path.basename(path))[0]] = os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+
+        changed = []
+        for lesson_id in [lesson_id for lesson_id in self.lessons if lesson_id not in mtimes]:
+            del self.lessons[lesson_id]
+            self.sections.remove_lesson(lesson_id)
+            changed.append(lesson_id)
+        for lesson_id, mtime in sorted(mtimes.items()):
+            lesson = self.lessons.get(lesson_id)
+            if lesson is not None and lesson.mtime == mtime:
+                continue
+            try:
+                self._load(lesson_id, mtime)
+            except OSError as e:
+                print(f"Could not load lesson {lesson_id!r}: {e}")
+                continue
+            changed.append(lesson_id)
+
+        if changed:
+            self.list_payload = JSONPayload.encode({"lessons": [
+                {"id": lesson.lesson_id, "title": lesson.title} for lesson in self.lessons.values()
+            ]})
+            if not force:
+                print(f"Reloaded lessons: {', '.join(changed)}")
+            for lesson_id in changed:
+                for callback in self._listeners:
+                    callback(lesson_id)
+        return changed
+
+    def _load(self, lesson_id: str, mtime: float) -> None:
+        with open(lesson_path(lesson_id, self.theory_dir), 'r', encoding='utf-8') as f:
+            content = f.read()
+        sections = parse_sections(content)
+        self.lessons[lesson_id] = Lesson(
+            lesson_id=lesson_id,
+            title=lesson_title(content, lesson_id),
+            sections=sections,
+            mtime=mtime,
+            payload=JSONPayload.encode({"content": sections}),
+        )
+        # Giữ thứ tự theo tên file cho danh sách bài học
+        self.lessons = dict(sorted(self.lessons.items()))
+        self.sections.add_lesson(lesson_id, sections)
+
+
+lesson_index = LessonIndex(reload_interval=settings.LESSON_RELOAD_INTERVAL)
+
+
+def retrieve_theory_context(lesson_id: str, query: str, k: Optional[int] = None) -> Optional[str]:
+    """Return the lesson sections relevant to `query` as prompt text, or None if the lesson does not exist."""
+    if lesson_index.get(lesson_id) is None:
+        return None
+    return format_sections(section_index.search(lesson_id, query, k or settings.THEORY_TOP_K))
@@ -0,0 +1,496 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+import anthropic
+import httpx
+import openai
+from langchain_anthropic import ChatAnthropic
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import root_validator
+
+from .config import settings
+from .llm_scheduler import LLMBusyError, llm_scheduler
+from .metrics import llm_call_duration, llm_time_to_first_chunk, llm_tokens
+
+T = TypeVar("T")
+
+# Lỗi tạm thời của provider: rate limit, quá tải (529 của Anthropic) và lỗi server
+RETRYABLE_STATUS_CODES = {408, 429}
+
+
+class LLMTimeoutError(Exception):
+    """Raised when an LLM call does not finish before its deadline."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, LLMBusyError):
+        # Bị scheduler từ chối, không phải lỗi của provider
+        return False
+    if isinstance(error, (anthropic.APIConnectionError, openai.APIConnectionError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and (status_code in RETRYABLE_STATUS_CODES or status_code >= 500)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds to wait from the error response's Retry-After header, if any."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def usage_of(result: Any) -> Any:
+    """The token usage reported with an LLM response, whichever client produced it."""
+    # Response của SDK OpenAI/Anthropic có `usage`; ChatResult của LangChain giữ nó trong llm_output
+    usage = getattr(result, "usage", None)
+    if usage is None and isinstance(result, ChatResult):
+        usage = (result.llm_output or {}).get("usage") or (result.llm_output or {}).get("token_usage")
+    if usage is None:
+        metadata = getattr(result, "response_metadata", None) or {}
+        usage = metadata.get("usage") or metadata.get("token_usage")
+    return usage
+
+
+def _usage_value(usage: Any, *names: str) -> int:
+    for name in names:
+        value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+        if value:
+            return value
+    return 0
+
+
+def token_counts(usage: Any) -> Dict[str, int]:
+    """Non-zero input, output, cache_read and cache_write token counts of a response's usage."""
+    if usage is None:
+        return {}
+    counts = {
+        "input": _usage_value(usage, "input_tokens", "prompt_tokens"),
+        "output": _usage_value(usage, "output_tokens", "completion_tokens"),
+        "cache_read": _usage_value(usage, "cache_read_input_tokens"),
+        "cache_write": _usage_value(usage, "cache_creation_input_tokens"),
+    }
+    return {kind: count for kind, count in counts.items() if count}
+
+
+class CallSiteStats:
+    """Counters and a rolling latency window for one call site."""
+
+    WINDOW = 200
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.latencies: Deque[float] = deque(maxlen=self.WINDOW)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def to_dict(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency_ms": {
+                "p50": round(p50 * 1000, 1) if p50 is not None else None,
+                "p95": round(p95 * 1000, 1) if p95 is not None else None,
+            },
+        }
+
+
+class LLMGateway:
+    """
+    Single entry point for all LLM traffic.
+
+    Owns long-lived pooled HTTP clients shared by every provider SDK client
+    (with the SDKs' own retries disabled), and runs each call inside one of
+    `llm_scheduler`'s concurrency slots, with a deadline and
+    exponential-backoff retries on 429/5xx and connection errors. When
+    hedging is enabled, a non-streaming call still running after its call
+    site's p95 latency gets a duplicate request, and the first
+    answer wins. Streams are only retried before their first chunk, and
+    fail with `LLMTimeoutError` if no chunk arrives for `stream_idle_timeout`
+    seconds after that.
+    """
+
+    def __init__(
+        self,
+        timeout: float,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+        hedge: bool,
+        hedge_min_samples: int,
+        max_connections: int,
+        stream_idle_timeout: Optional[float] = None,
+    ):
+        self.timeout = timeout
+        self.stream_idle_timeout = stream_idle_timeout or timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        http_timeout = httpx.Timeout(timeout, connect=10.0)
+        self.http_client = httpx.AsyncClient(limits=limits, timeout=http_timeout)
+        self.sync_http_client = httpx.Client(limits=limits, timeout=http_timeout)
+        self._anthropic_clients: Dict[Tuple, Tuple[anthropic.Anthropic, anthropic.AsyncAnthropic]] = {}
+        self._openai_client: Optional[openai.AsyncOpenAI] = None
+        self._sites: Dict[str, CallSiteStats] = {}
+
+    def anthropic_clients(
+        self, api_key: Optional[str] = None, base_url: Optional[str] = None, default_headers: Optional[dict] = None
+    ) -> Tuple[anthropic.Anthropic, anthropic.AsyncAnthropic]:
+        """Sync and async Anthropic clients on the shared connection pools, one pair per key/URL."""
+        key = (api_key, base_url, tuple(sorted((default_headers or {}).items())))
+        if key not in self._anthropic_clients:
+            params = {
+                "api_key": api_key,
+                "base_url": base_url,
+                "default_headers": default_headers,
+                "max_retries": 0,
+                "timeout": self.timeout,
+            }
+            self._anthropic_clients[key] = (
+                anthropic.Anthropic(http_client=self.sync_http_client, **params),
+                anthropic.AsyncAnthropic(http_client=self.http_client, **params),
+            )
+        return self._anthropic_clients[key]
+
+    def openai_client(self) -> openai.AsyncOpenAI:
+        if self._openai_client is None:
+            self._openai_client = openai.AsyncOpenAI(http_client=self.http_client, max_retries=0, timeout=self.timeout)
+        return self._openai_client
+
+    def site(self, name: str) -> CallSiteStats:
+        if name not in self._sites:
+            self._sites[name] = CallSiteStats()
+        return self._sites[name]
+
+    async def call(
+        self,
+        site: str,
+        factory: Callable[[], Awaitable[T]],
+        timeout: Optional[float] = None,
+        hedge: bool = True,
+    ) -> T:
+        """
+        Run `factory()` (which starts one request) with a deadline and retries.
+
+        Raises:
+            LLMTimeoutError: if no attempt succeeded before the deadline
+        """
+        stats = self.site(site)
+        stats.calls += 1
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            started_at = time.monotonic()
+            try:
+                async with asyncio.timeout(max(0.0, deadline - started_at)):
+                    async with llm_scheduler.slot():
+                        # Thời gian chờ slot được đo riêng trong scheduler
+                        attempt_started_at = time.monotonic()
+                        result = await self._attempt(stats, factory, hedge)
+            except TimeoutError:
+                stats.timeouts += 1
+                raise LLMTimeoutError(f"LLM call '{site}' did not finish within {timeout or self.timeout:.0f}s")
+            except Exception as e:
+                await self._backoff(site, stats, e, attempt, deadline)
+                attempt += 1
+                continue
+            stats.latencies.append(time.monotonic() - started_at)
+            llm_call_duration.observe(time.monotonic() - attempt_started_at, site=site)
+            self.record_usage(site, usage_of(result))
+            return result
+
+    def call_sync(self, site: str, fn: Callable[[], T], timeout: Optional[float] = None) -> T:
+        """
+        Blocking version of `call` for synchronous code paths (no hedging).
+
+        Each attempt holds a scheduler slot (see `LLMScheduler.slot_sync`). A
+        running attempt cannot be interrupted, so the deadline is checked
+        before each attempt and bounds the retries.
+
+        Raises:
+            LLMTimeoutError: if the deadline passed before an attempt succeeded
+        """
+        stats = self.site(site)
+        stats.calls += 1
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            started_at = time.monotonic()
+            if started_at >= deadline:
+                stats.timeouts += 1
+                raise LLMTimeoutError(f"LLM call '{site}' did not finish within {timeout or self.timeout:.0f}s")
+            try:
+                with llm_scheduler.slot_sync():
+                    result = fn()
+            except LLMBusyError:
+                raise
+            except Exception as e:
+                delay = self._retry_delay(site, stats, e, attempt, deadline)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            stats.latencies.append(time.monotonic() - started_at)
+            llm_call_duration.observe(time.monotonic() - started_at, site=site)
+            self.record_usage(site, usage_of(result))
+            return result
+
+    async def stream(
+        self,
+        site: str,
+        factory: Callable[[], AsyncIterator[T]],
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[T]:
+        """
+        Iterate `factory()`, retrying until the first chunk arrives.
+
+        The deadline applies to the first chunk, then each later chunk must
+        arrive within `stream_idle_timeout`; errors after the first chunk are
+        raised to the caller, since part of the answer has already been sent.
+        The scheduler slot is held until the stream ends.
+        """
+        async with llm_scheduler.slot():
+            async for item in self._stream(site, factory, timeout):
+                yield item
+
+    async def _stream(
+        self,
+        site: str,
+        factory: Callable[[], AsyncIterator[T]],
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[T]:
+        stats = self.site(site)
+        stats.calls += 1
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            started_at = time.monotonic()
+            iterator = factory()
+            try:
+                async with asyncio.timeout(max(0.0, deadline - started_at)):
+                    first = await anext(iterator)
+            except StopAsyncIteration:
+                return
+            except TimeoutError:
+                stats.timeouts += 1
+                await _aclose(iterator)
+                raise LLMTimeoutError(f"LLM stream '{site}' sent nothing within {timeout or self.timeout:.0f}s")
+            except Exception as e:
+                await _aclose(iterator)
+                await self._backoff(site, stats, e, attempt, deadline)
+                attempt += 1
+                continue
+            # Với stream, latency được đo đến chunk đầu tiên
+            stats.latencies.append(time.monotonic() - started_at)
+            llm_time_to_first_chunk.observe(time.monotonic() - started_at, site=site)
+            break
+
+        try:
+            yield first
+            while True:
+                try:
+                    async with asyncio.timeout(self.stream_idle_timeout):
+                        item = await anext(iterator)
+                except StopAsyncIteration:
+                    break
+                except TimeoutError:
+                    stats.timeouts += 1
+                    raise LLMTimeoutError(
+                        f"LLM stream '{site}' stalled for {self.stream_idle_timeout:.0f}s"
+                    ) from None
+                yield item
+            llm_call_duration.observe(time.monotonic() - started_at, site=site)
+        finally:
+            await _aclose(iterator)
+
+    async def _attempt(self, stats: CallSiteStats, factory: Callable[[], Awaitable[T]], hedge: bool) -> T:
+        hedge_after = stats.percentile(0.95) if hedge and self.hedge and len(stats.latencies) >= self.hedge_min_samples else None
+        if hedge_after is None:
+            return await factory()
+
+        primary = asyncio.ensure_future(factory())
+        primary.add_done_callback(_retrieve_exception)
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+            if done:
+                return primary.result()
+
+            # Request chậm hơn p95: gửi thêm một request giống hệt, lấy kết quả nào về trước
+            stats.hedges += 1
+            hedged = asyncio.ensure_future(factory())
+            hedged.add_done_callback(_retrieve_exception)
+            tasks.append(hedged)
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            stats.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # Hủy request còn lại, kể cả khi bị hủy vì hết deadline
+            for task in tasks:
+                task.cancel()
+
+    async def _backoff(self, site: str, stats: CallSiteStats, error: Exception, attempt: int, deadline: float) -> None:
+        await asyncio.sleep(self._retry_delay(site, stats, error, attempt, deadline))
+
+    def _retry_delay(self, site: str, stats: CallSiteStats, error: Exception, attempt: int, deadline: float) -> float:
+        """Delay before retrying after `error`; re-raises it if the call must not be retried."""
+        if not is_retryable(error) or attempt >= self.max_retries:
+            stats.errors += 1
+            raise error
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+        delay = max(delay, retry_after(error) or 0.0)
+        if time.monotonic() + delay >= deadline:
+            stats.errors += 1
+            raise error
+        stats.retries += 1
+        return delay
+
+    def record_usage(self, site: str, usage: Any) -> None:
+        """Count the input/output (and prompt cache) tokens of one response under `site`."""
+        for kind, count in token_counts(usage).items():
+            llm_tokens.inc(count, site=site, type=kind)
+
+    def stats(self) -> dict:
+        return {name: site.to_dict() for name, site in self._sites.items()}
+
+    async def aclose(self) -> None:
+        await self.http_client.aclose()
+        self.sync_http_client.close()
+
+
+def _retrieve_exception(task: asyncio.Future) -> None:
+    # Request thua trong hedging có thể kết thúc bằng lỗi sau khi đã bị bỏ qua
+    if not task.cancelled():
+        task.exception()
+
+
+async def _aclose(iterator: AsyncIterator) -> None:
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+llm_gateway = LLMGateway(
+    timeout=settings.LLM_TIMEOUT,
+    max_retries=settings.LLM_MAX_RETRIES,
+    backoff_base=settings.LLM_BACKOFF_BASE,
+    backoff_max=settings.LLM_BACKOFF_MAX,
+    hedge=settings.LLM_HEDGE,
+    hedge_min_samples=settings.LLM_HEDGE_MIN_SAMPLES,
+    max_connections=settings.LLM_MAX_CONNECTIONS,
+    stream_idle_timeout=settings.LLM_STREAM_IDLE_TIMEOUT,
+)
+
+
+class GatewayChatAnthropic(ChatAnthropic):
+    """
+    ChatAnthropic whose requests go through `llm_gateway`.
+
+    Uses the gateway's pooled clients instead of creating its own, and runs
+    each generation with the gateway's deadline, retries and (for
+    non-streaming calls) hedging under `call_site`. Streams read the final
+    message so their token usage is counted too; subclasses can see it by
+    overriding `_on_stream_usage`.
+    """
+
+    call_site: str = "anthropic"
+
+    @root_validator()
+    def use_gateway_clients(cls, values: Dict) -> Dict:
+        values["_client"], values["_async_client"] = llm_gateway.anthropic_clients(
+            values["anthropic_api_key"].get_secret_value() or None,
+            values["anthropic_api_url"],
+            values.get("default_headers"),
+        )
+        return values
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        generate = super()._generate
+        return llm_gateway.call_sync(self.call_site, lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            # ChatAnthropic gom kết quả từ _astream, vốn đã đi qua gateway
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        generate = super()._agenerate
+        return await llm_gateway.call(
+            self.call_site, lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        )
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        chunks = llm_gateway.stream(
+            self.call_site, lambda: self._astream_attempt(messages, stop=stop, run_manager=run_manager, **kwargs)
+        )
+        async for chunk in chunks:
+            yield chunk
+
+    async def _astream_attempt(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        # Giống ChatAnthropic._astream (không dùng tool) nhưng đọc thêm usage của message cuối;
+        # gateway gọi lại hàm này khi cần retry
+        params = self._format_params(messages=messages, stop=stop, **kwargs)
+        async with self._async_client.messages.stream(**params) as stream:
+            async for text in stream.text_stream:
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+                if run_manager:
+                    await run_manager.on_llm_new_token(text, chunk=chunk)
+                yield chunk
+            final_message = await stream.get_final_message()
+        self._on_stream_usage(final_message.usage)
+
+    def _on_stream_usage(self, usage: Any) -> None:
+        llm_gateway.record_usage(self.call_site, usage)
@@ -0,0 +1,227 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+from .cache import LRUCache
+from .config import settings
+from .metrics import llm_queue_wait
+
+
+class Priority(IntEnum):
+    """LLM priority classes; a lower value is served first."""
+    INTERACTIVE = 0
+    GENERATION = 1
+    BACKGROUND = 2
+
+
+# Priority của request hiện tại; các task con (singleflight, refill) kế thừa theo context
+llm_priority: ContextVar[Priority] = ContextVar("llm_priority", default=Priority.INTERACTIVE)
+
+
+class LLMBusyError(Exception):
+    """Raised when an LLM request is not admitted; carries the HTTP status and a Retry-After hint."""
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: float = 1.0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `burst` requests at once, refilled at `rate` requests per second."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available, 0 if one is available now."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> float:
+        """Take one token; return 0 on success, otherwise the seconds until one is available."""
+        wait = self.wait_time()
+        if not wait:
+            self.tokens -= 1
+        return wait
+
+
+class LLMScheduler:
+    """
+    Admission control and priority scheduling for LLM calls.
+
+    `admit` charges a request to the token buckets of its session and of its
+    client IP, so one student cannot use up the provider rate limit, even by
+    sending a new session id with every request. `slot` bounds the number of
+    concurrent LLM calls to `concurrency`. When all slots are busy, callers
+    wait and are served by priority class (FIFO within a class). Interactive
+    and generation calls are rejected with `LLMBusyError` when `queue_size`
+    calls are already waiting or after `max_wait` seconds in the queue.
+    Background calls always wait. `slot_sync` takes the same slots from a
+    worker thread while the event loop runs.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        queue_size: int,
+        max_wait: float,
+        session_rate: float,
+        session_burst: float,
+        ip_rate: float = 0.0,
+        ip_burst: float = 0.0,
+    ):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.session_rate = session_rate
+        self.session_burst = session_burst
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self._running = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._buckets = LRUCache(maxsize=10000, ttl=3600)
+        # Event loop sở hữu hàng đợi, để slot_sync gửi yêu cầu lấy slot từ thread khác
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.rejected: Counter = Counter()
+
+    def admit(self, session_id: Optional[str], client_ip: str, priority: Priority) -> None:
+        """
+        Charge one request to its session and client IP and run the rest of the request at `priority`.
+
+        A token is only taken when both buckets have one, so a rejected
+        request does not use up the other bucket.
+
+        Raises:
+            LLMBusyError: (429) if the session or the IP is sending requests too fast
+        """
+        llm_priority.set(priority)
+        buckets = []
+        if self.ip_rate > 0:
+            buckets.append(self._bucket(("ip", client_ip), self.ip_rate, self.ip_burst))
+        if session_id and self.session_rate > 0:
+            buckets.append(self._bucket(("session", session_id), self.session_rate, self.session_burst))
+        wait = max((bucket.wait_time() for bucket in buckets), default=0.0)
+        if wait:
+            self.rejected["rate_limited"] += 1
+            raise LLMBusyError(
+                "Bạn đang gửi yêu cầu quá nhanh, vui lòng chờ một chút rồi thử lại.", status_code=429, retry_after=wait
+            )
+        for bucket in buckets:
+            bucket.take()
+
+    def _bucket(self, key: Tuple[str, str], rate: float, burst: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst)
+            self._buckets.set(key, bucket)
+        return bucket
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one of the concurrent LLM call slots, at the current request's priority."""
+        priority = llm_priority.get()
+        self._loop = asyncio.get_running_loop()
+        started_at = time.monotonic()
+        await self._acquire(priority)
+        llm_queue_wait.observe(time.monotonic() - started_at, priority=priority.name.lower())
+        try:
+            yield
+        finally:
+            self._release()
+
+    @contextmanager
+    def slot_sync(self) -> Iterator[None]:
+        """
+        Blocking `slot` for synchronous LLM calls made from a worker thread.
+
+        Without a running event loop (scripts, benchmarks) there are no async
+        calls to share the slots with, so the call runs at once.
+        """
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            yield
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            raise RuntimeError("slot_sync() would block the event loop, use slot() instead")
+        priority = llm_priority.get()
+        started_at = time.monotonic()
+        asyncio.run_coroutine_threadsafe(self._acquire(priority), loop).result()
+        llm_queue_wait.observe(time.monotonic() - started_at, priority=priority.name.lower())
+        try:
+            yield
+        finally:
+            loop.call_soon_threadsafe(self._release)
+
+    async def _acquire(self, priority: Priority) -> None:
+        if self._running < self.concurrency and not self._queue:
+            self._running += 1
+            return
+        waiting = sum(1 for entry in self._queue if entry[0] != Priority.BACKGROUND)
+        if priority != Priority.BACKGROUND and waiting >= self.queue_size:
+            self.rejected["queue_full"] += 1
+            raise LLMBusyError("Hệ thống đang bận, vui lòng thử lại sau ít giây.", retry_after=2.0)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (int(priority), next(self._order), future)
+        heapq.heappush(self._queue, entry)
+        timeout = None if priority == Priority.BACKGROUND else self.max_wait
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Slot đã được chuyển cho request này ngay lúc nó bị hủy: trả lại
+                self._release()
+            else:
+                future.cancel()
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected["wait_timeout"] += 1
+                raise LLMBusyError("Hệ thống đang bận, vui lòng thử lại sau ít giây.", retry_after=2.0)
+            raise
+
+    def _release(self) -> None:
+        # Chuyển slot thẳng cho request đang chờ có priority cao nhất
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._running -= 1
+
+    def stats(self) -> dict:
+        waiting = Counter(Priority(entry[0]).name.lower() for entry in self._queue)
+        return {
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "waiting": {priority.name.lower(): waiting[priority.name.lower()] for priority in Priority},
+            "rejected": dict(self.rejected),
+        }
+
+
+llm_scheduler = LLMScheduler(
+    concurrency=settings.LLM_CONCURRENCY,
+    queue_size=settings.LLM_QUEUE_SIZE,
+    max_wait=settings.LLM_QUEUE_TIMEOUT,
+    session_rate=settings.LLM_SESSION_RATE,
+    session_burst=settings.LLM_SESSION_BURST,
+    ip_rate=settings.LLM_IP_RATE,
+    ip_burst=settings.LLM_IP_BURST,
+)
@@ -0,0 +1,299 @@
+import asyncio
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .config import settings
+
+# Bucket (giây) cho request HTTP; SSE có thể kéo dài đến hết câu trả lời của LLM
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+EXECUTION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+LabelValues = Tuple[str, ...]
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+
+class Metric:
+    """Base class: a named metric family with a fixed set of label names."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, Sequence[Tuple[str, str]], float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing value per label set."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, value: float, **labels: object) -> None:
+        """Copy a total counted elsewhere (e.g. cache hits), at scrape time."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, list(zip(self.labelnames, key)), value
+
+
+class Gauge(Counter):
+    """Value that can go up and down per label set."""
+
+    type = "gauge"
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative `le` buckets, with their sum and count."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = REQUEST_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Mỗi label set: số quan sát theo từng bucket (không cộng dồn, bucket cuối là +Inf), tổng và số lượng
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(counts), total[0]) for key, (counts, total) in self._values.items())
+        for key, counts, total in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + [("le", format_value(bound))], cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class MetricsRegistry:
+    """
+    In-process metrics rendered in the Prometheus text exposition format.
+
+    Counters and histograms are updated where the work happens. Values that
+    other components already keep (cache hit counters, queue depths) are
+    copied in by callbacks registered with `on_collect`, which run on each
+    scrape.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = REQUEST_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def on_collect(self, callback: Callable[[], None]) -> None:
+        self._collectors.append(callback)
+
+    def render(self) -> str:
+        for callback in self._collectors:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Metrics collector {callback.__name__} failed: {e}")
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "Time from receiving a request to sending the last byte of its response.",
+    ("method", "route", "status"),
+)
+http_time_to_first_byte = registry.histogram(
+    "http_time_to_first_byte_seconds", "Time from receiving a request to sending the first byte of its body.",
+    ("method", "route"),
+)
+llm_call_duration = registry.histogram(
+    "llm_call_duration_seconds", "Duration of the successful attempt of each LLM call (streams: until the last chunk).",
+    ("site",), LLM_BUCKETS,
+)
+llm_time_to_first_chunk = registry.histogram(
+    "llm_time_to_first_chunk_seconds", "Time until a streamed LLM call produced its first chunk.",
+    ("site",), LLM_BUCKETS,
+)
+llm_queue_wait = registry.histogram(
+    "llm_queue_wait_seconds", "Time spent waiting for an LLM concurrency slot.",
+    ("priority",), LLM_BUCKETS,
+)
+llm_tokens = registry.counter(
+    "llm_tokens_total", "Tokens reported by the provider (input, output, cache_read, cache_write).",
+    ("site", "type"),
+)
+agent_iterations = registry.histogram(
+    "agent_iterations", "ReAct tool-use steps taken before the agent answered.",
+    ("agent",), (0, 1, 2, 3, 4, 5),
+)
+execution_queue_wait = registry.histogram(
+    "execution_queue_wait_seconds", "Time a code execution job waited for a sandbox slot.",
+    ("job",), EXECUTION_BUCKETS,
+)
+execution_run_time = registry.histogram(
+    "execution_run_seconds", "Time a code execution job ran in the sandbox.",
+    ("job",), EXECUTION_BUCKETS,
+)
+execution_rejected = registry.counter(
+    "execution_rejected_total", "Code execution jobs rejected because the queue was full.",
+)
+
+# Các giá trị dưới đây được copy từ component sở hữu chúng mỗi lần scrape (xem `on_collect`)
+cache_hits = registry.counter("cache_hits_total", "Cache lookups that found an entry.", ("cache",))
+cache_misses = registry.counter("cache_misses_total", "Cache lookups that found nothing.", ("cache",))
+cache_hit_ratio = registry.gauge("cache_hit_ratio", "Share of cache lookups that were hits since startup.", ("cache",))
+cache_entries = registry.gauge("cache_entries", "Entries currently held by a cache.", ("cache",))
+llm_calls = registry.counter("llm_calls_total", "LLM calls started, per call site.", ("site",))
+llm_retries = registry.counter("llm_retries_total", "LLM call attempts retried after a transient error.", ("site",))
+llm_errors = registry.counter("llm_errors_total", "LLM calls that failed after their last attempt.", ("site",))
+llm_timeouts = registry.counter("llm_timeouts_total", "LLM calls that hit their deadline.", ("site",))
+llm_hedges = registry.counter("llm_hedges_total", "Hedged duplicate LLM requests sent.", ("site",))
+llm_running = registry.gauge("llm_running", "LLM calls currently holding a concurrency slot.")
+llm_waiting = registry.gauge("llm_waiting", "LLM calls waiting for a concurrency slot.", ("priority",))
+llm_rejected = registry.counter("llm_rejected_total", "LLM requests rejected by admission control.", ("reason",))
+llm_coalesced = registry.counter("llm_coalesced_total", "Requests served by another identical in-flight LLM call.", ("endpoint",))
+execution_waiting = registry.gauge("execution_waiting", "Code execution jobs waiting for a sandbox slot.")
+
+event_loop_lag = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop woke up a periodic timer; high values mean blocking code.",
+    (), LOOP_LAG_BUCKETS,
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template, method and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started_at = time.perf_counter()
+        status = 500
+        first_byte = False
+
+        async def send_timed(message):
+            nonlocal status, first_byte
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not first_byte:
+                first_byte = True
+                http_time_to_first_byte.observe(
+                    time.perf_counter() - started_at, method=scope["method"], route=route_name(scope)
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            http_request_duration.observe(
+                time.perf_counter() - started_at, method=scope["method"], route=route_name(scope), status=status
+            )
+
+
+def route_name(scope) -> str:
+    # Dùng path template của route (/api/theory/{lesson_id}) để số label không tăng theo URL
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class EventLoopMonitor:
+    """Measures event loop lag by sleeping `interval` seconds and timing how late the wakeup is."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            event_loop_lag.observe(max(0.0, time.perf_counter() - started_at - self.interval))
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+loop_monitor = EventLoopMonitor(settings.METRICS_LOOP_INTERVAL)
@@ -21,4 +21,6 @@ class AgentResponse(BaseModel):
 class CodeRequest(BaseModel):
     """Model for code execution requests."""
     code: str
-    unit_test: Optional[str] = None 
\ No newline at end of file
+    unit_test: Optional[str] = None
+    parallel: Optional[bool] = False
+    session_id: Optional[str] = None 
\ No newline at end of file
@@ -0,0 +1,82 @@
+from typing import Any, Dict, List, Optional
+
+from langchain.prompts import PromptTemplate
+from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.prompts.chat import BaseChatPromptTemplate
+
+from .llm_gateway import GatewayChatAnthropic
+
+# Đánh dấu điểm kết thúc của một prefix được Anthropic cache (TTL 5 phút)
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+class CachedPrefixPromptTemplate(BaseChatPromptTemplate):
+    """
+    Chat prompt made of stable prefix blocks followed by the variable part.
+
+    Formats to one user message whose content blocks are the rendered
+    `prefixes`, each marked with `cache_control`, then the rendered `suffix`.
+    Put the most widely shared text first (tutor instructions, then the
+    exercise) so every request for the same exercise reuses the cached prefix,
+    and keep per-turn text (history, question, agent scratchpad) in `suffix`.
+    """
+
+    prefixes: List[PromptTemplate]
+    suffix: PromptTemplate
+
+    @classmethod
+    def from_templates(cls, prefixes: List[str], suffix: str) -> "CachedPrefixPromptTemplate":
+        prefix_prompts = [PromptTemplate.from_template(template) for template in prefixes]
+        suffix_prompt = PromptTemplate.from_template(suffix)
+        input_variables = sorted({
+            variable
+            for prompt in prefix_prompts + [suffix_prompt]
+            for variable in prompt.input_variables
+        })
+        return cls(prefixes=prefix_prompts, suffix=suffix_prompt, input_variables=input_variables)
+
+    def format_messages(self, **kwargs: Any) -> List[BaseMessage]:
+        kwargs = self._merge_partial_and_user_variables(**kwargs)
+        content: List[Dict[str, Any]] = [
+            {"type": "text", "text": prompt.format(**_select(prompt, kwargs)), "cache_control": dict(CACHE_CONTROL)}
+            for prompt in self.prefixes
+        ]
+        content.append({"type": "text", "text": self.suffix.format(**_select(self.suffix, kwargs))})
+        return [HumanMessage(content=content)]
+
+    @property
+    def _prompt_type(self) -> str:
+        return "cached-prefix-chat"
+
+
+def _select(prompt: PromptTemplate, values: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: values[key] for key in prompt.input_variables}
+
+
+class CachingChatAnthropic(GatewayChatAnthropic):
+    """
+    ChatAnthropic that sends `cache_control` markers.
+
+    langchain-anthropic rebuilds text blocks without their `cache_control`
+    key, so the markers set by `CachedPrefixPromptTemplate` are put back on
+    the formatted request here. Cache read/write tokens are counted by the
+    gateway in `llm_tokens_total`.
+    """
+
+    def _format_params(self, *, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs: Any) -> Dict:
+        params = super()._format_params(messages=messages, stop=stop, **kwargs)
+        cached_texts = {
+            block["text"]
+            for message in messages
+            if isinstance(message.content, list)
+            for block in message.content
+            if isinstance(block, dict) and block.get("cache_control")
+        }
+        if cached_texts:
+            for message in params["messages"]:
+                if not isinstance(message["content"], list):
+                    continue
+                for block in message["content"]:
+                    if block.get("type") == "text" and block.get("text") in cached_texts:
+                        block["cache_control"] = dict(CACHE_CONTROL)
+        return params
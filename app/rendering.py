@@ -0,0 +1,86 @@
+import hashlib
+import html
+import re
+import threading
+from typing import Dict, Optional
+
+import markdown2
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexer import Lexer
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
+
+from .cache import LRUCache
+from .config import settings
+
+CODE_BLOCK_PATTERN = re.compile(r'```(\w+)?\n(.*?)```', flags=re.DOTALL)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CodeRenderer:
+    """
+    Markdown to HTML with Pygments-highlighted code blocks.
+
+    The formatter and lexers are created once and reused. Highlighted blocks
+    are cached by (language, code hash) and whole rendered documents by
+    content hash, both with LRU eviction, so repeated snippets and messages
+    are not highlighted again. The stylesheet is generated once and served
+    separately, so rendered HTML only carries CSS classes.
+    """
+
+    def __init__(self, style: str, cache_size: int):
+        self.formatter = HtmlFormatter(style=style)
+        self.css = self.formatter.get_style_defs('.highlight')
+        self.css_etag = f'"{content_hash(self.css)[:32]}"'
+        self.blocks = LRUCache(cache_size)
+        self.documents = LRUCache(cache_size)
+        self._lexers: Dict[str, Optional[Lexer]] = {}
+        self._lexers_lock = threading.Lock()
+
+    def lexer(self, language: str) -> Optional[Lexer]:
+        """Shared lexer for `language`, or None if Pygments does not know it."""
+        with self._lexers_lock:
+            if language not in self._lexers:
+                try:
+                    self._lexers[language] = get_lexer_by_name(language)
+                except ClassNotFound:
+                    self._lexers[language] = None
+            return self._lexers[language]
+
+    def highlight(self, code: str, language: str = 'python') -> str:
+        key = (language, content_hash(code))
+        rendered = self.blocks.get(key)
+        if rendered is None:
+            lexer = self.lexer(language)
+            if lexer is None:
+                # Ngôn ngữ không được hỗ trợ thì giữ nguyên code block
+                rendered = f'<pre><code class="{language}">{html.escape(code)}</code></pre>'
+            else:
+                rendered = highlight(code, lexer, self.formatter)
+            self.blocks.set(key, rendered)
+        return rendered
+
+    def render_markdown(self, content: str) -> str:
+        """Render markdown, highlighting ```language code blocks (python if no language is given)."""
+        key = content_hash(content)
+        rendered = self.documents.get(key)
+        if rendered is None:
+            highlighted = CODE_BLOCK_PATTERN.sub(
+                lambda match: self.highlight(match.group(2), match.group(1) or 'python'), content
+            )
+            rendered = markdown2.markdown(highlighted)
+            self.documents.set(key, rendered)
+        return rendered
+
+    def stats(self) -> dict:
+        return {
+            "blocks": {"size": len(self.blocks), "hits": self.blocks.hits, "misses": self.blocks.misses},
+            "documents": {"size": len(self.documents), "hits": self.documents.hits, "misses": self.documents.misses},
+        }
+
+
+renderer = CodeRenderer(settings.RENDER_STYLE, settings.RENDER_CACHE_SIZE)
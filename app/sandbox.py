@@ -0,0 +1,373 @@
+import io
+import marshal
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+from typing import Any, Callable, List, Optional, Union
+
+# Các module được import sẵn trong worker để học viên không phải trả chi phí import mỗi lần chạy
+import collections
+import functools
+import itertools
+import json
+import math
+import random
+import re
+import string
+import typing
+import unittest
+
+from .config import settings
+from .test_harness import run_test_case, summarize
+
+# Chu kỳ flush output đang nằm trong buffer về server khi chạy ở chế độ stream
+STREAM_FLUSH_INTERVAL = 0.05
+
+ChunkCallback = Callable[[str, str], None]
+
+
+class OutputLimitExceeded(BaseException):
+    """
+    Raised inside student code once it has written more than the allowed output.
+
+    Derives from BaseException so a bare `except Exception` in student code
+    cannot swallow it and keep printing.
+    """
+
+
+class _OutputBudget:
+    """Total number of characters a single run may still write, shared by stdout and stderr."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.remaining = limit
+
+
+class _CappedWriter(io.TextIOBase):
+    """
+    Text stream that collects writes in a fixed-size buffer and hands them to
+    `sink` in chunks, enforcing the run's output budget.
+    """
+
+    def __init__(self, sink: Callable[[str], None], budget: _OutputBudget, buffer_size: int, lock: threading.RLock = None):
+        self._sink = sink
+        self._budget = budget
+        self._buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+        self._lock = lock or threading.RLock()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        with self._lock:
+            if self._budget.remaining <= 0:
+                raise OutputLimitExceeded
+            accepted = text[:self._budget.remaining]
+            self._budget.remaining -= len(accepted)
+            self._buffer.append(accepted)
+            self._buffered += len(accepted)
+            if len(accepted) < len(text):
+                self.flush()
+                raise OutputLimitExceeded
+            if self._buffered >= self._buffer_size:
+                self.flush()
+            return len(text)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._buffer:
+                self._sink("".join(self._buffer))
+                self._buffer = []
+                self._buffered = 0
+
+
+def _truncated_notice(budget: _OutputBudget) -> str:
+    return f"\n... Output đã bị cắt vì vượt quá {budget.limit} ký tự."
+
+
+def _load_code(code: Union[str, bytes]):
+    """Turn a marshalled code object back into something `exec` accepts; source passes through."""
+    return marshal.loads(code) if isinstance(code, bytes) else code
+
+
+def execute_code(code: Union[str, bytes], namespace: dict = None) -> str:
+    """
+    Execute Python code in the current process and return the captured stdout.
+
+    This is the low-level routine run inside a sandbox worker; API handlers should
+    go through `SandboxPool.run` instead of calling it directly.
+    """
+    output = io.StringIO()
+    budget = _OutputBudget(settings.SANDBOX_MAX_OUTPUT_CHARS)
+    writer = _CappedWriter(output.write, budget, settings.SANDBOX_STREAM_BUFFER_CHARS)
+    try:
+        # Create a new namespace if none is provided
+        if namespace is None:
+            namespace = {}
+
+        # Add builtins to namespace
+        namespace.update({'__builtins__': __builtins__})
+
+        with redirect_stdout(writer):
+            exec(_load_code(code), namespace)
+        writer.flush()
+        return output.getvalue()
+    except OutputLimitExceeded:
+        writer.flush()
+        return output.getvalue() + _truncated_notice(budget)
+    except (Exception, SystemExit):
+        return f"Error executing code:\n{traceback.format_exc()}"
+    finally:
+        output.close()
+
+
+def stream_code(code: Union[str, bytes], namespace: Optional[dict], conn) -> None:
+    """
+    Execute Python code, sending stdout/stderr chunks over `conn` as they are produced.
+
+    Tracebacks are written to the stderr stream, so the caller only needs the chunks.
+    """
+    budget = _OutputBudget(settings.SANDBOX_MAX_OUTPUT_CHARS)
+    # Dùng chung một lock để stdout, stderr và thread flush không gửi xen kẽ vào pipe
+    lock = threading.RLock()
+    buffer_size = settings.SANDBOX_STREAM_BUFFER_CHARS
+    stdout = _CappedWriter(lambda text: conn.send(("chunk", "stdout", text)), budget, buffer_size, lock)
+    stderr = _CappedWriter(lambda text: conn.send(("chunk", "stderr", text)), budget, buffer_size, lock)
+
+    # Flush định kỳ để output hiện ra ngay cả khi code đang chờ hoặc tính toán lâu
+    finished = threading.Event()
+
+    def flush_periodically():
+        while not finished.wait(STREAM_FLUSH_INTERVAL):
+            stdout.flush()
+            stderr.flush()
+
+    flusher = threading.Thread(target=flush_periodically, daemon=True)
+    flusher.start()
+
+    if namespace is None:
+        namespace = {}
+    namespace.update({'__builtins__': __builtins__})
+    notice = None
+    try:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            exec(_load_code(code), namespace)
+    except OutputLimitExceeded:
+        notice = _truncated_notice(budget)
+    except (Exception, SystemExit):
+        notice = f"Error executing code:\n{traceback.format_exc()}"
+    finished.set()
+    flusher.join()
+    stdout.flush()
+    stderr.flush()
+    if notice:
+        conn.send(("chunk", "stderr", notice))
+
+
+def execute_unit_tests(code: str, unit_test: str, test_names: Optional[List[str]] = None) -> dict:
+    """Run the unit tests (optionally only `test_names`) against student code and return the structured report."""
+    output = io.StringIO()
+    budget = _OutputBudget(settings.SANDBOX_MAX_OUTPUT_CHARS)
+    writer = _CappedWriter(output.write, budget, settings.SANDBOX_STREAM_BUFFER_CHARS)
+    setup_output = []
+
+    def mark_setup_done():
+        writer.flush()
+        setup_output.append(output.getvalue())
+
+    try:
+        # Chỉ khi chạy một nhóm test mới cần tách output ở module level để gộp các nhóm
+        report = run_test_case(code, unit_test, writer, test_names, mark_setup_done if test_names is not None else None)
+    except OutputLimitExceeded:
+        report = summarize([], error=f"Error executing code:{_truncated_notice(budget)}")
+    writer.flush()
+    report["output"] = output.getvalue()
+    if setup_output:
+        report["setup_output"] = setup_output[0]
+    # Output bị cắt thì kết quả phụ thuộc vào giới hạn output, không được cache
+    report["truncated"] = budget.remaining <= 0
+    return report
+
+
+def _worker_main(conn) -> None:
+    """Worker loop: nhận job qua pipe, chạy code và gửi kết quả trả về."""
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+        kind, *args = job
+        if kind == "stream":
+            stream_code(*args, conn)
+            conn.send(("done", ""))
+        elif kind == "unit_test":
+            conn.send(("done", execute_unit_tests(*args)))
+        else:
+            conn.send(("done", execute_code(*args)))
+    conn.close()
+
+
+def _get_context():
+    """
+    Start workers from a forkserver that has already imported this module.
+
+    The API process runs many threads (executor, event loop, trace writer),
+    and forking it directly can leave a child stuck on a lock another thread
+    held. The forkserver is a fresh single-threaded process, so workers forked
+    from it are safe and still start warm. Fall back to spawn where
+    forkserver is unavailable.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class SandboxError(Exception):
+    """Raised when a job could not finish because its worker timed out or crashed."""
+
+
+class SandboxWorker:
+    """A single warm worker process that takes jobs over a pipe."""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def run(self, job: tuple, timeout: float, on_chunk: Optional[ChunkCallback] = None) -> Any:
+        """
+        Send one job to the worker and wait for its result.
+
+        Streaming jobs send output chunks before the result; each one is passed
+        to `on_chunk(stream_name, text)` as soon as it arrives.
+        """
+        self.jobs += 1
+        deadline = time.monotonic() + timeout
+        self.conn.send(job)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.conn.poll(remaining):
+                raise TimeoutError
+            kind, *payload = self.conn.recv()
+            if kind == "chunk":
+                on_chunk(*payload)
+                continue
+            return payload[0]
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def stop(self) -> None:
+        """Ask the worker to exit, killing it if it does not comply."""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=1)
+        self.kill()
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    Pool of warm worker processes that execute student code.
+
+    Workers are recycled after `max_jobs_per_worker` jobs, and replaced
+    immediately if they crash or exceed `timeout`.
+    """
+
+    def __init__(self, size: int, max_jobs_per_worker: int, timeout: float):
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.timeout = timeout
+        self._context = None
+        self._idle: "queue.Queue[SandboxWorker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self) -> None:
+        """Start all workers up front so the first requests hit warm processes."""
+        with self._lock:
+            if self._started:
+                return
+            self._context = _get_context()
+            for _ in range(self.size):
+                self._idle.put(SandboxWorker(self._context))
+            self._started = True
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._started = False
+            while True:
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                worker.stop()
+
+    def run(self, code: Union[str, bytes], namespace: dict = None, on_chunk: Optional[ChunkCallback] = None) -> str:
+        """
+        Run code on an idle worker, blocking until one is available.
+
+        `code` is either source text or a marshalled code object. With
+        `on_chunk` the output is streamed to the callback instead of being
+        returned. Raises `SandboxError` if the worker times out or crashes.
+        """
+        job = ("stream", code, namespace) if on_chunk else ("exec", code, namespace)
+        return self._dispatch(job, on_chunk)
+
+    def run_unit_tests(self, code: str, unit_test: str, test_names: Optional[List[str]] = None) -> dict:
+        """Run unit tests (optionally only `test_names`) on an idle worker and return the structured report."""
+        return self._dispatch(("unit_test", code, unit_test, test_names))
+
+    def _dispatch(self, job: tuple, on_chunk: Optional[ChunkCallback] = None) -> Any:
+        self.start()
+        worker = self._idle.get()
+        try:
+            return worker.run(job, self.timeout, on_chunk)
+        except TimeoutError:
+            worker.kill()
+            raise SandboxError(f"TimeoutError: Code chạy quá {self.timeout:g} giây và đã bị dừng.")
+        except (EOFError, OSError):
+            worker.kill()
+            raise SandboxError("Sandbox worker crashed while running the code.")
+        except BaseException:
+            # Ví dụ: client đóng stream giữa chừng, worker vẫn đang chạy job nên phải dừng nó
+            worker.kill()
+            raise
+        finally:
+            self._release(worker)
+
+    def _release(self, worker: SandboxWorker) -> None:
+        """Return a worker to the pool, replacing it if it is dead or used up."""
+        with self._lock:
+            if not self._started:
+                worker.stop()
+                return
+            if worker.jobs >= self.max_jobs_per_worker or not worker.is_alive():
+                worker.stop()
+                worker = SandboxWorker(self._context)
+            self._idle.put(worker)
+
+
+sandbox_pool = SandboxPool(
+    size=settings.SANDBOX_WORKERS,
+    max_jobs_per_worker=settings.SANDBOX_MAX_JOBS_PER_WORKER,
+    timeout=settings.SANDBOX_TIMEOUT,
+)
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from .config import settings
+from .metrics import execution_queue_wait, execution_rejected, execution_run_time
+
+
+class QueueFullError(Exception):
+    """Raised when the execution queue has no room for another job."""
+
+
+@dataclass
+class ExecutionResult:
+    """Result of a scheduled job together with its timing information."""
+    value: Any
+    queue_wait_ms: float
+    run_ms: float
+
+    def timing(self) -> dict:
+        return {
+            "queue_wait_ms": round(self.queue_wait_ms, 2),
+            "run_ms": round(self.run_ms, 2),
+        }
+
+
+class ExecutionScheduler:
+    """
+    Runs blocking code execution jobs off the event loop.
+
+    At most `concurrency` jobs run at the same time; up to `queue_size` more
+    may wait for a slot. Anything beyond that is rejected immediately with
+    `QueueFullError` so the caller can answer with 429 instead of hanging.
+    """
+
+    def __init__(self, concurrency: int, queue_size: int):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="execution")
+        self._semaphore = None
+        self._waiting = 0
+
+    def check_capacity(self) -> None:
+        """Raise `QueueFullError` if a new job would not fit in the queue."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self._semaphore.locked() and self._waiting >= self.queue_size:
+            execution_rejected.inc()
+            raise QueueFullError(
+                f"Hàng đợi chạy code đã đầy ({self.queue_size} job đang chờ), vui lòng thử lại sau."
+            )
+
+    async def submit(self, func: Callable[..., Any], *args: Any) -> ExecutionResult:
+        """
+        Wait for a free slot, run `func(*args)` in a worker thread and time both phases.
+
+        The slot is held until the job finishes, even if the caller is cancelled first.
+        """
+        self.check_capacity()
+        enqueued_at = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        loop = asyncio.get_running_loop()
+        started_at = time.perf_counter()
+        job = self._executor.submit(func, *args)
+        # Nhả slot khi job thật sự kết thúc: request bị hủy (client ngắt kết nối) không
+        # dừng được thread đang chạy, nên slot phải được giữ đến lúc đó
+        job.add_done_callback(lambda _: self._release_threadsafe(loop))
+        value = await asyncio.wrap_future(job)
+        finished_at = time.perf_counter()
+        execution_queue_wait.observe(started_at - enqueued_at, job=func.__name__)
+        execution_run_time.observe(finished_at - started_at, job=func.__name__)
+
+        return ExecutionResult(
+            value=value,
+            queue_wait_ms=(started_at - enqueued_at) * 1000,
+            run_ms=(finished_at - started_at) * 1000,
+        )
+
+    def _release_threadsafe(self, loop: asyncio.AbstractEventLoop) -> None:
+        try:
+            loop.call_soon_threadsafe(self._semaphore.release)
+        except RuntimeError:
+            # Event loop đã đóng (server đang tắt)
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "waiting": self._waiting,
+        }
+
+
+execution_scheduler = ExecutionScheduler(
+    concurrency=settings.EXECUTION_CONCURRENCY,
+    queue_size=settings.EXECUTION_QUEUE_SIZE,
+)
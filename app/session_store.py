@@ -0,0 +1,207 @@
+import asyncio
+import functools
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from .cache import LRUCache
+from .config import settings
+
+
+@dataclass
+class Session:
+    """Per-student state kept on the server between requests."""
+
+    session_id: str
+    exercise: Dict[str, str] = field(default_factory=dict)
+    history: List[Dict[str, Any]] = field(default_factory=list)
+    code: Optional[str] = None
+    terminal_output: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Session":
+        return cls(**data)
+
+
+class SessionStore:
+    """
+    Base class for session backends.
+
+    Backends implement `_load`, `_save`, `delete` and `_transaction`;
+    `update` applies a request's changes inside one transaction so concurrent
+    requests for the same session do not overwrite each other. Endpoints use
+    `aget`/`aupdate`, which run the blocking calls in a thread so a busy
+    database never stalls the event loop.
+    """
+
+    def get(self, session_id: str) -> Optional[Session]:
+        return self._load(session_id)
+
+    async def aget(self, session_id: str) -> Optional[Session]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, session_id)
+
+    async def aupdate(self, session_id: str, **changes: Any) -> Session:
+        """Async `update`, with the same keyword arguments."""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self.update, session_id, **changes)
+        )
+
+    def update(
+        self,
+        session_id: str,
+        exercise: Optional[Dict[str, str]] = None,
+        code: Optional[str] = None,
+        terminal_output: Optional[str] = None,
+        history: Optional[List[Dict[str, Any]]] = None,
+        messages: Optional[List[Dict[str, Any]]] = None,
+    ) -> Session:
+        """
+        Apply the fields that were sent and return the updated session, creating it if needed.
+
+        `exercise` and `history` replace the stored values, `messages` are
+        appended to the history.
+        """
+        with self._transaction():
+            session = self._load(session_id) or Session(session_id)
+            if exercise is not None:
+                session.exercise = dict(exercise)
+            if code is not None:
+                session.code = code
+            if terminal_output is not None:
+                session.terminal_output = terminal_output
+            if history is not None:
+                session.history = list(history)
+            if messages:
+                session.history.extend(messages)
+            self._save(session)
+            return session
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        raise NotImplementedError
+
+    def _save(self, session: Session) -> None:
+        raise NotImplementedError
+
+    def _transaction(self):
+        """Context manager that makes a load/modify/save sequence atomic."""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions kept in this process, evicted by LRU and TTL. Only suitable for a single worker."""
+
+    def __init__(self, maxsize: int, ttl: Optional[float]):
+        self._cache = LRUCache(maxsize, ttl)
+        self._lock = threading.RLock()
+
+    def delete(self, session_id: str) -> None:
+        self._cache.pop(session_id)
+
+    # Chỉ thao tác trong bộ nhớ nên gọi thẳng, không cần chuyển sang thread
+    async def aget(self, session_id: str) -> Optional[Session]:
+        return self.get(session_id)
+
+    async def aupdate(self, session_id: str, **changes: Any) -> Session:
+        return self.update(session_id, **changes)
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        # Lưu dạng dict và tạo object mới mỗi lần đọc để giống backend SQLite
+        data = self._cache.get(session_id)
+        return Session.from_dict(data) if data is not None else None
+
+    def _save(self, session: Session) -> None:
+        self._cache.set(session.session_id, session.to_dict())
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        with self._lock:
+            yield
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions stored in a SQLite file, shared by all uvicorn workers on one host.
+
+    Expired sessions are ignored on read and deleted periodically.
+    """
+
+    # Số lần ghi giữa hai lần xóa các session đã hết hạn
+    PURGE_EVERY = 100
+
+    def __init__(self, path: str, ttl: Optional[float]):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._purge_expired()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        data, updated_at = row
+        if self.ttl and updated_at + self.ttl < time.time():
+            return None
+        return Session.from_dict(json.loads(data))
+
+    def _save(self, session: Session) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+                (session.session_id, json.dumps(session.to_dict(), ensure_ascii=False), time.time()),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._purge_expired()
+
+    def _purge_expired(self) -> None:
+        if self.ttl:
+            with self._lock:
+                self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # BEGIN IMMEDIATE giữ write lock của file DB nên các worker khác phải chờ
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+
+def create_session_store() -> SessionStore:
+    """Create the session backend selected by `SESSION_BACKEND` ("memory" or "sqlite")."""
+    ttl = settings.SESSION_TTL or None
+    if settings.SESSION_BACKEND == "sqlite":
+        return SQLiteSessionStore(settings.SESSION_DB_PATH, ttl)
+    if settings.SESSION_BACKEND != "memory":
+        raise ValueError(f"Unknown SESSION_BACKEND: {settings.SESSION_BACKEND}")
+    return MemorySessionStore(settings.SESSION_CACHE_SIZE, ttl)
+
+
+session_store = create_session_store()
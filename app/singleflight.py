@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+from collections import Counter
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, TypeVar
+
+from .config import settings
+
+T = TypeVar("T")
+
+
+def prompt_key(*parts: str) -> str:
+    """Hash identifying a request by its prompt (and anything else that changes the answer)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _retrieve_exception(task: asyncio.Future) -> None:
+    # Mọi request chờ đã ngắt kết nối thì lỗi của call chung không còn ai đọc
+    if not task.cancelled():
+        task.exception()
+
+
+class SharedStream:
+    """
+    One upstream stream fanned out to any number of subscribers.
+
+    Chunks are kept so a subscriber that joins late first replays what was
+    already produced. The upstream is cancelled once every subscriber has
+    gone away.
+    """
+
+    def __init__(self, source: AsyncIterator[Any]):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+        self.cancelled = False
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]) -> None:
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        self._subscribers += 1
+        index = 0
+        try:
+            while True:
+                changed = self._changed
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self._subscribers -= 1
+            if self._subscribers == 0 and not self.done:
+                self.cancelled = True
+                self.task.cancel()
+
+
+class Singleflight:
+    """
+    Coalesces identical in-flight requests into one upstream call.
+
+    Callers opt in per endpoint by routing a call through `do` (for a single
+    result) or `stream` (for an async iterator) with a key derived from the
+    prompt. While a call with the same key is running, later callers wait
+    for its result instead of starting their own. The shared call runs in
+    its own task, so one caller disconnecting does not fail the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, SharedStream] = {}
+        self.leaders: Counter = Counter()
+        self.coalesced: Counter = Counter()
+
+    async def do(self, name: str, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        key = f"{name}:{key}"
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders[name] += 1
+            task = asyncio.ensure_future(factory())
+            task.add_done_callback(_retrieve_exception)
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self._calls[key] = task
+        else:
+            self.coalesced[name] += 1
+        return await asyncio.shield(task)
+
+    def stream(self, name: str, key: str, factory: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        key = f"{name}:{key}"
+        shared = self._streams.get(key)
+        if shared is None or shared.cancelled:
+            self.leaders[name] += 1
+            shared = SharedStream(factory())
+            shared.task.add_done_callback(lambda _, shared=shared: self._discard_stream(key, shared))
+            self._streams[key] = shared
+        else:
+            self.coalesced[name] += 1
+        return shared.subscribe()
+
+    def _discard_stream(self, key: str, shared: SharedStream) -> None:
+        if self._streams.get(key) is shared:
+            del self._streams[key]
+
+    def stats(self) -> dict:
+        names: Set[str] = set(self.leaders) | set(self.coalesced)
+        return {
+            name: {
+                "upstream_calls": self.leaders[name],
+                "coalesced": self.coalesced[name],
+                "in_flight": sum(1 for key in list(self._calls) + list(self._streams) if key.startswith(f"{name}:")),
+            }
+            for name in sorted(names)
+        }
+
+
+def coalescing_enabled(endpoint: str) -> bool:
+    """Whether `endpoint` is listed in COALESCE_ENDPOINTS."""
+    return endpoint in {name.strip() for name in settings.COALESCE_ENDPOINTS.split(",")}
+
+
+singleflight = Singleflight()
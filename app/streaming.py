@@ -0,0 +1,81 @@
+import asyncio
+import concurrent.futures
+import json
+from typing import Any, AsyncIterator, Optional
+
+
+class ChannelClosed(Exception):
+    """Raised when a producer writes to a channel whose consumer has gone away."""
+
+
+class ChunkChannel:
+    """
+    Bounded hand-off of chunks from a worker thread to an async consumer.
+
+    The queue has a fixed size, so a producer that outpaces the client blocks
+    instead of piling output up in server memory.
+    """
+
+    # Chu kỳ kiểm tra xem consumer đã đóng channel chưa khi producer đang bị chặn
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, maxsize: int):
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._closed = False
+
+    def put_threadsafe(self, item: Any) -> None:
+        """Put an item from a non-event-loop thread, blocking while the queue is full."""
+        if self._closed:
+            raise ChannelClosed
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop)
+        while True:
+            try:
+                future.result(timeout=self.POLL_INTERVAL)
+                return
+            except concurrent.futures.TimeoutError:
+                if self._closed:
+                    future.cancel()
+                    raise ChannelClosed
+
+    async def put(self, item: Any) -> None:
+        await self._queue.put(item)
+
+    async def get(self) -> Any:
+        return await self._queue.get()
+
+    def close(self) -> None:
+        self._closed = True
+
+
+# Token đặc biệt trong iterator câu trả lời: bỏ phần đã stream, câu trả lời sẽ được gửi lại từ đầu
+ANSWER_RESET = object()
+
+
+def sse_event(data: Any, event: Optional[str] = None) -> str:
+    """Format one Server-Sent Events message with a JSON payload."""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_tokens(tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Turn an async iterator of answer tokens into SSE messages.
+
+    Sends one `token` event per chunk and a final `done` event carrying the
+    full response, or an `error` event if the iterator fails. `ANSWER_RESET`
+    becomes a `reset` event telling the client to clear what it has shown.
+    """
+    parts = []
+    try:
+        async for text in tokens:
+            if text is ANSWER_RESET:
+                parts.clear()
+                yield sse_event({}, "reset")
+                continue
+            parts.append(text)
+            yield sse_event({"text": text}, "token")
+    except Exception as e:
+        yield sse_event({"detail": str(e)}, "error")
+        return
+    yield sse_event({"response": "".join(parts)}, "done")
@@ -0,0 +1,248 @@
+import ast
+import builtins
+import time
+import traceback
+import unittest
+from contextlib import redirect_stdout
+from typing import Any, Callable, Dict, List, Optional, TextIO
+
+
+class StructuredTestResult(unittest.TestResult):
+    """TestResult that records one entry per test with its status, message and duration."""
+
+    def __init__(self):
+        super().__init__()
+        self.results: List[Dict[str, Any]] = []
+        self._started_at = 0.0
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._started_at = time.perf_counter()
+
+    def _record(self, test, status: str, message: str = "") -> None:
+        self.results.append({
+            "name": test.id().split('.')[-1],
+            "status": status,
+            "message": message,
+            "duration_ms": round((time.perf_counter() - self._started_at) * 1000, 3),
+        })
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._record(test, "passed")
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, "failed", str(err[1]))
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, "error", str(err[1]))
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, "skipped", reason)
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            status = "failed" if issubclass(err[0], test.failureException) else "error"
+            self._record(subtest, status, str(err[1]))
+
+
+def find_test_classes(namespace: dict, before: dict) -> List[type]:
+    """Return the TestCase subclasses that the unit test code added to `namespace`."""
+    return [
+        value for name, value in namespace.items()
+        if before.get(name) is not value
+        and isinstance(value, type)
+        and issubclass(value, unittest.TestCase)
+        and value is not unittest.TestCase
+    ]
+
+
+# Các base class của unittest mà TestCase trong unit test có thể kế thừa trực tiếp
+UNITTEST_BASES = ("TestCase", "IsolatedAsyncioTestCase")
+
+
+def _test_methods(node: ast.ClassDef) -> List[str]:
+    names = []
+    for item in node.body:
+        if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            names.append(item.name)
+        elif isinstance(item, ast.Assign):
+            names.extend(target.id for target in item.targets if isinstance(target, ast.Name))
+    return [name for name in names if name.startswith("test")]
+
+
+def discover_test_methods(unit_test: str) -> List[str]:
+    """
+    List the `test_*` methods of the TestCase classes in the unit test source without running it.
+
+    Bases are resolved through `unittest` imports and aliases, and methods
+    inherited from classes defined earlier in the unit test are included.
+    Returns an empty list, so the tests run as a single group, if the source
+    does not parse or a class's bases cannot be resolved from the unit test
+    alone (e.g. a base defined in the student's code, a metaclass or a class
+    decorator).
+    """
+    try:
+        tree = ast.parse(unit_test)
+    except (SyntaxError, ValueError):
+        return []
+
+    modules = set()
+    test_bases = set()
+    # Method test_* của từng class định nghĩa trong unit test, gồm cả method kế thừa
+    classes: Dict[str, List[str]] = {}
+    test_classes = set()
+
+    def resolve(base: ast.expr) -> Optional[bool]:
+        """True for a TestCase base, False for a known non-test base, None if unknown."""
+        if isinstance(base, ast.Attribute) and isinstance(base.value, ast.Name) and base.value.id in modules:
+            return base.attr in UNITTEST_BASES or None
+        if isinstance(base, ast.Name):
+            if base.id in test_bases or base.id in test_classes:
+                return True
+            if base.id in classes or hasattr(builtins, base.id):
+                return False
+        return None
+
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.update(alias.asname or alias.name for alias in node.names if alias.name == "unittest")
+        elif isinstance(node, ast.ImportFrom) and node.module == "unittest":
+            for alias in node.names:
+                if alias.name == "*":
+                    test_bases.update(UNITTEST_BASES)
+                elif alias.name in UNITTEST_BASES:
+                    test_bases.add(alias.asname or alias.name)
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            if resolve(node.value):
+                test_bases.add(node.targets[0].id)
+        elif isinstance(node, ast.ClassDef):
+            if node.decorator_list or node.keywords:
+                return []
+            kinds = [resolve(base) for base in node.bases]
+            if None in kinds:
+                return []
+            methods = [name for base in node.bases if isinstance(base, ast.Name) for name in classes.get(base.id, [])]
+            classes[node.name] = methods + _test_methods(node)
+            if any(kinds):
+                test_classes.add(node.name)
+                names.extend(classes[node.name])
+    return list(dict.fromkeys(names))
+
+
+def summarize(results: List[Dict[str, Any]], error: Optional[str] = None) -> Dict[str, Any]:
+    """Build a report dict from per-test results."""
+    failed = sum(1 for result in results if result["status"] in ("failed", "error"))
+    return {
+        "passed": error is None and failed == 0,
+        "total": len(results),
+        "failed": failed,
+        "results": results,
+        "error": error,
+    }
+
+
+def _test_output(report: Dict[str, Any]) -> str:
+    """Output a run printed after its module level code, or everything if the run never got that far."""
+    output = report.get("output", "")
+    setup_output = report.get("setup_output")
+    if setup_output is not None and output.startswith(setup_output):
+        return output[len(setup_output):]
+    return output
+
+
+def merge_reports(reports: List[Dict[str, Any]], order: List[str]) -> Dict[str, Any]:
+    """
+    Combine reports from runs over disjoint sets of test methods into one report.
+
+    Every run executes the module level code again, so the module level output
+    (`setup_output`) is kept once, from the first report, followed by what
+    each run printed during its tests.
+    """
+    position = {name: index for index, name in enumerate(order)}
+    results = [result for report in reports for result in report["results"]]
+    results.sort(key=lambda result: position.get(result["name"].split(' ')[0], len(order)))
+    error = next((report["error"] for report in reports if report["error"]), None)
+    merged = summarize(results, error=error)
+    setup_output = reports[0].get("setup_output", "") if reports else ""
+    merged["output"] = setup_output + "".join(_test_output(report) for report in reports)
+    merged["truncated"] = any(report.get("truncated") for report in reports)
+    return merged
+
+
+def run_test_case(
+    code: str,
+    unit_test: str,
+    stdout: TextIO,
+    test_names: Optional[List[str]] = None,
+    on_setup_done: Optional[Callable[[], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Execute student code and its unit tests, returning a structured report.
+
+    The student code and the unit test run in one shared namespace, then the
+    TestCase classes defined by the unit test are loaded directly. Anything the
+    code prints goes to `stdout`. If `test_names` is given only those test
+    methods are run. `on_setup_done` is called once both modules have run,
+    before the first test.
+    """
+    namespace = {'__builtins__': __builtins__}
+    results: List[Dict[str, Any]] = []
+    try:
+        with redirect_stdout(stdout):
+            exec(compile(code, "<student_code>", "exec"), namespace)
+            before = dict(namespace)
+            exec(compile(unit_test, "<unit_test>", "exec"), namespace)
+            if on_setup_done is not None:
+                on_setup_done()
+
+            test_classes = find_test_classes(namespace, before)
+            if not test_classes:
+                raise ValueError("Could not find test class in unit test code")
+
+            loader = unittest.TestLoader()
+            suite = unittest.TestSuite()
+            for test_class in test_classes:
+                if test_names is None:
+                    suite.addTests(loader.loadTestsFromTestCase(test_class))
+                else:
+                    suite.addTests(test_class(name) for name in test_names if hasattr(test_class, name))
+
+            result = StructuredTestResult()
+            suite(result)
+            results = result.results
+    except (Exception, SystemExit):
+        return summarize(results, error=f"Error executing code:\n{traceback.format_exc()}")
+    return summarize(results)
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Render a report as the Vietnamese text summary shown to the tutor agent."""
+    if report.get("error"):
+        return report["error"]
+
+    output = []
+    if report["passed"]:
+        output.append("✅ Tất cả unit test đã pass!")
+        output.append(f"Số lượng test đã pass: {report['total']}")
+    else:
+        output.append("❌ Một số unit test đã fail!")
+        output.append(f"Số lượng test đã chạy: {report['total']}")
+        output.append(f"Số lượng test fail: {report['failed']}")
+
+    for result in report["results"]:
+        if result["status"] == "passed":
+            output.append(f"✅ Test {result['name']} passed!")
+        elif result["status"] == "error":
+            output.append(f"❌ Test {result['name']} failed with error: {result['message']}")
+        elif result["status"] == "failed":
+            output.append(f"❌ Test {result['name']} failed: {result['message']}")
+        else:
+            output.append(f"⏭️ Test {result['name']} skipped: {result['message']}")
+
+    return '\n'.join(output)
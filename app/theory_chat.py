@@ -1,10 +1,14 @@
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
 from dotenv import load_dotenv
 import httpx
-from langchain_anthropic import ChatAnthropic
 from langchain.prompts import PromptTemplate
+from .cache import LRUCache
 from .config import settings
+from .lessons import tokenize
+from .history import create_history_manager
+from .llm_gateway import GatewayChatAnthropic
+from .singleflight import prompt_key, singleflight
 
 load_dotenv()
 
@@ -33,29 +37,66 @@ theory_chat_prompt = PromptTemplate(
     input_variables=["input", "chat_history", "theory_context"]
 )
 
-llm = ChatAnthropic(
+llm = GatewayChatAnthropic(
     model_name="claude-3-5-sonnet-20241022",
     anthropic_api_key=settings.ANTHROPIC_API_KEY,
     temperature=settings.ANTHROPIC_TEMPERATURE,
-    max_tokens=4096
+    max_tokens=4096,
+    call_site="theory_chat"
 )
 
-def format_chat_history(history: List[Dict[str, Any]]) -> str:
-    if not history:
-        return "Chưa có lịch sử trò chuyện."
-    formatted = []
-    for msg in history:
-        role = "Học viên" if msg.get("role") == "user" else "Tutor"
-        formatted.append(f"{role}: {msg.get('content', '')}")
-    return "\n".join(formatted)
-
-async def get_theory_chat_response(message: str, history: List[Dict[str, Any]], theory_context: str) -> str:
-    chat_history_str = format_chat_history(history)
-    prompt = theory_chat_prompt.format(
+history_manager = create_history_manager(llm)
+
+# Câu trả lời cho câu hỏi đầu tiên của một bài học, key theo (lesson_id, câu hỏi đã chuẩn hóa)
+answer_cache = LRUCache(settings.THEORY_ANSWER_CACHE_SIZE, settings.THEORY_ANSWER_CACHE_TTL)
+
+def answer_cache_key(lesson_id: Optional[str], message: str, history: List[Dict[str, Any]]) -> Optional[Tuple[str, str]]:
+    """
+    Cache key for a theory question, or None if the answer must not be cached.
+
+    Only questions asked without earlier questions in the conversation are
+    cached, since the answer would otherwise depend on that history. The
+    question is compared case-, whitespace-, punctuation- and
+    diacritics-insensitively.
+    """
+    if not lesson_id or any(msg.get("role") == "user" for msg in history[:-1]):
+        return None
+    question = " ".join(tokenize(message))
+    return (lesson_id, question) if question else None
+
+async def build_theory_prompt(message: str, history: List[Dict[str, Any]], theory_context: str, session_id: str = None) -> str:
+    return theory_chat_prompt.format(
         input=message,
-        chat_history=chat_history_str,
+        chat_history=await history_manager.build(history, session_id),
         theory_context=theory_context
     )
+
+async def get_theory_chat_response(message: str, history: List[Dict[str, Any]], theory_context: str, session_id: str = None, coalesce: bool = False) -> str:
+    """
+    Answer a theory question.
+
+    With `coalesce`, concurrent requests that build exactly the same prompt
+    share one LLM call.
+    """
+    prompt = await build_theory_prompt(message, history, theory_context, session_id)
     # Gọi LLM (Claude)
-    response = await llm.ainvoke(prompt)
-    return response.content if hasattr(response, "content") else str(response)
\ No newline at end of file
+    if coalesce:
+        response = await singleflight.do("theory_chat", prompt_key(prompt), lambda: llm.ainvoke(prompt))
+    else:
+        response = await llm.ainvoke(prompt)
+    return response.content if hasattr(response, "content") else str(response)
+
+async def stream_theory_chat_response(message: str, history: List[Dict[str, Any]], theory_context: str, session_id: str = None, coalesce: bool = False) -> AsyncIterator[str]:
+    """Yield the answer to a theory question token by token as Claude generates it (shared between identical prompts with `coalesce`)."""
+    prompt = await build_theory_prompt(message, history, theory_context, session_id)
+    if coalesce:
+        tokens = singleflight.stream("theory_chat", prompt_key(prompt), lambda: answer_tokens(prompt))
+    else:
+        tokens = answer_tokens(prompt)
+    async for text in tokens:
+        yield text
+
+async def answer_tokens(prompt: str) -> AsyncIterator[str]:
+    async for chunk in llm.astream(prompt):
+        if chunk.content:
+            yield chunk.content
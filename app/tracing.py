@@ -0,0 +1,293 @@
+import json
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from .config import settings
+from .llm_gateway import token_counts
+
+# Id của request HTTP hiện tại, được RequestIdMiddleware gán; task con kế thừa theo context
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Chỉ nhận X-Request-ID ngắn, không có ký tự lạ, để dùng an toàn làm key và trong log
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# Độ dài tối đa của input/output tool được ghi vào span
+MAX_ATTRIBUTE_LENGTH = 200
+
+# Tên tool mà AgentExecutor dùng để trả lỗi parse output về cho LLM (handle_parsing_errors)
+PARSE_ERROR_TOOL = "_Exception"
+
+
+def current_request_id() -> Optional[str]:
+    return request_id_var.get()
+
+
+def truncate(text: Any) -> str:
+    text = str(text)
+    return text if len(text) <= MAX_ATTRIBUTE_LENGTH else text[:MAX_ATTRIBUTE_LENGTH] + "..."
+
+
+@dataclass
+class Span:
+    """One timed step of a request: an LLM call, a tool call, a parse error retry, a fallback or the whole agent run."""
+    name: str
+    kind: str
+    started_at: float
+    duration_ms: float
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def format_error(error: BaseException) -> str:
+    return f"{type(error).__name__}: {error}"
+
+
+class TraceStore:
+    """
+    Spans of the most recent requests, keyed by request id.
+
+    Keeps at most `maxsize` requests (oldest dropped first) and `max_spans`
+    spans per request in memory. When `path` is set, every span is also
+    appended to that JSONL file by a background thread, so the event loop
+    never waits on disk.
+    """
+
+    def __init__(self, maxsize: int, max_spans: int, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.max_spans = max_spans
+        self.path = path
+        self.dropped = 0
+        self._traces: "OrderedDict[str, List[Span]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: Optional["queue.SimpleQueue[Optional[Tuple[str, Span]]]"] = None
+        self._writer: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start the JSONL writer thread, if a trace file is configured."""
+        if self.path and self._writer is None:
+            self._queue = queue.SimpleQueue()
+            self._writer = threading.Thread(target=self._write, name="trace-writer", daemon=True)
+            self._writer.start()
+
+    def record(self, request_id: str, span: Span) -> None:
+        with self._lock:
+            spans = self._traces.get(request_id)
+            if spans is None:
+                spans = self._traces[request_id] = []
+                while len(self._traces) > self.maxsize:
+                    self._traces.popitem(last=False)
+            if len(spans) >= self.max_spans:
+                self.dropped += 1
+                return
+            spans.append(span)
+        if self._queue is not None:
+            self._queue.put((request_id, span))
+
+    def __contains__(self, request_id: str) -> bool:
+        return request_id in self._traces
+
+    def get(self, request_id: str) -> Optional[List[dict]]:
+        """Spans of `request_id` in start order, or None if it is not (or no longer) in the buffer."""
+        with self._lock:
+            spans = self._traces.get(request_id)
+            spans = list(spans) if spans is not None else None
+        if spans is None:
+            return None
+        return [asdict(span) for span in sorted(spans, key=lambda span: span.started_at)]
+
+    def recent(self, limit: int = 50) -> List[dict]:
+        """Summary of the newest traces: request id, span count and total LLM/tool time."""
+        with self._lock:
+            items = [(request_id, list(spans)) for request_id, spans in reversed(self._traces.items())][:limit]
+        summaries = []
+        for request_id, spans in items:
+            time_by_kind: Dict[str, float] = {}
+            for span in spans:
+                time_by_kind[span.kind] = time_by_kind.get(span.kind, 0.0) + span.duration_ms
+            summaries.append({
+                "request_id": request_id,
+                "started_at": min((span.started_at for span in spans), default=None),
+                "spans": len(spans),
+                "duration_ms": {kind: round(duration, 1) for kind, duration in time_by_kind.items()},
+            })
+        return summaries
+
+    def _write(self) -> None:
+        with open(self.path, "a", encoding="utf-8") as file:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                request_id, span = item
+                file.write(json.dumps({"request_id": request_id, **asdict(span)}, ensure_ascii=False, default=str) + "\n")
+                if self._queue.empty():
+                    file.flush()
+
+    def shutdown(self) -> None:
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join(timeout=5)
+            self._writer = None
+            self._queue = None
+
+
+trace_store = TraceStore(settings.TRACE_BUFFER_SIZE, settings.TRACE_MAX_SPANS, settings.TRACE_FILE)
+
+
+def record_event(name: str, kind: str, error: Optional[BaseException] = None, **attributes: Any) -> None:
+    """Record a zero-length span (e.g. a fallback decision) on the current request, if there is one."""
+    request_id = current_request_id()
+    if request_id:
+        trace_store.record(request_id, Span(
+            name=name,
+            kind=kind,
+            started_at=time.time(),
+            duration_ms=0.0,
+            attributes=attributes,
+            error=format_error(error) if error is not None else None,
+        ))
+
+
+class TracingCallbackHandler(AsyncCallbackHandler):
+    """
+    Records LangChain runs as spans of the current request.
+
+    LLM calls, tool calls and the whole agent run become spans in
+    `trace_store`, with their duration and a few attributes (model, token
+    counts, truncated tool input). Tool calls that feed an output parsing
+    error back to the agent are recorded as `parse_error` spans. Handlers
+    only append to memory, so they are cheap enough to attach to every
+    request. Runs outside an HTTP request are not recorded.
+    """
+
+    def __init__(self, request_id: Optional[str] = None):
+        self.request_id = request_id or current_request_id()
+        # run_id -> (tên, loại, thời điểm bắt đầu, perf_counter lúc bắt đầu, attributes)
+        self._runs: Dict[UUID, Tuple[str, str, float, float, Dict[str, Any]]] = {}
+
+    def _start(self, run_id: UUID, name: str, kind: str, **attributes: Any) -> None:
+        if self.request_id:
+            self._runs[run_id] = (name, kind, time.time(), time.perf_counter(), attributes)
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None, **attributes: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        name, kind, started_at, started_perf, start_attributes = run
+        trace_store.record(self.request_id, Span(
+            name=name,
+            kind=kind,
+            started_at=started_at,
+            duration_ms=round((time.perf_counter() - started_perf) * 1000, 2),
+            attributes={**start_attributes, **attributes},
+            error=format_error(error) if error is not None else None,
+        ))
+
+    async def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID, **kwargs: Any) -> None:
+        model = kwargs.get("invocation_params", {}).get("model") or serialized.get("id", ["llm"])[-1]
+        self._start(run_id, model, "llm", messages=sum(len(batch) for batch in messages), chunks=0)
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        model = kwargs.get("invocation_params", {}).get("model") or serialized.get("id", ["llm"])[-1]
+        self._start(run_id, model, "llm", prompts=len(prompts), chunks=0)
+
+    async def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.get(run_id)
+        if run is not None:
+            attributes = run[4]
+            if not attributes["chunks"]:
+                attributes["first_chunk_ms"] = round((time.perf_counter() - run[3]) * 1000, 2)
+            attributes["chunks"] += 1
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        usage = (response.llm_output or {}).get("usage")
+        self._end(run_id, **{f"{kind}_tokens": count for kind, count in token_counts(usage).items()})
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        name = serialized.get("name", "tool")
+        if name == PARSE_ERROR_TOOL:
+            # Agent trả lời sai định dạng ReAct: lỗi được gửi lại cho LLM để thử lại
+            self._start(run_id, "parse_error_retry", "parse_error", observation=truncate(input_str))
+        else:
+            self._start(run_id, name, "tool", input=truncate(input_str))
+
+    async def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, output_length=len(str(output)))
+
+    async def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+    async def on_chain_start(
+        self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> None:
+        # Chỉ ghi lần chạy ngoài cùng (AgentExecutor), bỏ qua các chain con của từng bước
+        if parent_run_id is None:
+            self._start(run_id, (serialized or {}).get("id", ["chain"])[-1], "agent")
+
+    async def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        steps = outputs.get("intermediate_steps") if isinstance(outputs, dict) else None
+        self._end(run_id, **({"iterations": len(steps)} if steps is not None else {}))
+
+    async def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware giving every HTTP request an id.
+
+    Uses the client's X-Request-ID header when it is a short token,
+    otherwise a new one, and returns it in the X-Request-ID response header.
+    Requests that recorded spans also get an `http` span for the whole
+    request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        started_at, started_perf = time.time(), time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
+            # Request không gọi agent/LLM thì không tạo trace, để buffer chỉ giữ các request đáng xem
+            if request_id in trace_store:
+                trace_store.record(request_id, Span(
+                    name=f"{scope['method']} {scope['path']}",
+                    kind="http",
+                    started_at=started_at,
+                    duration_ms=round((time.perf_counter() - started_perf) * 1000, 2),
+                    attributes={"status": status},
+                ))
@@ -0,0 +1,143 @@
+"""
+Benchmark: per-request cost of the agent path before and after building the
+ReAct agents once at startup.
+
+"construction" times only what the change removed from each request: the
+tool closures, the ReAct agent and the AgentExecutor, against looking up the
+prebuilt executor. The "request" cases run a whole /chat request through the agent: history and
+exercise preparation, executor lookup (or construction), binding the
+request's code and terminal output, prompt formatting, output parsing and
+one read_code tool step. "before" recreates the tool closures, the ReAct
+agent and a verbose AgentExecutor on every call, like get_agent_response
+used to; "after" calls the current get_agent_response with the prebuilt
+executor. The LLM is a fake chat model answering instantly, so the numbers
+are the framework overhead around each LLM call, not API latency.
+
+Building an executor costs under 0.2 ms. That is within the
+run-to-run noise of a whole request, which takes tens of milliseconds even
+with an instant LLM, so the two request numbers show no measurable
+difference. Prebuilding the agents keeps that work and its garbage off each
+request, but it does not make a request noticeably faster.
+
+Run from the project root:
+
+    python -m benchmarks.agent_setup
+"""
+import asyncio
+import contextlib
+import itertools
+import os
+import time
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+
+from langchain.agents import Tool, AgentExecutor, create_react_agent  # noqa: E402
+from langchain.callbacks import StdOutCallbackHandler  # noqa: E402
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel  # noqa: E402
+from langchain_core.messages import AIMessage  # noqa: E402
+
+from app import agent  # noqa: E402
+
+MESSAGE = "Code của em sai ở đâu?"
+CODE = "def add(a, b):\n    return a + b\n"
+TERMINAL_OUTPUT = "✅ Tất cả unit test đã pass!"
+HISTORY = [
+    {"role": "user", "content": "Em nên bắt đầu từ đâu?"},
+    {"role": "assistant", "content": "Hãy đọc kỹ mô tả và ví dụ của bài tập trước."},
+]
+EXERCISE = {"description": "Viết hàm add(a, b) trả về tổng hai số.", "function": "def add(a, b):", "unit_test": "assert add(1, 2) == 3"}
+
+# Mỗi request: một bước gọi read_code rồi Final Answer
+REPLIES = [
+    AIMessage(content="Thought: Tôi cần xem code của học viên.\nAction: read_code\nAction Input: code"),
+    AIMessage(content="Thought: Tôi đã có câu trả lời.\nFinal Answer: Code của em đúng rồi."),
+]
+
+
+def fake_llm() -> GenericFakeChatModel:
+    return GenericFakeChatModel(messages=itertools.cycle(REPLIES))
+
+
+def build_per_request(llm, code: str, terminal_output: str) -> AgentExecutor:
+    def read_code_with_input(input_str=None):
+        return f"```python\n{code.strip()}\n```"
+
+    def read_terminal_output(input_str=None):
+        return f"Terminal Output:\n```\n{terminal_output.strip()}\n```"
+
+    tools = [
+        Tool(name="read_code", func=read_code_with_input, description="Đọc code từ sandbox của học viên."),
+        Tool(name="read_terminal_output", func=read_terminal_output, description="Đọc terminal output."),
+    ]
+    return AgentExecutor.from_agent_and_tools(
+        agent=create_react_agent(llm=llm, tools=tools, prompt=agent.chat_prompt),
+        tools=tools,
+        verbose=True,
+        handle_parsing_errors=True,
+        max_iterations=5,
+        return_intermediate_steps=True,
+        callbacks=[StdOutCallbackHandler()],
+    )
+
+
+def lookup_prebuilt() -> AgentExecutor:
+    return agent.chat_executor
+
+
+async def respond_per_request(llm) -> str:
+    chat_history_str, exercise_variables = await agent._prepare_request(HISTORY, EXERCISE)
+    executor = build_per_request(llm, CODE, TERMINAL_OUTPUT)
+    response = await executor.ainvoke({"input": MESSAGE, "chat_history": chat_history_str, **exercise_variables})
+    return response["output"]
+
+
+async def respond_prebuilt() -> str:
+    return await agent.get_agent_response(
+        message=MESSAGE, code=CODE, history=HISTORY, terminal_output=TERMINAL_OUTPUT, exercise=EXERCISE
+    )
+
+
+def measure_sync(func, number: int, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - started_at) / number)
+    return best
+
+
+async def measure(func, number: int, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        for _ in range(number):
+            await func()
+        best = min(best, (time.perf_counter() - started_at) / number)
+    return best
+
+
+async def run(number: int) -> None:
+    before_llm = fake_llm()
+    agent.chat_executor = agent.build_executor(agent.chat_prompt, fake_llm())
+    expected = "Code của em đúng rồi."
+    # Bản cũ in từng bước ra stdout (verbose): vẫn tính chi phí ghi, nhưng không in ra màn hình
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        assert await respond_per_request(before_llm) == expected
+        assert await respond_prebuilt() == expected
+        before = await measure(lambda: respond_per_request(before_llm), number)
+        after = await measure(respond_prebuilt, number)
+    build = measure_sync(lambda: build_per_request(before_llm, CODE, TERMINAL_OUTPUT), number)
+    lookup = measure_sync(lookup_prebuilt, number)
+    print(f"{'construction: build':<28} {build * 1e6:10.1f} µs/request")
+    print(f"{'construction: prebuilt':<28} {lookup * 1e6:10.1f} µs/request")
+    print(f"{'request: build per request':<28} {before * 1e6:10.1f} µs/request")
+    print(f"{'request: prebuilt agents':<28} {after * 1e6:10.1f} µs/request")
+
+
+def main(number: int = 100):
+    asyncio.run(run(number))
+
+
+if __name__ == "__main__":
+    main()
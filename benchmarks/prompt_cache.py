@@ -0,0 +1,194 @@
+"""
+Check the prompt caching layout against a local stub of the Anthropic
+Messages API, and measure how much of the input is served from cache over a
+simulated tutoring session.
+
+The stub asserts that every request starts with the `cache_control`-marked
+prefix blocks (tutor instructions, then the exercise) and that per-turn text
+(history, question, agent scratchpad) only appears after the last marker. It
+simulates the prompt cache by remembering the prefix up to each marker and
+reports cache read/creation tokens in `usage` (estimated as characters / 4),
+which the app counts in the `llm_tokens_total` metric.
+
+Run from the project root:
+
+    python -m benchmarks.prompt_cache
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+os.environ["CODE_EVALUATION_MODE"] = "react"
+
+PER_TURN_MARKERS = ("Lịch sử trò chuyện:", "Câu hỏi:")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+class StubState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cached_prefixes = set()
+        self.totals = {"requests": 0, "cache_read": 0, "cache_creation": 0, "input": 0}
+
+
+state = StubState()
+
+
+def check_layout(body: dict) -> list:
+    """Validate the request layout and return the user message's content blocks."""
+    assert "system" not in body or isinstance(body["system"], str)
+    assert len(body["messages"]) == 1, "the prompt must be a single user message"
+    blocks = body["messages"][0]["content"]
+    assert isinstance(blocks, list) and len(blocks) >= 2, "expected content blocks, got a plain string"
+    marked = [index for index, block in enumerate(blocks) if block.get("cache_control")]
+    assert marked and marked == list(range(len(marked))), "cache_control blocks must form a prefix"
+    assert len(marked) < len(blocks), "the variable part must not be cached"
+    for block in blocks[:len(marked)]:
+        for marker in PER_TURN_MARKERS:
+            assert marker not in block["text"], f"per-turn text {marker!r} found in the cached prefix"
+    return blocks
+
+
+def usage_for(blocks: list) -> dict:
+    """Simulate the prompt cache: the longest previously seen prefix is read, the rest up to the last marker is written."""
+    marked = [block for block in blocks if block.get("cache_control")]
+    keys, text = [], ""
+    for block in marked:
+        text += block["text"]
+        keys.append((hashlib.sha256(text.encode()).hexdigest(), estimate_tokens(text)))
+
+    with state.lock:
+        read = 0
+        for key, tokens in keys:
+            if key in state.cached_prefixes:
+                read = tokens
+        total_cached = keys[-1][1]
+        state.cached_prefixes.update(key for key, _ in keys)
+        uncached = sum(estimate_tokens(block["text"]) for block in blocks[len(marked):])
+        usage = {
+            "input_tokens": uncached,
+            "cache_read_input_tokens": read,
+            "cache_creation_input_tokens": total_cached - read,
+            "output_tokens": 20,
+        }
+        state.totals["requests"] += 1
+        state.totals["cache_read"] += read
+        state.totals["cache_creation"] += total_cached - read
+        state.totals["input"] += uncached
+    return usage
+
+
+def reply_for(blocks: list) -> str:
+    # Lượt đầu của agent gọi tool, lượt sau (đã có Observation) thì trả lời
+    if "Observation:" in blocks[-1]["text"]:
+        return "Thought: Tôi đã đọc code.\nFinal Answer: Code của bạn gần đúng rồi, hãy kiểm tra lại điều kiện dừng."
+    return "Thought: Tôi cần đọc code của học viên.\nAction: read_code\nAction Input: "
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        try:
+            blocks = check_layout(body)
+        except AssertionError as e:
+            self.send_response(400)
+            self.end_headers()
+            self.wfile.write(json.dumps({"type": "error", "error": {"type": "invalid_request_error", "message": str(e)}}).encode())
+            print(f"Layout check failed: {e}")
+            return
+        usage = usage_for(blocks)
+        text = reply_for(blocks)
+        message = {
+            "id": "msg_stub", "type": "message", "role": "assistant", "model": body["model"],
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn", "stop_sequence": None, "usage": usage,
+        }
+        if body.get("stream"):
+            self._stream(message, text, usage)
+        else:
+            payload = json.dumps(message).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    def _stream(self, message, text, usage):
+        start = dict(message, content=[], stop_reason=None, usage=dict(usage, output_tokens=0))
+        events = [
+            ("message_start", {"type": "message_start", "message": start}),
+            ("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}),
+            ("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}}),
+            ("content_block_stop", {"type": "content_block_stop", "index": 0}),
+            ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {"output_tokens": usage["output_tokens"]}}),
+            ("message_stop", {"type": "message_stop"}),
+        ]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for event, data in events:
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+
+
+EXERCISE = {
+    "description": "Viết hàm `count_even(numbers)` trả về số phần tử chẵn trong danh sách.",
+    "example": "count_even([1, 2, 3, 4])",
+    "example_output": "2",
+    "explanation": "Có hai số chẵn là 2 và 4.",
+    "function": "def count_even(numbers):\n    pass",
+    "unit_test": "import unittest\nclass TestCountEven(unittest.TestCase):\n    def test_basic(self):\n        self.assertEqual(count_even([1, 2, 3, 4]), 2)",
+}
+CODE = "def count_even(numbers):\n    return len([n for n in numbers if n % 2])"
+
+
+async def simulate_session(agent, turns: int) -> None:
+    history = []
+    for turn in range(turns):
+        message = f"Câu hỏi số {turn + 1}: code của mình sai ở đâu?"
+        history.append({"role": "user", "content": message})
+        if turn % 2:
+            parts = [text async for text in agent.stream_agent_response(message, code=CODE, history=history, exercise=EXERCISE)]
+            answer = "".join(parts)
+        else:
+            answer = await agent.get_agent_response(message, code=CODE, history=history, exercise=EXERCISE)
+        history.append({"role": "assistant", "content": answer})
+
+
+def main() -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["ANTHROPIC_API_URL"] = f"http://127.0.0.1:{server.server_port}"
+
+    import app.agent as agent
+
+    asyncio.run(simulate_session(agent, turns=6))
+    server.shutdown()
+
+    totals = state.totals
+    cacheable = totals["cache_read"] + totals["cache_creation"]
+    all_input = cacheable + totals["input"]
+    print(f"requests: {totals['requests']}")
+    print(f"input tokens read from cache: {totals['cache_read']} / {all_input} ({totals['cache_read'] / all_input:.0%})")
+    print(f"cache creation tokens: {totals['cache_creation']}")
+
+    # Token mà app đếm được từ `usage` phải khớp với stub
+    from app.metrics import llm_tokens
+    counted = {}
+    for _, labels, value in llm_tokens.samples():
+        kind = dict(labels)["type"]
+        counted[kind] = counted.get(kind, 0) + value
+    print(f"llm_tokens_total: {', '.join(f'{kind}={value:g}' for kind, value in sorted(counted.items()))}")
+
+
+if __name__ == "__main__":
+    main()
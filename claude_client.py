@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
-from anthropic import Anthropic
+
+from app.llm_gateway import llm_gateway
 
 # Load environment variables
 load_dotenv()
@@ -11,7 +12,8 @@ class ClaudeClient:
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
         
-        self.client = Anthropic()
+        # Client dùng chung connection pool của gateway
+        self.client, self.async_client = llm_gateway.anthropic_clients(api_key)
 
     def generate_response(self, prompt, max_tokens=1000):
         """
@@ -25,13 +27,37 @@ class ClaudeClient:
             str: Claude's response
         """
         try:
-            message = self.client.beta.messages.create(
+            message = llm_gateway.call_sync("claude_client", lambda: self.client.beta.messages.create(
+                model="claude-3-5-sonnet-20241022",
+                max_tokens=max_tokens,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ]
+            ))
+            return message.content[0].text
+        except Exception as e:
+            print(f"Error generating response: {str(e)}")
+            return None
+
+    async def agenerate_response(self, prompt, max_tokens=1000):
+        """
+        Async version of generate_response for use inside the event loop
+
+        Args:
+            prompt (str): The input prompt for Claude
+            max_tokens (int): Maximum number of tokens in the response
+
+        Returns:
+            str: Claude's response
+        """
+        try:
+            message = await llm_gateway.call("claude_client", lambda: self.async_client.beta.messages.create(
                 model="claude-3-5-sonnet-20241022",
                 max_tokens=max_tokens,
                 messages=[
                     {"role": "user", "content": prompt}
                 ]
-            )
+            ))
             return message.content[0].text
         except Exception as e:
             print(f"Error generating response: {str(e)}")
@@ -1,20 +1,38 @@
-import os
 import json
-from fastapi import FastAPI, Request, Form, HTTPException
+import asyncio
+import secrets
+from math import ceil
+from fastapi import FastAPI, Request, HTTPException, Header
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import Any, AsyncIterator, List, Optional, Dict
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.models import Message, CodeRequest
-from app.agent import get_agent_response
-from app.code_executor import run_python_code
-from app.generate_exercise import generate_exercise, extract_description, extract_example, extract_explanation, extract_function, extract_unit_test, extract_example_output
-from app.theory import ListTheory
-from app.theory_chat import get_theory_chat_response
+from app.models import CodeRequest
+from app.agent import get_agent_response, stream_agent_response
+from app.code_executor import run_python_code, stream_python_code, run_unit_tests, cache_stats, compile_cache, test_result_cache
+from app.test_harness import format_report
+from app.config import settings
+from app.sandbox import sandbox_pool
+from app.session_store import Session, session_store
+from app.scheduler import execution_scheduler, ExecutionResult, QueueFullError
+from app.streaming import ANSWER_RESET, ChunkChannel, ChannelClosed, sse_event, stream_tokens
+from app.generate_exercise import get_context, stream_exercise_fields
+from app.exercise_bank import exercise_bank
+from app.exercise_pool import create_exercise, exercise_pool
+from app.lessons import JSONPayload, lesson_index, retrieve_theory_context
+from app.rendering import renderer
+from app.llm_gateway import LLMTimeoutError, llm_gateway
+from app.llm_scheduler import LLMBusyError, Priority, llm_scheduler
+from app.singleflight import coalescing_enabled, prompt_key, singleflight
+from app.cache import LRUCache
+from app import metrics
+from app.metrics import MetricsMiddleware, loop_monitor
+from app.tracing import RequestIdMiddleware, trace_store
+from app.theory_chat import get_theory_chat_response, stream_theory_chat_response, answer_cache, answer_cache_key
 
 # Load environment variables
 load_dotenv()
@@ -28,15 +46,56 @@ app.add_middleware(
     allow_origins=["http://localhost:5173"],  # Vue dev server address
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization", "Accept"],
+    allow_headers=["Content-Type", "Authorization", "Accept", "X-Request-ID"],
+    expose_headers=["X-Request-ID"],
 )
 
+# Đo thời gian của mọi request cho /metrics
+app.add_middleware(MetricsMiddleware)
+# Gán id cho mỗi request để tra trace của agent qua /debug/traces/{request_id}
+app.add_middleware(RequestIdMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Initialize templates
 templates = Jinja2Templates(directory="templates")
 
+@app.on_event("startup")
+async def start_sandbox():
+    # Khởi động sẵn các worker để lần chạy code đầu tiên không phải chờ
+    sandbox_pool.start()
+    loop_monitor.start()
+    trace_store.start()
+    exercise_bank.start()
+    # Bài học đổi nội dung thì câu trả lời đã cache cho bài đó không còn đúng
+    lesson_index.on_change(lambda lesson_id: answer_cache.remove_if(lambda key: key[0] == lesson_id))
+    lesson_index.build()
+    # Tạo sẵn bài tập ở background để học viên không phải chờ LLM
+    topics = [topic.strip() for topic in settings.EXERCISE_POOL_TOPICS.split(",") if topic.strip()]
+    exercise_pool.start(topics or lesson_index.lessons)
+
+@app.on_event("shutdown")
+async def stop_sandbox():
+    await exercise_pool.shutdown()
+    await loop_monitor.shutdown()
+    trace_store.shutdown()
+    exercise_bank.shutdown()
+    sandbox_pool.shutdown()
+    await llm_gateway.aclose()
+
+@app.exception_handler(LLMTimeoutError)
+async def llm_timeout_handler(request: Request, exc: LLMTimeoutError):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+@app.exception_handler(LLMBusyError)
+async def llm_busy_handler(request: Request, exc: LLMBusyError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(ceil(exc.retry_after))}
+    )
+
 class ChatRequest(BaseModel):
     message: str
     code: Optional[str] = None
@@ -44,104 +103,106 @@ class ChatRequest(BaseModel):
     terminal_output: Optional[str] = None
     exercise: Optional[Dict[str, str]] = None
     is_code_evaluation: Optional[bool] = False
+    parallel: Optional[bool] = False
+    session_id: Optional[str] = None
 
 class TheoryChatRequest(BaseModel):
     message: str
-    history: List[Dict]
-    theory_context: str
+    history: Optional[List[Dict]] = None
+    lesson_id: Optional[str] = None
+    theory_context: Optional[str] = None
+    session_id: Optional[str] = None
 
 class ExerciseRequest(BaseModel):
     topic: str
+    session_id: Optional[str] = None
 
-def run_unit_tests(code: str, unit_test: str) -> str:
-    # Kết hợp code của học viên với unit test
-    full_code = f"{code}\n\n{unit_test}"
-    
-    # Thêm imports cần thiết
-    imports = """import unittest
-import io
-import sys
-from unittest import TextTestRunner, TestResult
-"""
-    
-    # Thêm custom test runner để capture kết quả chi tiết
-    custom_runner_code = """
-class CustomTestResult(TestResult):
-    def __init__(self):
-        super().__init__()
-        self.output = []
-
-    def startTest(self, test):
-        super().startTest(test)
-        
-    def addSuccess(self, test):
-        super().addSuccess(test)
-        test_name = test.id().split('.')[-1]
-        self.output.append(f"✅ Test {test_name} passed!")
-
-    def addError(self, test, err):
-        super().addError(test, err)
-        test_name = test.id().split('.')[-1]
-        error_message = str(err[1])
-        self.output.append(f"❌ Test {test_name} failed with error: {error_message}")
-
-    def addFailure(self, test, err):
-        super().addFailure(test, err)
-        test_name = test.id().split('.')[-1]
-        error_message = str(err[1])
-        self.output.append(f"❌ Test {test_name} failed: {error_message}")
-
-class CustomTestRunner(TextTestRunner):
-    def _makeResult(self):
-        return CustomTestResult()
-
-    def run(self, test):
-        result = self._makeResult()
-        test(result)
-        
-        # Tổng hợp kết quả
-        output = []
-        if result.wasSuccessful():
-            output.append("✅ Tất cả unit test đã pass!")
-            output.append(f"Số lượng test đã pass: {result.testsRun}")
+def admit_llm(http_request: Request, session_id: Optional[str], priority: Priority) -> None:
+    """Charge an LLM request to the student's session and IP and set its scheduling priority."""
+    client = http_request.client.host if http_request.client else "unknown"
+    llm_scheduler.admit(session_id, client, priority)
+
+async def schedule_execution(func, *args) -> ExecutionResult:
+    """Run a blocking execution job through the scheduler, mapping a full queue to 429."""
+    try:
+        return await execution_scheduler.submit(func, *args)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+async def open_session(
+    session_id: Optional[str],
+    history: Optional[List[Dict[str, Any]]],
+    messages: List[Dict[str, Any]],
+    exercise: Optional[Dict[str, str]] = None,
+    code: Optional[str] = None,
+    terminal_output: Optional[str] = None,
+    require_history: bool = False,
+    require_exercise: bool = False,
+) -> Session:
+    """
+    Apply a request's changes to its session and return the resulting state.
+
+    Without a session id the request carries the full state (with the new
+    message already in `history`), which is used as-is. With one, the client
+    only sends what changed; `messages` are added to the returned history but
+    only stored together with the answer, by `remember_reply`, so a request
+    that fails leaves no unanswered turn behind. If the server has lost state
+    the request needs (session expired or server restarted), a 409 asks the
+    client to resend the full state.
+    """
+    if not session_id:
+        return Session("", exercise=exercise or {}, history=history or [], code=code, terminal_output=terminal_output)
+
+    if history is None:
+        existing = await session_store.aget(session_id)
+        missing_history = require_history and existing is None
+        missing_exercise = require_exercise and exercise is None and (existing is None or not existing.exercise)
+        if missing_history or missing_exercise:
+            raise HTTPException(status_code=409, detail="Session not found, resend the full state")
+    session = await session_store.aupdate(
+        session_id,
+        exercise=exercise,
+        code=code,
+        terminal_output=terminal_output,
+        history=history,
+    )
+    session.history.extend(messages)
+    return session
+
+async def remember_reply(session_id: Optional[str], messages: List[Dict[str, Any]], response: str) -> None:
+    """Append the request's messages and the answer to the session's history in one update."""
+    if session_id:
+        await session_store.aupdate(session_id, messages=[*messages, {"role": "assistant", "content": response}])
+
+async def record_reply(session_id: Optional[str], messages: List[Dict[str, Any]], tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Pass streamed tokens through, saving the full answer to the session once it is complete."""
+    parts = []
+    async for text in tokens:
+        if text is ANSWER_RESET:
+            parts.clear()
         else:
-            output.append("❌ Một số unit test đã fail!")
-            output.append(f"Số lượng test đã chạy: {result.testsRun}")
-            output.append(f"Số lượng test fail: {len(result.failures) + len(result.errors)}")
-        
-        # Thêm kết quả chi tiết từng test
-        output.extend(result.output)
-        
-        return '\\n'.join(output)
-"""
-    
-    # Thêm code để chạy test với custom runner
-    run_tests_code = """
-# Get test class name dynamically
-import re
-test_class_match = re.search(r'class\s+(\w+)\s*\(unittest\.TestCase\)', __unit_test__)
-if not test_class_match:
-    raise ValueError("Could not find test class in unit test code")
-
-test_class_name = test_class_match.group(1)
-
-# Get all test cases using the found class name
-suite = unittest.TestLoader().loadTestsFromTestCase(eval(test_class_name))
-
-# Run tests with custom runner
-runner = CustomTestRunner(stream=None)
-result = runner.run(suite)
-print(result)  # In kết quả test
-"""
-
-    # Kết hợp tất cả code và tạo namespace
-    full_code = imports + full_code + "\n\n" + custom_runner_code + "\n" + run_tests_code
-    
-    # Tạo namespace với unit_test code
-    namespace = {'__unit_test__': unit_test}
-    
-    # Chạy code với namespace đã được cung cấp
-    return run_python_code(full_code, namespace)
+            parts.append(text)
+        yield text
+    await remember_reply(session_id, messages, "".join(parts))
+
+def chat_messages(request: ChatRequest) -> List[Dict[str, Any]]:
+    # Tin nhắn đánh giá code do frontend tự tạo nên không lưu vào history
+    return [] if request.is_code_evaluation else [{"role": "user", "content": request.message}]
+
+def theory_chat_messages(request: TheoryChatRequest) -> List[Dict[str, Any]]:
+    return [{"role": "user", "content": request.message}]
+
+async def open_chat_session(request: ChatRequest) -> Session:
+    return await open_session(
+        request.session_id,
+        request.history,
+        chat_messages(request),
+        exercise=request.exercise,
+        code=request.code,
+        terminal_output=request.terminal_output,
+        require_history=True,
+        require_exercise=True,
+    )
 
 @app.get("/", response_class=HTMLResponse)
 async def chat_page(request: Request):
@@ -157,134 +218,546 @@ async def theory_page(request: Request):
         {"request": request}
     )
 
+async def take_stored_exercise(request: ExerciseRequest) -> Optional[Dict[str, str]]:
+    """
+    Return an exercise this session has not seen from the bank, or a pre-generated one from the pool.
+
+    Requests without a session skip the bank: it cannot tell which exercises
+    they have seen and would keep returning the least-served one.
+    """
+    exercise = await exercise_bank.atake_unseen(request.topic, request.session_id) if request.session_id else None
+    if exercise is None:
+        # Bài trong pool có thể lấy từ bank: bỏ qua những bài session này đã nhận
+        seen = await exercise_bank.aseen_hashes(request.topic, request.session_id) if request.session_id else ()
+        generated = exercise_pool.take(request.topic, exclude=seen)
+        if generated is None:
+            return None
+        context, exercise = generated
+        await exercise_bank.aadd(request.topic, context, exercise, session_id=request.session_id)
+    if request.session_id:
+        await session_store.aupdate(request.session_id, exercise=exercise)
+    return exercise
+
+async def new_exercise_stream(topic: str) -> AsyncIterator[Any]:
+    """Yield the context pair chosen for a new exercise, then each (name, value) field as it is generated."""
+    context = get_context()
+    yield context
+    async for field in stream_exercise_fields(topic, context):
+        yield field
+
+async def store_exercise(request: ExerciseRequest, context: List[str], exercise: Dict[str, str]) -> None:
+    """Save a newly generated exercise in the bank and in the student's session."""
+    await exercise_bank.aadd(request.topic, context, exercise, session_id=request.session_id)
+    if request.session_id:
+        await session_store.aupdate(request.session_id, exercise=exercise)
+
 @app.post("/generate_exercise")
-async def generate_exercise_endpoint(request: ExerciseRequest):
-    """Generate a new Python exercise."""
-    print(request.topic)
-    content = generate_exercise(request.topic)
-    
-    print(extract_unit_test(content))
-    return {
-        "description": extract_description(content),
-        "example": extract_example(content),
-        "example_output": extract_example_output(content),
-        "explanation": extract_explanation(content),
-        "function": extract_function(content),
-        "unit_test": extract_unit_test(content)
-    }
+async def generate_exercise_endpoint(request: ExerciseRequest, http_request: Request):
+    """
+    Get a Python exercise for the student.
+
+    Serves an exercise from the bank that this session has not seen yet,
+    then a pre-generated one from the pool, and only calls the LLM when
+    neither has one.
+    """
+    exercise = await take_stored_exercise(request)
+    if exercise is None:
+        # Bank và pool đều không có: tạo bài tập ngay trong request
+        admit_llm(http_request, request.session_id, Priority.GENERATION)
+        try:
+            if coalescing_enabled("generate_exercise"):
+                context, exercise = await singleflight.do(
+                    "generate_exercise", prompt_key(request.topic), lambda: create_exercise(request.topic)
+                )
+            else:
+                context, exercise = await create_exercise(request.topic)
+        except ValueError as e:
+            raise HTTPException(status_code=502, detail=str(e))
+        await store_exercise(request, context, exercise)
+    return exercise
+
+@app.post("/generate_exercise/stream")
+async def generate_exercise_stream_endpoint(request: ExerciseRequest, http_request: Request):
+    """
+    Get a Python exercise as Server-Sent Events.
+
+    Sends one `field` event ({name, value}) per exercise field as soon as its
+    section has been generated, so the description and example can be shown
+    before the unit test is written, then a `done` event with the whole
+    exercise. Exercises from the bank or the pool are sent at once.
+    """
+    exercise = await take_stored_exercise(request)
+    if exercise is not None:
+        async def stored_events():
+            for name, value in exercise.items():
+                yield sse_event({"name": name, "value": value}, "field")
+            yield sse_event(exercise, "done")
+        return StreamingResponse(stored_events(), media_type="text/event-stream")
+
+    admit_llm(http_request, request.session_id, Priority.GENERATION)
+    if coalescing_enabled("generate_exercise"):
+        fields = singleflight.stream(
+            "generate_exercise", prompt_key(request.topic), lambda: new_exercise_stream(request.topic)
+        )
+    else:
+        fields = new_exercise_stream(request.topic)
+    # Chờ section đầu tiên trước khi gửi header để output sai format ngay từ đầu vẫn trả về 502
+    try:
+        context = await anext(fields)
+        first_field = await anext(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    async def events():
+        generated = {}
+        try:
+            name, value = first_field
+            generated[name] = value
+            yield sse_event({"name": name, "value": value}, "field")
+            async for name, value in fields:
+                generated[name] = value
+                yield sse_event({"name": name, "value": value}, "field")
+        except (ValueError, LLMBusyError, LLMTimeoutError) as e:
+            yield sse_event({"detail": str(e)}, "error")
+            return
+        finally:
+            await fields.aclose()
+        await store_exercise(request, context, generated)
+        yield sse_event(generated, "done")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/exercise_pool/stats")
+async def exercise_pool_stats_endpoint():
+    """Pool depth per topic, hit rate and refill latency of the pre-generated exercise pool."""
+    return exercise_pool.stats()
+
+@app.get("/exercise_bank/stats")
+async def exercise_bank_stats_endpoint():
+    """Stored and served exercises per topic and the bank hit rate."""
+    return exercise_bank.stats()
 
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
+    session = await open_chat_session(request)
+    admit_llm(http_request, request.session_id, Priority.INTERACTIVE)
     # Get response from agent, passing message, code, and terminal output
-    response = get_agent_response(
+    response = await get_agent_response(
         message=request.message,
-        code=request.code,
-        history=request.history or [],
-        terminal_output=request.terminal_output,
-        exercise=request.exercise,
-        is_code_evaluation=request.is_code_evaluation
+        code=session.code,
+        history=[] if request.is_code_evaluation else session.history,
+        terminal_output=session.terminal_output,
+        exercise=session.exercise,
+        is_code_evaluation=request.is_code_evaluation,
+        session_id=request.session_id
     )
+    await remember_reply(request.session_id, chat_messages(request), response)
     
     return {
         "response": response
     }
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    """Stream the tutor's answer as Server-Sent Events: `token` chunks, then `done` with the full response."""
+    session = await open_chat_session(request)
+    admit_llm(http_request, request.session_id, Priority.INTERACTIVE)
+    tokens = stream_agent_response(
+        message=request.message,
+        code=session.code,
+        history=[] if request.is_code_evaluation else session.history,
+        terminal_output=session.terminal_output,
+        exercise=session.exercise,
+        is_code_evaluation=request.is_code_evaluation,
+        session_id=request.session_id
+    )
+    tokens = record_reply(request.session_id, chat_messages(request), tokens)
+    return StreamingResponse(stream_tokens(tokens), media_type="text/event-stream")
+
 @app.post("/run_code")
 async def run_code_endpoint(request: CodeRequest):
     """Execute Python code and return the output."""
-    output = run_python_code(request.code)
-    return {"output": output}
+    result = await schedule_execution(run_python_code, request.code)
+    if request.session_id:
+        await session_store.aupdate(request.session_id, code=request.code, terminal_output=result.value)
+    return {"output": result.value, "timing": result.timing()}
+
+@app.post("/run_code/stream")
+async def run_code_stream_endpoint(request: CodeRequest):
+    """Execute Python code and stream stdout/stderr chunks as Server-Sent Events."""
+    # Từ chối ngay khi hàng đợi đầy, trước khi bắt đầu stream
+    try:
+        execution_scheduler.check_capacity()
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+    channel = ChunkChannel(maxsize=settings.STREAM_QUEUE_SIZE)
+    output = []
+
+    def on_chunk(stream: str, text: str):
+        output.append(text)
+        channel.put_threadsafe(("chunk", {"stream": stream, "text": text}))
+
+    async def run():
+        try:
+            result = await execution_scheduler.submit(stream_python_code, request.code, on_chunk)
+            if result.value:
+                output.append(result.value)
+                await channel.put(("chunk", {"stream": "stderr", "text": result.value}))
+            if request.session_id:
+                await session_store.aupdate(request.session_id, code=request.code, terminal_output="".join(output))
+            await channel.put(("done", {"timing": result.timing()}))
+        except QueueFullError as e:
+            await channel.put(("error", {"detail": str(e)}))
+        except ChannelClosed:
+            pass
+
+    async def events():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event, data = await channel.get()
+                yield sse_event(data, event)
+                if event != "chunk":
+                    break
+        finally:
+            # Client ngắt kết nối thì dừng job, worker sẽ bị thu hồi khi gửi chunk tiếp theo
+            channel.close()
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 @app.post("/run_unit_tests")
 async def run_unit_tests_endpoint(request: CodeRequest):
     """Run unit tests on the submitted code without LLM evaluation."""
-    if not request.code or not request.unit_test:
+    unit_test = request.unit_test
+    if not unit_test and request.session_id:
+        session = await session_store.aget(request.session_id)
+        unit_test = session.exercise.get("unit_test") if session else None
+    if not request.code or not unit_test:
         raise HTTPException(status_code=400, detail="Missing code or unit test")
     
     # Chạy unit test
-    test_output = run_unit_tests(request.code, request.unit_test)
+    result = await schedule_execution(run_unit_tests, request.code, unit_test, request.parallel)
+    if request.session_id:
+        await session_store.aupdate(request.session_id, code=request.code, terminal_output=format_report(result.value))
     return {
-        "test_output": test_output
+        "test_result": result.value,
+        "timing": result.timing()
     }
 
+@app.get("/execution_cache/stats")
+async def execution_cache_stats_endpoint():
+    """Hit/miss counters for the compile and unit test result caches."""
+    return cache_stats()
+
+async def open_test_session(request: ChatRequest) -> Session:
+    """Open the session whose code is tested, rejecting it if there is no code or unit test to run."""
+    session = await open_session(
+        request.session_id, request.history, [], exercise=request.exercise, code=request.code, require_exercise=True
+    )
+    if not session.code or not session.exercise.get("unit_test"):
+        raise HTTPException(status_code=400, detail="Missing code or unit test")
+    return session
+
+async def run_session_tests(request: ChatRequest, session: Session) -> ExecutionResult:
+    """Run the exercise's unit tests on the session's code, storing the report as its terminal output."""
+    result = await schedule_execution(run_unit_tests, session.code, session.exercise["unit_test"], request.parallel)
+    session.terminal_output = format_report(result.value)
+    if request.session_id:
+        await session_store.aupdate(request.session_id, terminal_output=session.terminal_output)
+    return result
+
 @app.post("/test_code")
-async def test_code_endpoint(request: ChatRequest):
+async def test_code_endpoint(request: ChatRequest, http_request: Request):
     """Run unit tests and get AI evaluation."""
-    if not request.code or not request.exercise or not request.exercise.get("unit_test"):
-        raise HTTPException(status_code=400, detail="Missing code or unit test")
-    
-    # Chạy unit test
-    test_output = run_unit_tests(request.code, request.exercise["unit_test"])
+    session = await open_test_session(request)
+    # Kiểm tra quota trước khi chạy test để request bị từ chối không tốn sandbox
+    admit_llm(http_request, request.session_id, Priority.INTERACTIVE)
+    result = await run_session_tests(request, session)
+    test_result = result.value
     
     # Gửi kết quả cho agent để đánh giá
-    agent_response = get_agent_response(
+    agent_response = await get_agent_response(
         message="Hãy đánh giá kết quả unit test của học viên",
-        code=request.code,
-        terminal_output=test_output,
-        exercise=request.exercise,
+        code=session.code,
+        terminal_output=session.terminal_output,
+        exercise=session.exercise,
         is_code_evaluation=True
     )
+    await remember_reply(request.session_id, [], agent_response)
     
     return {
-        "test_output": test_output,
-        "agent_response": agent_response
+        "test_result": test_result,
+        "agent_response": agent_response,
+        "timing": result.timing()
     }
 
+@app.post("/test_code/stream")
+async def test_code_stream_endpoint(request: ChatRequest, http_request: Request):
+    """Run unit tests, send the report as a `test_result` event, then stream the AI evaluation."""
+    session = await open_test_session(request)
+    admit_llm(http_request, request.session_id, Priority.INTERACTIVE)
+    result = await run_session_tests(request, session)
+    test_result = result.value
+
+    async def events():
+        yield sse_event({"test_result": test_result, "timing": result.timing()}, "test_result")
+        tokens = stream_agent_response(
+            message="Hãy đánh giá kết quả unit test của học viên",
+            code=session.code,
+            terminal_output=session.terminal_output,
+            exercise=session.exercise,
+            is_code_evaluation=True
+        )
+        async for message in stream_tokens(record_reply(request.session_id, [], tokens)):
+            yield message
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def payload_response(request: Request, payload: JSONPayload) -> Response:
+    """Send a pre-encoded JSON payload, with 304 for a matching If-None-Match and gzip when accepted."""
+    headers = {"ETag": payload.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match", "")
+    etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+    if payload.etag in etags or "*" in etags:
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(payload.gzip_body, media_type="application/json", headers=headers)
+    return Response(payload.body, media_type="application/json", headers=headers)
+
+@app.get("/api/theory")
+async def list_theory(request: Request):
+    """List the id and title of every lesson."""
+    lesson_index.refresh()
+    return payload_response(request, lesson_index.list_payload)
+
 @app.get("/api/theory/{lesson_id}")
-async def get_theory(lesson_id: str):
+async def get_theory(request: Request, lesson_id: str):
     """Get theory content for a specific lesson."""
-    theory_dir = os.path.join(os.path.dirname(__file__), "app", "theory")
-    theory_file = os.path.join(theory_dir, f"{lesson_id}.md")
-    
-    if not os.path.exists(theory_file):
+    lesson = lesson_index.get(lesson_id)
+    if lesson is None:
         raise HTTPException(status_code=404, detail="Lesson not found")
-    
-    try:
-        with open(theory_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-        # Parse markdown content into sections
-        sections = []
-        current_title = None
-        current_content = []
-        
-        for line in content.split('\n'):
-            # Only process level 2 headings (##)
-            if line.startswith('## '):
-                # Save previous section if exists
-                if current_title is not None:
-                    sections.append({
-                        "title": current_title,
-                        "content": '\n'.join(current_content).strip()
-                    })
-                # Start new section
-                current_title = line[3:].strip()
-                current_content = []
-            else:
-                # Add line to current content
-                current_content.append(line)
-        
-        # Add the last section
-        if current_title is not None:
-            sections.append({
-                "title": current_title,
-                "content": '\n'.join(current_content).strip()
-            })
-        
-        return {"content": sections}
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return payload_response(request, lesson.payload)
+
+# Lesson đã render sang HTML, theo ETag của nội dung nên tự hết hạn khi file bài học thay đổi
+rendered_lessons = LRUCache(maxsize=64)
+
+@app.get("/api/theory/{lesson_id}/html")
+async def get_rendered_theory(request: Request, lesson_id: str):
+    """Get a lesson's sections rendered to HTML with highlighted code (styles from /render/pygments.css)."""
+    lesson = lesson_index.get(lesson_id)
+    if lesson is None:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    key = (lesson_id, lesson.payload.etag)
+    payload = rendered_lessons.get(key)
+    if payload is None:
+        payload = JSONPayload.encode({"content": [
+            {"title": section["title"], "html": renderer.render_markdown(section["content"])}
+            for section in lesson.sections
+        ]})
+        rendered_lessons.remove_if(lambda cached_key: cached_key[0] == lesson_id)
+        rendered_lessons.set(key, payload)
+    return payload_response(request, payload)
+
+@app.get("/render/pygments.css")
+async def pygments_css(request: Request):
+    """Stylesheet for the highlighted code returned by the rendering endpoints."""
+    headers = {"ETag": renderer.css_etag, "Cache-Control": "public, max-age=86400"}
+    if renderer.css_etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(renderer.css, media_type="text/css", headers=headers)
+
+@app.get("/llm/stats")
+async def llm_stats_endpoint():
+    """Calls, retries, timeouts, hedges and latency percentiles per LLM call site."""
+    return llm_gateway.stats()
+
+@app.get("/llm/coalescing/stats")
+async def coalescing_stats_endpoint():
+    """Upstream calls and coalesced requests per endpoint that opted in to request coalescing."""
+    return singleflight.stats()
+
+@app.get("/llm/scheduler/stats")
+async def scheduler_stats_endpoint():
+    """Running and waiting LLM calls per priority class and rejected request counts."""
+    return llm_scheduler.stats()
+
+def collect_metrics() -> None:
+    """Copy cache counters, queue depths and LLM call counters into the metrics registry."""
+    caches = {
+        "compile": compile_cache,
+        "test_results": test_result_cache,
+        "theory_answers": answer_cache,
+        "rendered_blocks": renderer.blocks,
+        "rendered_documents": renderer.documents,
+        "rendered_lessons": rendered_lessons,
+        "exercise_bank": exercise_bank,
+        "exercise_pool": exercise_pool,
+    }
+    for name, cache in caches.items():
+        lookups = cache.hits + cache.misses
+        metrics.cache_hits.set(cache.hits, cache=name)
+        metrics.cache_misses.set(cache.misses, cache=name)
+        metrics.cache_hit_ratio.set(cache.hits / lookups if lookups else 0.0, cache=name)
+        if isinstance(cache, LRUCache):
+            metrics.cache_entries.set(len(cache), cache=name)
+
+    for site, stats in llm_gateway.stats().items():
+        metrics.llm_calls.set(stats["calls"], site=site)
+        metrics.llm_retries.set(stats["retries"], site=site)
+        metrics.llm_errors.set(stats["errors"], site=site)
+        metrics.llm_timeouts.set(stats["timeouts"], site=site)
+        metrics.llm_hedges.set(stats["hedges"], site=site)
+
+    scheduler_stats = llm_scheduler.stats()
+    metrics.llm_running.set(scheduler_stats["running"])
+    for priority, waiting in scheduler_stats["waiting"].items():
+        metrics.llm_waiting.set(waiting, priority=priority)
+    for reason, count in scheduler_stats["rejected"].items():
+        metrics.llm_rejected.set(count, reason=reason)
+    for endpoint, stats in singleflight.stats().items():
+        metrics.llm_coalesced.set(stats["coalesced"], endpoint=endpoint)
+    metrics.execution_waiting.set(execution_scheduler.stats()["waiting"])
+
+metrics.registry.on_collect(collect_metrics)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus text exposition of request, LLM, agent, sandbox, cache and event loop metrics.
+
+    Latency histograms are split by stage (HTTP request, LLM slot wait, LLM
+    call, sandbox queue wait and run, event loop lag) so a slow percentile
+    can be traced to where the time went.
+    """
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/render/cache/stats")
+async def render_cache_stats_endpoint():
+    """Size and hit/miss counters of the highlighted code and rendered document caches."""
+    return renderer.stats()
+
+def resolve_theory_context(request: TheoryChatRequest, history: List[Dict[str, Any]]) -> str:
+    """
+    Pick the lesson sections relevant to the question.
+
+    The previous question is added to the query so follow-ups like
+    "cho ví dụ khác" still find the right section. Clients that still send
+    `theory_context` directly get it used as-is.
+    """
+    if request.lesson_id:
+        previous = [msg.get("content", "") for msg in history[:-1] if msg.get("role") == "user"][-1:]
+        context = retrieve_theory_context(request.lesson_id, " ".join(previous + [request.message]))
+        if context is None:
+            raise HTTPException(status_code=404, detail="Lesson not found")
+        return context
+    if request.theory_context is None:
+        raise HTTPException(status_code=400, detail="Missing lesson_id")
+    return request.theory_context
+
+async def single_token(text: str) -> AsyncIterator[str]:
+    yield text
+
+async def cache_answer(cache_key, tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Pass streamed tokens through and cache the full answer once it completes without error."""
+    parts = []
+    async for text in tokens:
+        parts.append(text)
+        yield text
+    answer_cache.set(cache_key, "".join(parts))
 
 @app.post("/theory_chat")
-async def theory_chat_endpoint(request: TheoryChatRequest):
-    response = await get_theory_chat_response(
-        message=request.message,
-        history=request.history,
-        theory_context=request.theory_context
+async def theory_chat_endpoint(request: TheoryChatRequest, http_request: Request):
+    session = await open_session(
+        request.session_id, request.history, theory_chat_messages(request), require_history=True
     )
+    cache_key = answer_cache_key(request.lesson_id, request.message, session.history)
+    response = answer_cache.get(cache_key) if cache_key else None
+    if response is None:
+        # Bài học không tồn tại thì trả về 404 trước khi trừ quota
+        theory_context = resolve_theory_context(request, session.history)
+        admit_llm(http_request, request.session_id, Priority.INTERACTIVE)
+        response = await get_theory_chat_response(
+            message=request.message,
+            history=session.history,
+            theory_context=theory_context,
+            session_id=request.session_id,
+            coalesce=coalescing_enabled("theory_chat")
+        )
+        if cache_key:
+            answer_cache.set(cache_key, response)
+    await remember_reply(request.session_id, theory_chat_messages(request), response)
     return {"response": response}
 
+@app.post("/theory_chat/stream")
+async def theory_chat_stream_endpoint(request: TheoryChatRequest, http_request: Request):
+    """Stream the answer to a theory question as Server-Sent Events."""
+    session = await open_session(
+        request.session_id, request.history, theory_chat_messages(request), require_history=True
+    )
+    cache_key = answer_cache_key(request.lesson_id, request.message, session.history)
+    cached = answer_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        tokens = single_token(cached)
+    else:
+        theory_context = resolve_theory_context(request, session.history)
+        admit_llm(http_request, request.session_id, Priority.INTERACTIVE)
+        tokens = stream_theory_chat_response(
+            message=request.message,
+            history=session.history,
+            theory_context=theory_context,
+            session_id=request.session_id,
+            coalesce=coalescing_enabled("theory_chat")
+        )
+        if cache_key:
+            tokens = cache_answer(cache_key, tokens)
+    tokens = record_reply(request.session_id, theory_chat_messages(request), tokens)
+    return StreamingResponse(stream_tokens(tokens), media_type="text/event-stream")
+
+def require_admin(token: Optional[str]) -> None:
+    """Reject the request unless it carries the configured admin token; without one, admin endpoints are disabled."""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if not token or not secrets.compare_digest(token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/theory_chat/cache/stats")
+async def theory_answer_cache_stats_endpoint():
+    """Hit/miss counters for the theory answer cache."""
+    return answer_cache.stats()
+
+@app.delete("/admin/theory_chat/cache")
+async def purge_theory_answer_cache_endpoint(lesson_id: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """Drop cached theory answers, for one lesson or all of them."""
+    require_admin(x_admin_token)
+    if lesson_id:
+        removed = answer_cache.remove_if(lambda key: key[0] == lesson_id)
+    else:
+        removed = len(answer_cache)
+        answer_cache.clear()
+    return {"removed": removed}
+
+async def recent_traces_endpoint(limit: int = 50, x_admin_token: Optional[str] = Header(None)):
+    """The newest request traces, with their span count and time spent per span kind."""
+    require_admin(x_admin_token)
+    return {"traces": trace_store.recent(limit), "dropped_spans": trace_store.dropped}
+
+async def trace_endpoint(request_id: str, x_admin_token: Optional[str] = Header(None)):
+    """The spans (LLM calls, tool calls, parse error retries, agent run) recorded for one request."""
+    require_admin(x_admin_token)
+    spans = trace_store.get(request_id)
+    if spans is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return {"request_id": request_id, "spans": spans}
+
+# Endpoint xem trace chỉ được đăng ký khi bật TRACE_DEBUG_ENDPOINTS
+if settings.TRACE_DEBUG_ENDPOINTS:
+    app.get("/debug/traces")(recent_traces_endpoint)
+    app.get("/debug/traces/{request_id}")(trace_endpoint)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,24 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Client LLM được tạo lúc import nhưng test không gọi API thật
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+@pytest.fixture(scope="module")
+def main_module(tmp_path_factory):
+    # main.py mount thư mục static theo cwd
+    directory = tmp_path_factory.mktemp("app")
+    (directory / "static").mkdir()
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield importlib.import_module("main")
+    finally:
+        os.chdir(cwd)
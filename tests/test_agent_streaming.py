@@ -0,0 +1,77 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from app import agent
+from app.agent import FinalAnswerStreamHandler
+from app.streaming import ANSWER_RESET, stream_tokens
+from app.tracing import PARSE_ERROR_TOOL
+
+
+def feed(handler: FinalAnswerStreamHandler, tokens):
+    async def run():
+        await handler.on_chat_model_start()
+        for token in tokens:
+            await handler.on_llm_new_token(token)
+
+    asyncio.run(run())
+
+
+def queued(queue: asyncio.Queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_only_the_final_answer_is_forwarded():
+    handler = FinalAnswerStreamHandler(asyncio.Queue())
+    feed(handler, ["Thought: Tôi cần", " xem code.\nAction: read_code\nAction Input: code"])
+    feed(handler, ["Thought: Xong.\nFinal", " Answer:", " Code", " đúng rồi."])
+    assert queued(handler.queue) == ["Code", " đúng rồi."]
+    assert handler.streamed
+
+
+def test_a_step_with_both_action_and_final_answer_is_not_streamed():
+    handler = FinalAnswerStreamHandler(asyncio.Queue())
+    feed(handler, ["Action: read_code\n", "Final Answer: sai định dạng"])
+    assert queued(handler.queue) == []
+    assert not handler.streamed
+
+
+def test_a_rejected_final_answer_is_reset():
+    handler = FinalAnswerStreamHandler(asyncio.Queue())
+    feed(handler, ["Final Answer: lần một"])
+    asyncio.run(handler.on_tool_start({"name": PARSE_ERROR_TOOL}, "error"))
+    feed(handler, ["Final Answer: lần hai"])
+    assert queued(handler.queue) == ["lần một", ANSWER_RESET, "lần hai"]
+
+
+def test_stream_agent_response_yields_the_final_answer(monkeypatch):
+    llm = GenericFakeChatModel(messages=iter([
+        AIMessage(content="Thought: Tôi cần xem code.\nAction: read_code\nAction Input: code"),
+        AIMessage(content="Thought: Xong.\nFinal Answer: Code của em đúng rồi."),
+    ]))
+    monkeypatch.setattr(agent, "chat_stream_executor", agent.build_executor(agent.chat_prompt, llm))
+
+    async def run():
+        return [text async for text in agent.stream_agent_response("Code sai ở đâu?", code="x = 1")]
+
+    tokens = asyncio.run(run())
+    assert "".join(tokens) == "Code của em đúng rồi."
+    # Câu trả lời được gửi từng token chứ không phải một lần ở cuối
+    assert len(tokens) > 1
+
+
+def test_reset_becomes_an_sse_event_and_is_dropped_from_the_response():
+    async def tokens():
+        for text in ("bị từ chối", ANSWER_RESET, "câu trả lời"):
+            yield text
+
+    async def run():
+        return [message async for message in stream_tokens(tokens())]
+
+    messages = asyncio.run(run())
+    assert messages[1] == "event: reset\ndata: {}\n\n"
+    assert messages[-1] == 'event: done\ndata: {"response": "câu trả lời"}\n\n'
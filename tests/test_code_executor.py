@@ -0,0 +1,97 @@
+import marshal
+import traceback
+
+import pytest
+
+from app import code_executor
+from app.code_executor import compile_cached, is_deterministic, normalize_code, run_unit_tests
+from app.test_harness import summarize
+
+UNIT_TEST = "import unittest\nclass TestAdd(unittest.TestCase):\n    def test_add(self):\n        self.assertEqual(add(1, 2), 3)\n"
+
+
+def error_line(compiled) -> int:
+    try:
+        exec(marshal.loads(compiled), {})
+    except ZeroDivisionError as e:
+        return traceback.extract_tb(e.__traceback__)[-1].lineno
+    raise AssertionError("code did not raise")
+
+
+def test_compiled_code_keeps_the_line_numbers_of_each_source():
+    first = compile_cached("x = 1\ny = x / 0\n")
+    second = compile_cached("x = 1\n\n# chia cho 0\ny = x / 0\n")
+    assert error_line(first) == 2
+    assert error_line(second) == 4
+
+
+def test_source_that_does_not_compile_is_returned_unchanged():
+    assert compile_cached("def broken(:\n") == "def broken(:\n"
+
+
+def test_normalized_hash_ignores_comments_and_blank_lines():
+    assert normalize_code("x = 1\n")[0] == normalize_code("# gán x\n\nx = 1  # một\n")[0]
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("def add(a, b):\n    return a + b\n", True),
+    ("import random\nx = random.random()\n", False),
+    ("from datetime import datetime\n", False),
+    ("import os.path\n", False),
+    ("x = id(object())\n", False),
+    ("from typing import List\n", True),
+])
+def test_is_deterministic(code, expected):
+    assert is_deterministic(normalize_code(code)[1]) is expected
+
+
+@pytest.fixture
+def sandbox_runs(monkeypatch):
+    """Replace the sandbox with a fake whose next report can be set by the test."""
+    code_executor.test_result_cache.clear()
+    runs = []
+    state = {"report": {**summarize([{"name": "test_add", "status": "passed", "message": "", "duration_ms": 1.0}]), "output": ""}}
+
+    def run_unit_tests(code, unit_test, test_names=None):
+        runs.append(code)
+        return dict(state["report"])
+
+    monkeypatch.setattr(code_executor.sandbox_pool, "run_unit_tests", run_unit_tests)
+    yield runs, state
+    code_executor.test_result_cache.clear()
+
+
+def test_passing_report_is_reused_for_reformatted_code(sandbox_runs):
+    runs, _ = sandbox_runs
+    run_unit_tests("def add(a, b):\n    return a + b\n", UNIT_TEST)
+    report = run_unit_tests("def add(a, b):\n\n    # cộng\n    return a + b\n", UNIT_TEST)
+    assert report["passed"]
+    assert len(runs) == 1
+
+
+@pytest.mark.parametrize("changes", [
+    {"output": "debug\n"},
+    {"error": "Error executing code:\nTraceback ...", "passed": False},
+    {"truncated": True},
+])
+def test_reports_tied_to_the_source_are_not_cached(sandbox_runs, changes):
+    runs, state = sandbox_runs
+    state["report"] = {**state["report"], **changes}
+    run_unit_tests("def add(a, b):\n    return a + b\n", UNIT_TEST)
+    run_unit_tests("def add(a, b):\n    return a + b\n", UNIT_TEST)
+    assert len(runs) == 2
+
+
+def test_nondeterministic_code_is_not_cached(sandbox_runs):
+    runs, _ = sandbox_runs
+    code = "import random\ndef add(a, b):\n    return a + b + random.choice([0])\n"
+    run_unit_tests(code, UNIT_TEST)
+    run_unit_tests(code, UNIT_TEST)
+    assert len(runs) == 2
+
+
+def test_sequential_and_parallel_reports_are_cached_separately(sandbox_runs):
+    runs, _ = sandbox_runs
+    run_unit_tests("def add(a, b):\n    return a + b\n", UNIT_TEST, parallel=False)
+    run_unit_tests("def add(a, b):\n    return a + b\n", UNIT_TEST, parallel=True)
+    assert len(runs) == 2
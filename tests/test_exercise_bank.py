@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from app.exercise_bank import EXERCISE_FIELDS, ExerciseBank, content_hash
+
+
+def make_exercise(description: str) -> dict:
+    return {name: f"{name} of {description}" for name in EXERCISE_FIELDS}
+
+
+@pytest.fixture
+def bank(tmp_path):
+    bank = ExerciseBank(str(tmp_path / "exercises.db"))
+    bank.start()
+    yield bank
+    bank.shutdown()
+
+
+def test_stats_before_start_are_empty(tmp_path):
+    bank = ExerciseBank(str(tmp_path / "exercises.db"))
+    assert bank.stats()["topics"] == {}
+    assert not (tmp_path / "exercises.db").exists()
+
+
+def test_add_stores_each_exercise_once(bank):
+    first = bank.add("list", ["sách", "âm nhạc"], make_exercise("a"))
+    second = bank.add("list", ["âm nhạc", "sách"], make_exercise("a"))
+    assert first == second
+    assert bank.stats()["topics"] == {"list": {"exercises": 1, "served": 0}}
+
+
+def test_take_unseen_never_repeats_an_exercise_for_a_session(bank):
+    bank.add("list", None, make_exercise("a"))
+    bank.add("list", None, make_exercise("b"))
+    seen = [bank.take_unseen("list", "s1") for _ in range(2)]
+    assert {exercise["description"] for exercise in seen} == {"description of a", "description of b"}
+    assert bank.take_unseen("list", "s1") is None
+    assert bank.take_unseen("list", "s2") is not None
+    assert bank.stats()["hits"] == 3
+    assert bank.stats()["misses"] == 1
+
+
+def test_exercise_added_for_a_session_counts_as_seen(bank):
+    bank.add("list", None, make_exercise("a"), session_id="s1")
+    assert bank.take_unseen("list", "s1") is None
+
+
+def test_async_methods_run_off_the_event_loop(bank):
+    async def run():
+        await bank.aadd("set", None, make_exercise("a"))
+        return await bank.atake_unseen("set", "s1")
+
+    assert asyncio.run(run())["description"] == "description of a"
+
+
+def test_least_served_does_not_mark_exercises_served(bank):
+    bank.add("list", ["sách", "âm nhạc"], make_exercise("a"))
+    bank.add("list", None, make_exercise("b"))
+    bank.take_unseen("list", "s1")
+    stored = bank.least_served("list", 5)
+    assert [exercise["description"] for _, exercise in stored] == ["description of b", "description of a"]
+    assert stored[1][0] == ["sách", "âm nhạc"]
+    assert bank.stats()["topics"]["list"]["served"] == 1
+
+
+def test_seen_hashes_lists_the_session_exercises_of_a_topic(bank):
+    bank.add("list", None, make_exercise("a"), session_id="s1")
+    bank.add("set", None, make_exercise("b"), session_id="s1")
+    assert bank.seen_hashes("list", "s1") == {content_hash(make_exercise("a"))}
+    assert bank.seen_hashes("list", "s2") == set()
@@ -0,0 +1,81 @@
+import pytest
+
+from app.generate_exercise import ExerciseParser, parse_exercise
+
+EXERCISE = """- Mô tả:
+Viết hàm `add(a, b)` trả về tổng hai số.
+- Ví dụ:
+```python
+add(1, 2)
+```
+Output:
+```python
+3
+```
+- Giải thích:
+1 + 2 = 3
+- Hàm cần hoàn chỉnh:
+```python
+    def add(a, b):
+        pass
+```
+- Unit test:
+```python
+import unittest
+class TestAdd(unittest.TestCase):
+    def test_add(self):
+        self.assertEqual(add(1, 2), 3)
+```
+"""
+
+
+def test_parses_every_field():
+    exercise = parse_exercise(EXERCISE)
+    assert exercise["description"] == "Viết hàm `add(a, b)` trả về tổng hai số."
+    assert exercise["example"] == "```python\nadd(1, 2)\n```"
+    assert exercise["example_output"] == "```python\n3\n```"
+    assert exercise["explanation"] == "1 + 2 = 3"
+    assert exercise["function"] == "def add(a, b):\n    pass"
+    assert exercise["unit_test"].startswith("import unittest\nclass TestAdd")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_streamed_chunks_give_the_same_fields(chunk_size):
+    parser = ExerciseParser()
+    fields = []
+    for start in range(0, len(EXERCISE), chunk_size):
+        fields.extend(parser.feed(EXERCISE[start:start + chunk_size]))
+    fields.extend(parser.finish())
+    assert dict(fields) == parse_exercise(EXERCISE)
+    assert [name for name, _ in fields] == ["description", "example", "example_output", "explanation", "function", "unit_test"]
+
+
+def test_fields_are_returned_as_soon_as_the_next_marker_arrives():
+    parser = ExerciseParser()
+    assert parser.feed("- Mô tả:\nMô tả bài tập\n") == []
+    assert parser.feed("- Ví dụ:") == [("description", "Mô tả bài tập")]
+
+
+def test_missing_section_is_reported_on_finish():
+    content = EXERCISE.split("- Unit test:")[0]
+    with pytest.raises(ValueError, match="thiếu phần '- Unit test:'"):
+        parse_exercise(content)
+
+
+def test_out_of_order_section_is_reported_when_it_arrives():
+    parser = ExerciseParser()
+    parser.feed("- Mô tả:\nMô tả\n")
+    with pytest.raises(ValueError, match="thiếu phần '- Ví dụ:'"):
+        parser.feed("- Giải thích:\nGiải thích\n")
+
+
+def test_output_without_description_fails_after_the_preamble_limit():
+    parser = ExerciseParser()
+    parser.feed("x" * ExerciseParser.MAX_PREAMBLE)
+    with pytest.raises(ValueError, match="thiếu phần '- Mô tả:'"):
+        parser.feed("x")
+
+
+def test_empty_output_is_rejected():
+    with pytest.raises(ValueError, match="thiếu phần '- Mô tả:'"):
+        parse_exercise("")
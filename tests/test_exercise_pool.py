@@ -0,0 +1,97 @@
+import asyncio
+
+from app.exercise_bank import EXERCISE_FIELDS, content_hash
+from app.exercise_pool import ExercisePool
+
+
+def make_exercise(description: str) -> dict:
+    return {name: f"{name} of {description}" for name in EXERCISE_FIELDS}
+
+
+def test_pool_is_filled_in_the_background_and_refilled_after_take():
+    async def run():
+        created = []
+
+        async def factory(topic):
+            created.append(topic)
+            return ["a", "b"], make_exercise(str(len(created)))
+
+        pool = ExercisePool(2, factory)
+        pool.start(["list"])
+        await asyncio.sleep(0.01)
+        exercise = pool.take("list")
+        await asyncio.sleep(0.01)
+        stats = pool.stats()
+        await pool.shutdown()
+        return exercise, created, stats
+
+    exercise, created, stats = asyncio.run(run())
+    assert exercise[1]["description"] == "description of 1"
+    assert created == ["list"] * 3
+    assert stats["depth"] == {"list": 2}
+    assert stats["hits"] == 1
+
+
+def test_pool_is_seeded_before_generating():
+    async def run():
+        created = []
+
+        async def factory(topic):
+            created.append(topic)
+            return [], make_exercise("generated")
+
+        pool = ExercisePool(2, factory, seed=lambda topic, limit: [(["a", "b"], make_exercise("stored"))][:limit])
+        pool.start(["list"])
+        await asyncio.sleep(0.01)
+        stats = pool.stats()
+        await pool.shutdown()
+        return created, stats
+
+    created, stats = asyncio.run(run())
+    assert created == ["list"]
+    assert stats["seeded"] == 1
+    assert stats["depth"] == {"list": 2}
+
+
+def test_take_skips_excluded_exercises():
+    async def run():
+        seed = [([], make_exercise("seen")), ([], make_exercise("new"))]
+        pool = ExercisePool(2, lambda topic: asyncio.Event().wait(), seed=lambda topic, limit: seed[:limit])
+        pool.start(["list"])
+        await asyncio.sleep(0.01)
+        exercise = pool.take("list", exclude={content_hash(make_exercise("seen"))})
+        missing = pool.take("list", exclude={content_hash(make_exercise("seen"))})
+        await pool.shutdown()
+        return exercise, missing
+
+    exercise, missing = asyncio.run(run())
+    assert exercise[1]["description"] == "description of new"
+    assert missing is None
+
+
+def test_failures_back_off_and_stop_until_the_next_take():
+    async def run():
+        attempts = []
+
+        async def factory(topic):
+            attempts.append(asyncio.get_running_loop().time())
+            raise RuntimeError("invalid api key")
+
+        pool = ExercisePool(1, factory, retry_delay=0.01, max_retry_delay=0.02, max_failures=3)
+        pool.start(["list"])
+        await asyncio.sleep(0.2)
+        stopped_after = len(attempts)
+        pool.take("list")
+        await asyncio.sleep(0.05)
+        stats = pool.stats()
+        await pool.shutdown()
+        return attempts, stopped_after, stats
+
+    attempts, stopped_after, stats = asyncio.run(run())
+    assert stopped_after == 3
+    # Lần take sau khi dừng chỉ thử lại một lần
+    assert len(attempts) == 4
+    assert attempts[2] - attempts[1] >= attempts[1] - attempts[0]
+    assert stats["refill_failures"] == 4
+    assert stats["consecutive_failures"] == {"list": 4}
+    assert stats["last_errors"] == {"list": "RuntimeError: invalid api key"}
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from app.cache import LRUCache
+from app.history import HistoryManager
+from app.llm_gateway import LLMTimeoutError
+from app.tracing import request_id_var, trace_store
+
+
+class FailingLLM:
+    def __init__(self, error: Exception):
+        self.error = error
+
+    async def ainvoke(self, prompt):
+        raise self.error
+
+
+def make_history(count: int):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"tin nhắn số {i} " * 10} for i in range(count)]
+
+
+def make_manager(llm) -> HistoryManager:
+    return HistoryManager(llm, token_budget=100, recent_turns=2, cache=LRUCache(10, 60))
+
+
+def test_failed_summary_keeps_recent_messages_and_records_a_trace_event():
+    history = make_history(10)
+    manager = make_manager(FailingLLM(RuntimeError("boom")))
+    token = request_id_var.set("history-test")
+    try:
+        text = asyncio.run(manager.build(history, "session"))
+    finally:
+        request_id_var.reset(token)
+    assert "tin nhắn số 9" in text
+    assert "tin nhắn số 0" not in text
+    event = trace_store.get("history-test")[-1]
+    assert event["name"] == "history_summary_fallback"
+    assert "boom" in event["error"]
+    assert event["attributes"]["dropped_messages"] == 8
+
+
+def test_timeouts_are_not_hidden_by_the_fallback():
+    manager = make_manager(FailingLLM(LLMTimeoutError("too slow")))
+    with pytest.raises(LLMTimeoutError):
+        asyncio.run(manager.build(make_history(10), "session"))
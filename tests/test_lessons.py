@@ -0,0 +1,108 @@
+import json
+import os
+
+from fastapi.testclient import TestClient
+
+from app.lessons import LessonIndex, SectionIndex, format_sections, parse_sections, tokenize
+
+LESSON = """# Vòng lặp
+
+## Vòng lặp for
+Dùng for để duyệt qua từng phần tử của list.
+
+## Vòng lặp while
+While lặp lại khi điều kiện còn đúng.
+
+## Lệnh break
+Break thoát khỏi vòng lặp ngay lập tức.
+
+## Hàm range
+Range tạo dãy số để dùng với for.
+"""
+
+
+def make_index() -> SectionIndex:
+    index = SectionIndex()
+    index.add_lesson("loops", parse_sections(LESSON))
+    return index
+
+
+def test_tokens_ignore_case_and_diacritics():
+    assert tokenize("Vòng Lặp ĐIỀU KIỆN") == tokenize("vong lap dieu kien") == ["vong", "lap", "dieu", "kien"]
+
+
+def test_search_returns_the_best_sections_in_lesson_order():
+    sections = make_index().search("loops", "dieu kien cua while", 1)
+    assert [section["title"] for section in sections] == ["Vòng lặp while"]
+    sections = make_index().search("loops", "thoát vòng lặp bằng break, range", 2)
+    assert [section["title"] for section in sections] == ["Lệnh break", "Hàm range"]
+
+
+def test_search_falls_back_to_the_first_sections():
+    sections = make_index().search("loops", "giải thích lại giúp mình", 2)
+    assert [section["title"] for section in sections] == ["Vòng lặp for", "Vòng lặp while"]
+    assert make_index().search("missing", "for", 2) == []
+
+
+def test_removed_lessons_are_not_searched():
+    index = make_index()
+    index.remove_lesson("loops")
+    assert index.search("loops", "for", 2) == []
+
+
+def test_sections_are_formatted_with_their_headings():
+    sections = parse_sections(LESSON)[:1]
+    assert format_sections(sections) == "## Vòng lặp for\nDùng for để duyệt qua từng phần tử của list."
+
+
+def write_lesson(directory, lesson_id: str, content: str, mtime: float) -> None:
+    path = directory / f"{lesson_id}.md"
+    path.write_text(content, encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+def test_lesson_index_reloads_changed_and_removed_lessons(tmp_path):
+    write_lesson(tmp_path, "loops", LESSON, 1000)
+    write_lesson(tmp_path, "lists", "# List\n\n## Tạo list\nDùng ngoặc vuông.\n", 1000)
+    sections = SectionIndex()
+    index = LessonIndex(str(tmp_path), sections, reload_interval=0)
+    changes = []
+    index.on_change(changes.append)
+    index.build()
+    assert [lesson["id"] for lesson in json.loads(index.list_payload.body)["lessons"]] == ["lists", "loops"]
+    etag = index.get("loops").payload.etag
+
+    assert index.refresh() == []
+    write_lesson(tmp_path, "loops", LESSON.replace("Hàm range", "Hàm enumerate"), 2000)
+    os.remove(tmp_path / "lists.md")
+    assert index.refresh() == ["lists", "loops"]
+    assert changes[-2:] == ["lists", "loops"]
+    assert index.get("lists") is None
+    assert index.get("loops").payload.etag != etag
+    assert sections.search("lists", "list", 1) == []
+    assert sections.search("loops", "enumerate", 1)[0]["title"] == "Hàm enumerate"
+
+
+def test_lessons_are_checked_at_most_once_per_interval(tmp_path):
+    write_lesson(tmp_path, "loops", LESSON, 1000)
+    index = LessonIndex(str(tmp_path), SectionIndex(), reload_interval=60)
+    index.build()
+    write_lesson(tmp_path, "loops", "# Đổi\n", 2000)
+    assert index.refresh() == []
+    assert index.refresh(force=True) == ["loops"]
+
+
+def test_lesson_endpoint_supports_etag_and_gzip(main_module):
+    client = TestClient(main_module.app)
+    response = client.get("/api/theory/list")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert response.json()["content"][0]["title"] == "1. Danh sách (List) là gì?"
+
+    assert client.get("/api/theory/list", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/api/theory/list", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+    response = client.get("/api/theory/list", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    # httpx tự giải nén body gzip
+    assert response.content == main_module.lesson_index.get("list").payload.body
+    assert client.get("/api/theory/missing").status_code == 404
@@ -0,0 +1,168 @@
+import asyncio
+import threading
+
+import httpx
+import openai
+import pytest
+
+from app import llm_gateway as gateway_module
+from app.llm_gateway import LLMGateway, LLMTimeoutError
+from app.llm_scheduler import LLMScheduler
+
+
+def make_gateway(**kwargs) -> LLMGateway:
+    options = {
+        "timeout": 1.0, "max_retries": 2, "backoff_base": 0.001, "backoff_max": 0.01,
+        "hedge": False, "hedge_min_samples": 3, "max_connections": 2,
+    }
+    options.update(kwargs)
+    return LLMGateway(**options)
+
+
+def status_error(status_code: int) -> openai.APIStatusError:
+    request = httpx.Request("POST", "https://api.example.com")
+    return openai.APIStatusError("error", response=httpx.Response(status_code, request=request), body=None)
+
+
+@pytest.fixture(autouse=True)
+def scheduler(monkeypatch):
+    scheduler = LLMScheduler(concurrency=1, queue_size=5, max_wait=1, session_rate=0, session_burst=0)
+    monkeypatch.setattr(gateway_module, "llm_scheduler", scheduler)
+    return scheduler
+
+
+def test_call_retries_transient_errors():
+    gateway = make_gateway()
+    attempts = []
+
+    async def factory():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise status_error(529)
+        return "answer"
+
+    assert asyncio.run(gateway.call("test", factory)) == "answer"
+    assert gateway.stats()["test"]["retries"] == 2
+    assert gateway.stats()["test"]["errors"] == 0
+
+
+def test_call_does_not_retry_client_errors():
+    gateway = make_gateway()
+    attempts = []
+
+    async def factory():
+        attempts.append(1)
+        raise status_error(400)
+
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(gateway.call("test", factory))
+    assert len(attempts) == 1
+    assert gateway.stats()["test"]["errors"] == 1
+
+
+def test_call_gives_up_after_max_retries():
+    gateway = make_gateway(max_retries=1)
+
+    async def factory():
+        raise status_error(503)
+
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(gateway.call("test", factory))
+    assert gateway.stats()["test"]["retries"] == 1
+
+
+def test_call_times_out():
+    gateway = make_gateway()
+    with pytest.raises(LLMTimeoutError):
+        asyncio.run(gateway.call("test", lambda: asyncio.sleep(1), timeout=0.02))
+    assert gateway.stats()["test"]["timeouts"] == 1
+
+
+def test_slow_call_is_hedged_and_the_first_answer_wins():
+    async def run():
+        gateway = make_gateway(hedge=True)
+        for _ in range(3):
+            await gateway.call("test", lambda: asyncio.sleep(0.001, result="warmup"))
+        attempts = []
+
+        async def factory():
+            attempts.append(1)
+            # Request đầu bị treo, request hedge trả lời ngay
+            await asyncio.sleep(1 if len(attempts) == 1 else 0)
+            return f"answer {len(attempts)}"
+
+        return gateway, await gateway.call("test", factory)
+
+    gateway, answer = asyncio.run(run())
+    assert answer == "answer 2"
+    assert gateway.stats()["test"]["hedges"] == 1
+    assert gateway.stats()["test"]["hedge_wins"] == 1
+
+
+def test_stream_retries_before_the_first_chunk():
+    gateway = make_gateway()
+    attempts = []
+
+    async def chunks():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise status_error(529)
+        for chunk in ("a", "b"):
+            yield chunk
+
+    async def run():
+        return [chunk async for chunk in gateway.stream("test", chunks)]
+
+    assert asyncio.run(run()) == ["a", "b"]
+    assert len(attempts) == 2
+
+
+def test_stream_fails_when_it_stalls_after_the_first_chunk():
+    gateway = make_gateway(stream_idle_timeout=0.02)
+
+    async def chunks():
+        yield "a"
+        await asyncio.sleep(1)
+        yield "b"
+
+    async def run():
+        received = []
+        with pytest.raises(LLMTimeoutError):
+            async for chunk in gateway.stream("test", chunks):
+                received.append(chunk)
+        return received
+
+    assert asyncio.run(run()) == ["a"]
+    assert gateway.stats()["test"]["timeouts"] == 1
+
+
+def test_call_sync_waits_for_a_scheduler_slot(scheduler):
+    gateway = make_gateway()
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            async with scheduler.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        finished = threading.Event()
+        sync_call = asyncio.get_running_loop().run_in_executor(
+            None, lambda: (gateway.call_sync("test", lambda: "answer"), finished.set())[0]
+        )
+        await asyncio.sleep(0.05)
+        blocked = not finished.is_set()
+        release.set()
+        await holder
+        return blocked, await sync_call
+
+    blocked, answer = asyncio.run(run())
+    assert blocked
+    assert answer == "answer"
+
+
+def test_call_sync_runs_directly_without_an_event_loop():
+    gateway = make_gateway()
+    assert gateway.call_sync("test", lambda: "answer") == "answer"
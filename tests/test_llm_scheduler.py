@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from app.llm_scheduler import LLMBusyError, LLMScheduler, Priority, llm_priority
+
+
+def make_scheduler(**kwargs) -> LLMScheduler:
+    options = {"concurrency": 1, "queue_size": 1, "max_wait": 0.05, "session_rate": 0, "session_burst": 0}
+    options.update(kwargs)
+    return LLMScheduler(**options)
+
+
+async def hold_slot(scheduler: LLMScheduler, release: asyncio.Event, priority: Priority = Priority.INTERACTIVE) -> None:
+    llm_priority.set(priority)
+    async with scheduler.slot():
+        await release.wait()
+
+
+def test_rejects_when_the_queue_is_full():
+    async def run():
+        scheduler = make_scheduler(max_wait=1)
+        release = asyncio.Event()
+        running = asyncio.create_task(hold_slot(scheduler, release))
+        waiting = asyncio.create_task(hold_slot(scheduler, release))
+        await asyncio.sleep(0.01)
+        with pytest.raises(LLMBusyError) as busy:
+            await hold_slot(scheduler, release)
+        release.set()
+        await asyncio.gather(running, waiting)
+        return scheduler, busy.value
+
+    scheduler, error = asyncio.run(run())
+    assert error.status_code == 503
+    assert scheduler.stats()["rejected"] == {"queue_full": 1}
+    assert scheduler.stats()["running"] == 0
+
+
+def test_rejects_after_waiting_too_long():
+    async def run():
+        scheduler = make_scheduler(queue_size=5)
+        release = asyncio.Event()
+        running = asyncio.create_task(hold_slot(scheduler, release))
+        await asyncio.sleep(0.01)
+        with pytest.raises(LLMBusyError):
+            await hold_slot(scheduler, release)
+        stats = scheduler.stats()
+        release.set()
+        await running
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats["rejected"] == {"wait_timeout": 1}
+    # Request hết hạn chờ đã được bỏ khỏi hàng đợi
+    assert stats["waiting"]["interactive"] == 0
+
+
+def test_background_calls_wait_instead_of_being_rejected():
+    async def run():
+        scheduler = make_scheduler(queue_size=0)
+        release = asyncio.Event()
+        running = asyncio.create_task(hold_slot(scheduler, release))
+        await asyncio.sleep(0.01)
+        background = asyncio.create_task(hold_slot(scheduler, asyncio.Event(), Priority.BACKGROUND))
+        await asyncio.sleep(0.1)
+        queued = not background.done()
+        release.set()
+        await running
+        background.cancel()
+        await asyncio.gather(background, return_exceptions=True)
+        return queued
+
+    assert asyncio.run(run())
+
+
+def test_free_slots_go_to_the_highest_priority_first():
+    async def run():
+        scheduler = make_scheduler(queue_size=5, max_wait=1)
+        release = asyncio.Event()
+        order = []
+
+        async def call(name, priority):
+            llm_priority.set(priority)
+            async with scheduler.slot():
+                order.append(name)
+
+        running = asyncio.create_task(hold_slot(scheduler, release))
+        await asyncio.sleep(0.01)
+        background = asyncio.create_task(call("background", Priority.BACKGROUND))
+        generation = asyncio.create_task(call("generation", Priority.GENERATION))
+        interactive = asyncio.create_task(call("interactive", Priority.INTERACTIVE))
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(running, background, generation, interactive)
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "generation", "background"]
+
+
+def test_admit_limits_each_session():
+    scheduler = make_scheduler(session_rate=0.001, session_burst=2)
+    scheduler.admit("session", "10.0.0.1", Priority.INTERACTIVE)
+    scheduler.admit("session", "10.0.0.1", Priority.INTERACTIVE)
+    with pytest.raises(LLMBusyError) as limited:
+        scheduler.admit("session", "10.0.0.1", Priority.INTERACTIVE)
+    assert limited.value.status_code == 429
+    assert limited.value.retry_after > 0
+    # Session khác vẫn được phục vụ
+    scheduler.admit("other", "10.0.0.1", Priority.INTERACTIVE)
+
+
+def test_admit_limits_each_ip_across_sessions():
+    scheduler = make_scheduler(session_rate=0.001, session_burst=2, ip_rate=0.001, ip_burst=3)
+    for index in range(3):
+        scheduler.admit(f"session-{index}", "10.0.0.1", Priority.INTERACTIVE)
+    with pytest.raises(LLMBusyError):
+        scheduler.admit("session-new", "10.0.0.1", Priority.INTERACTIVE)
+    scheduler.admit("session-new", "10.0.0.2", Priority.INTERACTIVE)
+
+
+def test_admit_sets_the_request_priority():
+    async def run():
+        scheduler = make_scheduler()
+        scheduler.admit(None, "10.0.0.1", Priority.GENERATION)
+        return llm_priority.get()
+
+    assert asyncio.run(run()) == Priority.GENERATION
@@ -0,0 +1,47 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.metrics import MetricsRegistry
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency.", ("route",), (0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value, route="/chat")
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP latency_seconds Latency.", "# TYPE latency_seconds histogram"]
+    assert lines[2:] == [
+        'latency_seconds_bucket{route="/chat",le="0.1"} 2',
+        'latency_seconds_bucket{route="/chat",le="1"} 3',
+        'latency_seconds_bucket{route="/chat",le="+Inf"} 4',
+        'latency_seconds_sum{route="/chat"} 5.65',
+        'latency_seconds_count{route="/chat"} 4',
+    ]
+
+
+def test_counters_check_labels_and_escape_values():
+    registry = MetricsRegistry()
+    counter = registry.counter("errors_total", "Errors.", ("site",))
+    counter.inc(site='say "hi"\n')
+    counter.inc(2, site='say "hi"\n')
+    assert 'errors_total{site="say \\"hi\\"\\n"} 3' in registry.render()
+    with pytest.raises(ValueError):
+        counter.inc(other="x")
+
+
+def test_collectors_run_on_each_render():
+    registry = MetricsRegistry()
+    gauge = registry.gauge("queue_depth", "Depth.")
+    depth = iter([3, 1])
+    registry.on_collect(lambda: gauge.set(next(depth)))
+    assert "queue_depth 3" in registry.render()
+    assert "queue_depth 1" in registry.render()
+
+
+def test_metrics_endpoint_times_requests_by_route(main_module):
+    client = TestClient(main_module.app)
+    assert client.get("/api/theory/list").status_code == 200
+    body = client.get("/metrics").text
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/theory/{lesson_id}",status="200"}' in body
+    assert 'cache_hit_ratio{cache="compile"}' in body
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+from app import chat
+from app.rendering import CodeRenderer
+
+
+def test_code_blocks_are_highlighted_and_cached():
+    renderer = CodeRenderer("default", 16)
+    content = "Ví dụ:\n\n```python\nprint('xin chào')\n```\n"
+    html = renderer.render_markdown(content)
+    assert 'class="highlight"' in html
+    assert renderer.render_markdown(content) == html
+    assert renderer.stats()["documents"]["hits"] == 1
+    # Cùng code block trong tin nhắn khác dùng lại phần đã highlight
+    renderer.render_markdown("Lần nữa:\n\n```python\nprint('xin chào')\n```\n")
+    assert renderer.stats()["blocks"] == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_blocks_without_language_are_python_and_unknown_languages_are_escaped():
+    renderer = CodeRenderer("default", 16)
+    renderer.render_markdown("```\nx = 1\n```")
+    renderer.highlight("x = 1\n", "python")
+    assert renderer.stats()["blocks"]["hits"] == 1
+    html = renderer.highlight("<b>", "khong-co-ngon-ngu-nay")
+    assert html == '<pre><code class="khong-co-ngon-ngu-nay">&lt;b&gt;</code></pre>'
+
+
+def test_stylesheet_etag_follows_the_css():
+    renderer = CodeRenderer("default", 16)
+    assert ".highlight" in renderer.css
+    assert renderer.css_etag == CodeRenderer("default", 16).css_etag
+    assert renderer.css_etag != CodeRenderer("monokai", 16).css_etag
+
+
+def test_chat_response_is_rendered(monkeypatch):
+    monkeypatch.setattr(chat, "chat", SimpleNamespace(invoke=lambda messages: SimpleNamespace(
+        content=f"Có {len(messages)} tin nhắn\n\n```python\nprint(1)\n```"
+    )))
+    html = chat.get_chat_response("Chào", history=[{"role": "user", "content": "Hi"}])
+    assert "<p>Có 3 tin nhắn</p>" in html
+    assert 'class="highlight"' in html
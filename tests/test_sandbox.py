@@ -0,0 +1,73 @@
+import pytest
+
+from app.config import settings
+from app.sandbox import SandboxError, SandboxPool, execute_code, stream_code
+
+
+@pytest.fixture
+def pool():
+    pool = SandboxPool(size=1, max_jobs_per_worker=2, timeout=2)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def worker_pid(pool: SandboxPool) -> int:
+    return int(pool.run("import os\nprint(os.getpid(), end='')"))
+
+
+def test_code_runs_in_a_worker_process(pool):
+    assert pool.run("print(sum(range(10)))") == "45\n"
+    assert "ZeroDivisionError" in pool.run("1 / 0")
+
+
+def test_workers_are_recycled_after_max_jobs(pool):
+    first = worker_pid(pool)
+    assert worker_pid(pool) == first
+    assert worker_pid(pool) != first
+
+
+def test_timed_out_worker_is_replaced(pool):
+    pool.timeout = 0.5
+    first = worker_pid(pool)
+    with pytest.raises(SandboxError, match="TimeoutError"):
+        pool.run("while True: pass")
+    assert worker_pid(pool) != first
+
+
+def test_crashed_worker_is_replaced(pool):
+    with pytest.raises(SandboxError, match="crashed"):
+        pool.run("import os\nos._exit(1)")
+    assert pool.run("print('ok')") == "ok\n"
+
+
+class FakeConn:
+    def __init__(self):
+        self.chunks = []
+
+    def send(self, message):
+        self.chunks.append(message)
+
+
+def test_output_is_capped(monkeypatch):
+    monkeypatch.setattr(settings, "SANDBOX_MAX_OUTPUT_CHARS", 10)
+    output = execute_code("while True: print('x' * 4)")
+    assert output == "xxxx\nxxxx\n\n... Output đã bị cắt vì vượt quá 10 ký tự."
+
+
+def test_streamed_output_is_capped(monkeypatch):
+    monkeypatch.setattr(settings, "SANDBOX_MAX_OUTPUT_CHARS", 10)
+    conn = FakeConn()
+    stream_code("import sys\nprint('abcdef')\nsys.stderr.write('ghijkl')\nprint('never')", None, conn)
+    assert "".join(text for _, stream, text in conn.chunks if stream == "stdout") == "abcdef\n"
+    stderr = "".join(text for _, stream, text in conn.chunks if stream == "stderr")
+    assert stderr.startswith("ghi\n... Output đã bị cắt")
+
+
+def test_chunks_are_streamed_by_the_pool(pool):
+    chunks = []
+    result = pool.run("import sys\nprint('out')\nsys.stderr.write('err')\n1 / 0", on_chunk=lambda *chunk: chunks.append(chunk))
+    assert result == ""
+    assert chunks[0] == ("stdout", "out\n")
+    assert chunks[1] == ("stderr", "err")
+    assert chunks[2][0] == "stderr" and "ZeroDivisionError" in chunks[2][1]
@@ -0,0 +1,40 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.scheduler import ExecutionScheduler, QueueFullError
+
+
+def test_rejects_jobs_beyond_the_queue():
+    async def run():
+        scheduler = ExecutionScheduler(concurrency=1, queue_size=1)
+        release = threading.Event()
+        running = asyncio.create_task(scheduler.submit(release.wait))
+        await asyncio.sleep(0.01)
+        waiting = asyncio.create_task(scheduler.submit(lambda: "queued"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(QueueFullError):
+            await scheduler.submit(lambda: "rejected")
+        release.set()
+        return (await running).value, (await waiting).value
+
+    assert asyncio.run(run()) == (True, "queued")
+
+
+def test_cancelled_caller_keeps_the_slot_until_the_job_finishes():
+    async def run():
+        scheduler = ExecutionScheduler(concurrency=1, queue_size=0)
+        release = threading.Event()
+        running = asyncio.create_task(scheduler.submit(release.wait))
+        await asyncio.sleep(0.01)
+        running.cancel()
+        await asyncio.gather(running, return_exceptions=True)
+        # Thread vẫn chạy nên slot chưa được trả
+        with pytest.raises(QueueFullError):
+            await scheduler.submit(lambda: "rejected")
+        release.set()
+        await asyncio.sleep(0.05)
+        return (await scheduler.submit(lambda: "ok")).value
+
+    assert asyncio.run(run()) == "ok"
@@ -0,0 +1,115 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.llm_scheduler import LLMBusyError
+from app.streaming import ANSWER_RESET
+
+EXERCISE = {"description": "Viết hàm add(a, b).", "unit_test": "assert add(1, 2) == 3"}
+
+
+@pytest.fixture
+def client(main_module, monkeypatch):
+    monkeypatch.setattr(main_module.llm_scheduler, "session_rate", 0)
+    monkeypatch.setattr(main_module.llm_scheduler, "ip_rate", 0)
+    return TestClient(main_module.app)
+
+
+@pytest.fixture
+def agent_calls(main_module, monkeypatch):
+    calls = []
+
+    async def get_agent_response(**kwargs):
+        calls.append(kwargs)
+        return f"answer {len(calls)}"
+
+    monkeypatch.setattr(main_module, "get_agent_response", get_agent_response)
+    return calls
+
+
+def stored_history(main_module, session_id):
+    session = main_module.session_store.get(session_id)
+    return session.history if session else None
+
+
+def test_unknown_session_asks_for_the_full_state(main_module, client, agent_calls):
+    response = client.post("/chat", json={"message": "hi", "session_id": "unknown"})
+    assert response.status_code == 409
+    assert agent_calls == []
+    assert stored_history(main_module, "unknown") is None
+
+
+def test_session_without_exercise_asks_for_the_full_state(main_module, client, agent_calls):
+    main_module.session_store.update("no-exercise", history=[{"role": "user", "content": "hello"}])
+    response = client.post("/chat", json={"message": "hi", "session_id": "no-exercise"})
+    assert response.status_code == 409
+    assert agent_calls == []
+
+
+def test_full_state_then_deltas(main_module, client, agent_calls):
+    response = client.post("/chat", json={
+        "message": "hi", "session_id": "delta", "history": [], "exercise": EXERCISE, "code": "x = 1",
+    })
+    assert response.json() == {"response": "answer 1"}
+
+    response = client.post("/chat", json={"message": "and now?", "session_id": "delta"})
+    assert response.json() == {"response": "answer 2"}
+    # Request chỉ gửi tin nhắn mới, phần còn lại lấy từ session
+    assert agent_calls[1]["code"] == "x = 1"
+    assert agent_calls[1]["exercise"] == EXERCISE
+    assert agent_calls[1]["history"] == [
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "answer 1"},
+        {"role": "user", "content": "and now?"},
+    ]
+    assert stored_history(main_module, "delta") == agent_calls[1]["history"] + [{"role": "assistant", "content": "answer 2"}]
+
+
+def test_failed_request_leaves_no_unanswered_message(main_module, client, monkeypatch):
+    async def busy(**kwargs):
+        raise LLMBusyError("busy")
+
+    monkeypatch.setattr(main_module, "get_agent_response", busy)
+    response = client.post("/chat", json={"message": "hi", "session_id": "busy", "history": [], "exercise": EXERCISE})
+    assert response.status_code == 503
+    assert stored_history(main_module, "busy") == []
+
+
+def test_code_evaluation_stores_only_the_answer(main_module, client, agent_calls):
+    client.post("/chat", json={"message": "hi", "session_id": "evaluation", "history": [], "exercise": EXERCISE})
+    client.post("/chat", json={"message": "evaluate", "session_id": "evaluation", "is_code_evaluation": True})
+    assert agent_calls[1]["history"] == []
+    assert [message["content"] for message in stored_history(main_module, "evaluation")] == ["hi", "answer 1", "answer 2"]
+
+
+
+def test_rejected_requests_do_not_use_up_the_rate_limit(main_module, client, agent_calls, monkeypatch):
+    monkeypatch.setattr(main_module.llm_scheduler, "session_rate", 0.001)
+    monkeypatch.setattr(main_module.llm_scheduler, "session_burst", 1)
+    for _ in range(2):
+        assert client.post("/chat", json={"message": "hi", "session_id": "limited"}).status_code == 409
+        assert client.post("/test_code", json={"message": "", "session_id": "limited"}).status_code == 409
+        response = client.post(
+            "/theory_chat", json={"message": "hi", "session_id": "limited", "history": [], "lesson_id": "missing"}
+        )
+        assert response.status_code == 404
+    response = client.post("/chat", json={"message": "hi", "session_id": "limited", "history": [], "exercise": EXERCISE})
+    assert response.status_code == 200
+    response = client.post("/chat", json={"message": "again", "session_id": "limited"})
+    assert response.status_code == 429
+
+
+
+
+def test_stream_stores_the_answer_after_a_reset(main_module, client, monkeypatch):
+    async def stream_agent_response(**kwargs):
+        for text in ("rejected", ANSWER_RESET, "final", " answer"):
+            yield text
+
+    monkeypatch.setattr(main_module, "stream_agent_response", stream_agent_response)
+    response = client.post("/chat/stream", json={"message": "hi", "session_id": "stream", "history": [], "exercise": EXERCISE})
+    assert "event: reset" in response.text
+    assert '"response": "final answer"' in response.text
+    assert stored_history(main_module, "stream") == [
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "final answer"},
+    ]
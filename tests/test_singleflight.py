@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from app.singleflight import Singleflight
+
+
+def test_do_coalesces_identical_calls():
+    async def run():
+        flight = Singleflight()
+        calls = 0
+
+        async def factory():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*(flight.do("chat", "key", factory) for _ in range(5)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(run())
+    assert calls == 1
+    assert results == ["answer"] * 5
+    assert flight.stats()["chat"] == {"upstream_calls": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_do_runs_different_keys_separately():
+    async def run():
+        flight = Singleflight()
+
+        async def factory(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        return await asyncio.gather(flight.do("chat", "a", lambda: factory("a")), flight.do("chat", "b", lambda: factory("b")))
+
+    assert asyncio.run(run()) == ["a", "b"]
+
+
+def test_do_propagates_errors_to_every_caller_and_forgets_the_call():
+    async def run():
+        flight = Singleflight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream failed")
+
+        results = await asyncio.gather(*(flight.do("chat", "key", failing) for _ in range(3)), return_exceptions=True)
+        # Call lỗi không được giữ lại: lần gọi sau chạy lại từ đầu
+        retry = await flight.do("chat", "key", lambda: asyncio.sleep(0, result="ok"))
+        return results, retry
+
+    results, retry = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert retry == "ok"
+
+
+def test_do_keeps_running_when_one_caller_is_cancelled():
+    async def run():
+        flight = Singleflight()
+
+        async def factory():
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        first = asyncio.create_task(flight.do("chat", "key", factory))
+        second = asyncio.create_task(flight.do("chat", "key", factory))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first
+
+    result, first = asyncio.run(run())
+    assert result == "answer"
+    assert first.cancelled()
+
+
+def test_stream_replays_chunks_to_late_subscribers():
+    async def run():
+        flight = Singleflight()
+        calls = 0
+
+        async def source():
+            nonlocal calls
+            calls += 1
+            for chunk in ("a", "b", "c"):
+                await asyncio.sleep(0.01)
+                yield chunk
+
+        async def collect():
+            return [chunk async for chunk in flight.stream("theory_chat", "key", source)]
+
+        first = asyncio.create_task(collect())
+        await asyncio.sleep(0.015)
+        second = asyncio.create_task(collect())
+        return calls, await first, await second
+
+    calls, first, second = asyncio.run(run())
+    assert calls == 1
+    assert first == second == ["a", "b", "c"]
+
+
+def test_stream_propagates_errors_after_the_chunks():
+    async def run():
+        flight = Singleflight()
+
+        async def source():
+            yield "a"
+            raise ValueError("upstream failed")
+
+        chunks = []
+        with pytest.raises(ValueError, match="upstream failed"):
+            async for chunk in flight.stream("theory_chat", "key", source):
+                chunks.append(chunk)
+        return chunks
+
+    assert asyncio.run(run()) == ["a"]
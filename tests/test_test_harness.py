@@ -0,0 +1,68 @@
+from app.sandbox import execute_unit_tests
+from app.test_harness import discover_test_methods, merge_reports
+
+CODE = "print('code chạy')\ndef add(a, b):\n    return a + b\n"
+
+
+def test_discovery_resolves_aliases_and_inherited_methods():
+    unit_test = (
+        "import unittest as ut\n"
+        "from unittest import TestCase as Base\n"
+        "Case = ut.TestCase\n"
+        "class Mixin:\n"
+        "    def test_mixin(self): pass\n"
+        "class First(Mixin, Case):\n"
+        "    def test_first(self): pass\n"
+        "class Second(First):\n"
+        "    def test_second(self): pass\n"
+        "class Third(Base):\n"
+        "    test_third = First.test_first\n"
+        "    def helper(self): pass\n"
+    )
+    assert discover_test_methods(unit_test) == ["test_mixin", "test_first", "test_second", "test_third"]
+
+
+def test_discovery_gives_up_when_a_base_is_unknown():
+    # Base định nghĩa trong code của học viên: không biết có phải TestCase hay không
+    assert discover_test_methods("class TestAdd(StudentBase):\n    def test_add(self): pass\n") == []
+    assert discover_test_methods("import unittest\n@decorate\nclass T(unittest.TestCase):\n    def test_a(self): pass\n") == []
+    assert discover_test_methods("def broken(:\n") == []
+
+
+def test_helper_classes_do_not_make_discovery_give_up():
+    unit_test = (
+        "import unittest\n"
+        "class Helper(Exception): pass\n"
+        "class TestAdd(unittest.TestCase):\n"
+        "    def test_a(self): pass\n"
+        "    def test_b(self): pass\n"
+    )
+    assert discover_test_methods(unit_test) == ["test_a", "test_b"]
+
+
+def test_merged_groups_print_module_level_output_once():
+    unit_test = (
+        "import unittest\n"
+        "print('unit test chạy')\n"
+        "class TestAdd(unittest.TestCase):\n"
+        "    def test_a(self):\n"
+        "        print('a')\n"
+        "        self.assertEqual(add(1, 2), 3)\n"
+        "    def test_b(self):\n"
+        "        print('b')\n"
+        "        self.assertEqual(add(2, 2), 5)\n"
+    )
+    names = discover_test_methods(unit_test)
+    reports = [execute_unit_tests(CODE, unit_test, [name]) for name in reversed(names)]
+    merged = merge_reports(reports, names)
+    assert merged["output"] == "code chạy\nunit test chạy\nb\na\n"
+    assert [result["name"] for result in merged["results"]] == ["test_a", "test_b"]
+    assert merged["failed"] == 1
+    assert "setup_output" not in merged
+
+
+def test_single_run_reports_have_no_setup_output():
+    report = execute_unit_tests(CODE, "import unittest\nclass T(unittest.TestCase):\n    def test_a(self): pass\n")
+    assert report["passed"]
+    assert report["output"] == "code chạy\n"
+    assert "setup_output" not in report
@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from app import agent
+from app.tracing import RequestIdMiddleware, Span, TraceStore, TracingCallbackHandler, record_event, trace_store
+
+
+def span(name: str, started_at: float = 0.0) -> Span:
+    return Span(name=name, kind="tool", started_at=started_at, duration_ms=1.0)
+
+
+def test_store_keeps_the_newest_requests_and_caps_spans():
+    store = TraceStore(maxsize=2, max_spans=2)
+    for request_id in ("a", "b", "c"):
+        store.record(request_id, span("first"))
+    store.record("c", span("second"))
+    store.record("c", span("third"))
+    assert "a" not in store
+    assert [item["name"] for item in store.get("c")] == ["first", "second"]
+    assert store.dropped == 1
+    assert [summary["request_id"] for summary in store.recent()] == ["c", "b"]
+
+
+def test_spans_are_appended_to_the_trace_file(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    store = TraceStore(maxsize=10, max_spans=10, path=str(path))
+    store.start()
+    store.record("a", span("read_code"))
+    store.shutdown()
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [(line["request_id"], line["name"]) for line in lines] == [("a", "read_code")]
+
+
+def test_agent_steps_are_recorded_as_spans():
+    llm = GenericFakeChatModel(messages=iter([
+        AIMessage(content="Trả lời sai định dạng"),
+        AIMessage(content="Thought: Cần xem code.\nAction: read_code\nAction Input: code"),
+        AIMessage(content="Thought: Xong.\nFinal Answer: Đúng rồi."),
+    ]))
+    executor = agent.build_executor(agent.chat_prompt, llm)
+    inputs = {"input": "Code đúng không?", "chat_history": "", **{field: "" for field in agent.EXERCISE_FIELDS}}
+    asyncio.run(executor.ainvoke(inputs, config={"callbacks": [TracingCallbackHandler("agent-trace")]}))
+
+    spans = trace_store.get("agent-trace")
+    assert [item["kind"] for item in spans] == ["agent", "llm", "parse_error", "llm", "tool", "llm"]
+    assert spans[0]["attributes"]["iterations"] == 2
+    assert spans[4]["name"] == "read_code"
+
+
+def test_request_ids_are_returned_and_traced_requests_get_an_http_span():
+    app = FastAPI()
+
+    @app.get("/traced")
+    async def traced():
+        record_event("fallback", "fallback")
+        return {}
+
+    @app.get("/plain")
+    async def plain():
+        return {}
+
+    client = TestClient(RequestIdMiddleware(app))
+    response = client.get("/traced", headers={"X-Request-ID": "trace-http"})
+    assert response.headers["x-request-id"] == "trace-http"
+    assert [item["kind"] for item in trace_store.get("trace-http")] == ["http", "fallback"]
+    assert trace_store.get("trace-http")[0]["attributes"] == {"status": 200}
+
+    response = client.get("/plain", headers={"X-Request-ID": "bad id!"})
+    assert response.headers["x-request-id"] != "bad id!"
+    assert response.headers["x-request-id"] not in trace_store